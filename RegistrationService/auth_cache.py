@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+from models import User
+from config import USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_SIZE
+
+
+class PrincipalCache:
+    """Bounded in-process cache of authenticated users keyed on the token's `sub`"""
+
+    def __init__(self, max_size: int = USER_CACHE_MAX_SIZE, ttl_seconds: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, username: str) -> Optional[User]:
+        entry = self._entries.get(username)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            # Expired entries count as a miss so the caller reloads from Mongo
+            del self._entries[username]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return user
+
+    def put(self, username: str, user: User):
+        if self.max_size <= 0:
+            return
+        self._entries[username] = (user, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, username: str):
+        """Drop a cached user, e.g. after it was deactivated or changed"""
+        self._entries.pop(username, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,169 @@
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from models import Patient
+from utils import bson_dates
+from dedup import add_dedup_keys
+
+BULK_BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
+
+# A parsed row, or the error raised while parsing it, tagged with its 0-based position
+Row = Tuple[int, Union[Dict[str, Any], Exception]]
+
+
+def _validate(row: Dict[str, Any]) -> Patient:
+    # UIDs are always assigned by the server, so any client-supplied value is ignored
+    return Patient(**{**row, "patient_uid": 0})
+
+
+async def insert_patient_batch(patients_collection, uid_allocator, batch: List[Row],
+                               on_inserted: Optional[Callable[[Dict[str, Any]], Any]] = None):
+    """Validate and insert one batch; returns (inserted rows, per-row errors, batch failure).
+
+    A failure that isn't tied to particular rows (e.g. a lost connection) is recorded against every
+    row still pending and returned as the batch failure message, so callers can stop and report
+    what was already inserted. on_inserted, if given, is called with each stored patient document.
+    """
+    errors = []
+    valid: List[Tuple[int, Patient]] = []
+    for index, row in batch:
+        if isinstance(row, Exception):
+            errors.append({"row": index, "error": str(row)})
+            continue
+        try:
+            valid.append((index, _validate(row)))
+        except (ValidationError, TypeError) as e:
+            errors.append({"row": index, "error": str(e)})
+
+    inserted = []
+    pending = valid
+    # The allocator never repeats a UID; only a clash with a legacy random UID is retried
+    for attempt in range(3):
+        if not pending:
+            break
+        failed = {}
+        try:
+            uids = await uid_allocator.allocate(len(pending))
+            documents = []
+            for (index, patient), uid in zip(pending, uids):
+                patient.patient_uid = uid
+                documents.append(bson_dates(add_dedup_keys(patient.dict(by_alias=True))))
+            await patients_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed[write_error["index"]] = write_error
+        except Exception as e:
+            # Rows of an unordered insert_many interrupted this way may or may not have been written
+            errors.extend({"row": index, "error": f"Batch failed: {e}"} for index, _ in pending)
+            return inserted, errors, str(e)
+
+        retry = []
+        for position, (index, patient) in enumerate(pending):
+            write_error = failed.get(position)
+            if write_error is None:
+                inserted.append({"row": index, "patient_uid": documents[position]["patient_uid"]})
+                if on_inserted is not None:
+                    on_inserted(documents[position])
+            elif write_error.get("code") == DUPLICATE_KEY_ERROR and attempt < 2:
+                retry.append((index, patient))
+            else:
+                errors.append({"row": index, "error": write_error.get("errmsg", "Write failed")})
+        pending = retry
+
+    return inserted, errors, None
+
+
+async def bulk_register_patients(patients_collection, uid_allocator, rows: Union[AsyncIterator[Row], Iterable[Row]],
+                                 batch_size: int = BULK_BATCH_SIZE,
+                                 on_inserted: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Dict[str, Any]:
+    """Register patients from a stream of rows in unordered insert_many batches.
+
+    If a batch fails as a whole, the import stops there: the result still lists every patient
+    inserted so far, plus `aborted` (the error) and `resume_from_row` (the failed batch's first row).
+    """
+    inserted: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    batch: List[Row] = []
+    aborted = None
+    resume_from_row = None
+
+    async def flush():
+        nonlocal aborted, resume_from_row
+        batch_inserted, batch_errors, failure = await insert_patient_batch(
+            patients_collection, uid_allocator, batch, on_inserted
+        )
+        inserted.extend(batch_inserted)
+        errors.extend(batch_errors)
+        if failure is not None:
+            aborted, resume_from_row = failure, batch[0][0]
+        batch.clear()
+
+    if hasattr(rows, "__aiter__"):
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                await flush()
+                if aborted:
+                    break
+    else:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                await flush()
+                if aborted:
+                    break
+    if batch and not aborted:
+        await flush()
+
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "inserted": len(inserted),
+        "failed": len(errors),
+        "patients": inserted,
+        "errors": errors,
+        "aborted": aborted,
+        "resume_from_row": resume_from_row
+    }
+
+
+def _parse_line(index: int, line: Union[str, bytes]) -> Row:
+    try:
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("Each line must be a JSON object")
+        return index, row
+    except ValueError as e:
+        return index, e
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Split a streamed NDJSON body into rows without buffering the whole body"""
+    buffer = b""
+    index = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_line(index, line)
+                index += 1
+    if buffer.strip():
+        yield _parse_line(index, buffer)
+
+
+def iter_ndjson_lines(lines: Iterable[str]) -> Iterable[Row]:
+    index = 0
+    for line in lines:
+        if line.strip():
+            yield _parse_line(index, line)
+            index += 1
+
+
+def iter_json_array(items: List[Any]) -> Iterable[Row]:
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            yield index, item
+        else:
+            yield index, ValueError("Each item must be a JSON object")
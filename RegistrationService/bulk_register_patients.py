@@ -0,0 +1,41 @@
+import asyncio
+import json
+import sys
+from database import connect_to_mongo, get_patients_collection, get_stats_collection, get_patient_uid_allocator
+from bulk_import import bulk_register_patients, iter_ndjson_lines, iter_json_array
+from stats import record_patients_registered
+
+async def bulk_register(path: str):
+    """Register patients from a JSON array (.json) or NDJSON (.ndjson/.jsonl) file"""
+    try:
+        await connect_to_mongo()
+        
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                rows = iter_json_array(json.load(f))
+            else:
+                rows = iter_ndjson_lines(f)
+            result = await bulk_register_patients(get_patients_collection(), get_patient_uid_allocator(), rows)
+        
+        if result["inserted"]:
+            await record_patients_registered(get_stats_collection(), result["inserted"])
+        
+        print(f"✅ Inserted {result['inserted']} patients")
+        if result["failed"]:
+            print(f"❌ {result['failed']} rows failed:")
+            for error in result["errors"][:20]:
+                print(f"  Row {error['row']}: {error['error']}")
+            if result["failed"] > 20:
+                print(f"  ... and {result['failed'] - 20} more")
+        if result["aborted"]:
+            print(f"❌ Import stopped: {result['aborted']}")
+            print(f"   Rows before {result['resume_from_row']} are done; re-run with the rest of the file from there")
+            
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python bulk_register_patients.py <patients.json|patients.ndjson>")
+        sys.exit(1)
+    asyncio.run(bulk_register(sys.argv[1]))
@@ -19,3 +19,94 @@ PORT = int(os.getenv("PORT", "8000"))
 APP_NAME = "Hospital Management System"
 VERSION = "2.0.0"
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+
+# Authenticated user cache
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "1024"))
+
+# Drop indexes that are not declared in indexes.py when reconciling at startup (off by default so
+# indexes created by operators survive restarts)
+DROP_UNDECLARED_INDEXES = os.getenv("DROP_UNDECLARED_INDEXES", "False").lower() == "true"
+
+# Live queue streaming
+QUEUE_STREAM_BUFFER_SIZE = int(os.getenv("QUEUE_STREAM_BUFFER_SIZE", "100"))
+# Publish queue deltas from a Mongo change stream (requires a replica set, e.g. Atlas)
+QUEUE_CHANGE_STREAM = os.getenv("QUEUE_CHANGE_STREAM", "False").lower() == "true"
+
+# Dashboard counters are maintained incrementally and recounted on this interval
+STATS_RECONCILE_INTERVAL_SECONDS = float(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "300"))
+# Per-day appointment counters older than this many days (UTC) are dropped at reconciliation
+STATS_DAYS_KEPT = int(os.getenv("STATS_DAYS_KEPT", "7"))
+
+# Patient UID sequence numbers reserved per round-trip by each worker
+PATIENT_UID_BLOCK_SIZE = int(os.getenv("PATIENT_UID_BLOCK_SIZE", "100"))
+
+# Durable storage for the in-memory backend (database_simple); empty keeps it memory-only
+SIMPLE_DB_DATA_DIR = os.getenv("SIMPLE_DB_DATA_DIR", "")
+SIMPLE_DB_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SIMPLE_DB_SNAPSHOT_INTERVAL_SECONDS", "300"))
+SIMPLE_DB_FSYNC = os.getenv("SIMPLE_DB_FSYNC", "False").lower() == "true"
+
+# Store vitals in a MongoDB time-series collection (applies when the collection is first created)
+VITALS_TIMESERIES = os.getenv("VITALS_TIMESERIES", "False").lower() == "true"
+VITALS_TIMESERIES_GRANULARITY = os.getenv("VITALS_TIMESERIES_GRANULARITY", "minutes")
+
+# Batched device vitals ingestion
+VITALS_INGEST_QUEUE_SIZE = int(os.getenv("VITALS_INGEST_QUEUE_SIZE", "10000"))
+VITALS_INGEST_BATCH_SIZE = int(os.getenv("VITALS_INGEST_BATCH_SIZE", "500"))
+VITALS_INGEST_FLUSH_INTERVAL_MS = float(os.getenv("VITALS_INGEST_FLUSH_INTERVAL_MS", "200"))
+VITALS_INGEST_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("VITALS_INGEST_ENQUEUE_TIMEOUT_SECONDS", "5"))
+
+# MongoDB client pool, timeouts and wire compression
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+# 0 disables the socket timeout
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+# Preference order; compressors whose Python package is not installed are skipped
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+# Read preference for read-only analytics endpoints (dashboard, export, series, early warning)
+MONGO_ANALYTICS_READ_PREFERENCE = os.getenv("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+
+# Structured JSON logging (written from a background thread) and per-request access log lines
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+ACCESS_LOG = os.getenv("ACCESS_LOG", "True").lower() == "true"
+
+# Queue call order: priority, then arrival; every this many minutes waited moves a patient up one
+# priority level, at most QUEUE_PRIORITY_MAX_PROMOTION levels and never into URGENT
+QUEUE_PRIORITY_AGING_MINUTES = float(os.getenv("QUEUE_PRIORITY_AGING_MINUTES", "15"))
+QUEUE_PRIORITY_MAX_PROMOTION = int(os.getenv("QUEUE_PRIORITY_MAX_PROMOTION", "1"))
+# Without QUEUE_CHANGE_STREAM, each worker reloads its call order from Mongo this often
+QUEUE_ENGINE_REFRESH_SECONDS = float(os.getenv("QUEUE_ENGINE_REFRESH_SECONDS", "5"))
+
+# Wait-time estimates: moving average of consultation time per doctor
+WAIT_ESTIMATE_EWMA_ALPHA = float(os.getenv("WAIT_ESTIMATE_EWMA_ALPHA", "0.2"))
+WAIT_ESTIMATE_DEFAULT_SERVICE_MINUTES = float(os.getenv("WAIT_ESTIMATE_DEFAULT_SERVICE_MINUTES", "30"))
+WAIT_ESTIMATE_DEBOUNCE_SECONDS = float(os.getenv("WAIT_ESTIMATE_DEBOUNCE_SECONDS", "1"))
+WAIT_ESTIMATE_HISTORY_DAYS = float(os.getenv("WAIT_ESTIMATE_HISTORY_DAYS", "14"))
+
+# Appointment slots expanded from doctors' working hours; searches look this many days ahead
+APPOINTMENT_SLOT_MINUTES = int(os.getenv("APPOINTMENT_SLOT_MINUTES", "30"))
+SCHEDULER_HORIZON_DAYS = int(os.getenv("SCHEDULER_HORIZON_DAYS", "14"))
+# How often to pick up slots reserved or released through other workers
+SCHEDULER_REFRESH_SECONDS = float(os.getenv("SCHEDULER_REFRESH_SECONDS", "5"))
+
+# Patient search index: how often to pick up patients registered through other workers
+PATIENT_SEARCH_REFRESH_SECONDS = float(os.getenv("PATIENT_SEARCH_REFRESH_SECONDS", "5"))
+# Each refresh re-reads patients created this long before the newest one indexed, since created_at is stamped
+# by whichever worker or import validated the row and can arrive out of order
+PATIENT_SEARCH_REFRESH_OVERLAP_SECONDS = float(os.getenv("PATIENT_SEARCH_REFRESH_OVERLAP_SECONDS", "300"))
+
+# Duplicate patient detection: minimum name similarity (0-1) for a patient sharing the date of birth or phone
+# to count as a duplicate, and the time registration may spend looking for one
+DEDUP_NAME_THRESHOLD = float(os.getenv("DEDUP_NAME_THRESHOLD", "0.8"))
+DEDUP_BUDGET_MS = float(os.getenv("DEDUP_BUDGET_MS", "50"))
+DEDUP_MAX_CANDIDATES = int(os.getenv("DEDUP_MAX_CANDIDATES", "500"))
+# The offline duplicate scan splits blocks larger than this by name initial, and skips sub-blocks still larger
+DEDUP_MAX_BLOCK_SIZE = int(os.getenv("DEDUP_MAX_BLOCK_SIZE", "20000"))
+
+# Failed vitals ingest batches are retried with exponential backoff, then appended to this NDJSON file
+VITALS_INGEST_MAX_RETRIES = int(os.getenv("VITALS_INGEST_MAX_RETRIES", "3"))
+VITALS_INGEST_RETRY_BACKOFF_SECONDS = float(os.getenv("VITALS_INGEST_RETRY_BACKOFF_SECONDS", "0.5"))
+VITALS_INGEST_DEAD_LETTER_PATH = os.getenv("VITALS_INGEST_DEAD_LETTER_PATH", "vitals_dead_letter.ndjson")
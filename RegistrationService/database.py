@@ -1,11 +1,25 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 from typing import Optional
 import asyncio
-from models import User, Patient, Appointment, Vitals, Queue, Doctor, RoleEnum, generate_patient_uid
-from security import get_password_hash
+import secrets
+from models import User, Patient, Appointment, Vitals, Queue, Doctor, RoleEnum
+from security import get_password_hash_async
+from utils import format_queue_row
+from indexes import reconcile_indexes
+from uid_allocator import PatientUIDAllocator
+from auth_cache import principal_cache
+from pool_metrics import pool_metrics
+from metrics import command_metrics
+from pymongo import read_preferences
+from config import (
+    DROP_UNDECLARED_INDEXES, VITALS_TIMESERIES, VITALS_TIMESERIES_GRANULARITY,
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_COMPRESSORS, MONGO_ANALYTICS_READ_PREFERENCE
+)
 
 load_dotenv()
 
@@ -16,6 +30,42 @@ DATABASE_NAME = os.getenv("DATABASE_NAME", "hospital_management")
 # Global client instance
 client: Optional[AsyncIOMotorClient] = None
 database = None
+analytics_database = None
+
+# Python packages the driver needs for each wire compressor (zlib is built in)
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+def available_compressors(names: str):
+    """The configured compressors whose Python package can be imported, in preference order"""
+    available = []
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        module = COMPRESSOR_MODULES.get(name)
+        try:
+            if module is None:
+                raise ImportError(name)
+            __import__(module)
+            available.append(name)
+        except ImportError:
+            print(f"⚠️ Skipping MongoDB wire compressor '{name}' (not available)")
+    return available
+
+def client_options():
+    """Keyword arguments for the Motor client, from config.py"""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+        "event_listeners": [pool_metrics, command_metrics]
+    }
+    compressors = available_compressors(MONGO_COMPRESSORS)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
 
 async def get_database():
     """Get database instance"""
@@ -26,16 +76,24 @@ async def get_database():
 
 async def connect_to_mongo():
     """Create database connection"""
-    global client, database
+    global client, database, analytics_database
     try:
-        client = AsyncIOMotorClient(MONGODB_URL)
+        client = AsyncIOMotorClient(MONGODB_URL, **client_options())
+        pool_metrics.max_pool_size = MONGO_MAX_POOL_SIZE
         database = client[DATABASE_NAME]
+        analytics_database = client.get_database(
+            DATABASE_NAME,
+            read_preference=read_preferences.make_read_preference(
+                read_preferences.read_pref_mode_from_name(MONGO_ANALYTICS_READ_PREFERENCE), None
+            )
+        )
         
         # Test the connection
         await client.admin.command('ping')
         print("Successfully connected to MongoDB Cloud Atlas!")
         
         # Create indexes
+        await create_vitals_collection()
         await create_indexes()
         
     except Exception as e:
@@ -48,58 +106,24 @@ async def close_mongo_connection():
     if client:
         client.close()
 
+async def create_vitals_collection():
+    """Create vitals as a time-series collection when enabled; an existing collection is left as is"""
+    if not VITALS_TIMESERIES:
+        return
+    if "vitals" in await database.list_collection_names(filter={"name": "vitals"}):
+        return
+    await database.create_collection("vitals", timeseries={
+        "timeField": "recorded_at",
+        "metaField": "patient_uid",
+        "granularity": VITALS_TIMESERIES_GRANULARITY
+    })
+    print("Created vitals time-series collection")
+
 async def create_indexes():
-    """Create database indexes for better performance"""
+    """Reconcile database indexes with the declarations in indexes.py"""
     try:
-        # Users collection indexes
-        await database.users.create_indexes([
-            IndexModel([("username", ASCENDING)], unique=True),
-            IndexModel([("role", ASCENDING)]),
-            IndexModel([("is_active", ASCENDING)])
-        ])
-        
-        # Patients collection indexes
-        await database.patients.create_indexes([
-            IndexModel([("patient_uid", ASCENDING)], unique=True),
-            IndexModel([("contact_number", ASCENDING)]),
-            IndexModel([("created_at", DESCENDING)])
-        ])
-        
-        # Appointments collection indexes
-        await database.appointments.create_indexes([
-            IndexModel([("patient_uid", ASCENDING)]),
-            IndexModel([("doctor_id", ASCENDING)]),
-            IndexModel([("appointment_time", ASCENDING)]),
-            IndexModel([("status", ASCENDING)]),
-            IndexModel([("queue_token", ASCENDING)], unique=True),
-            IndexModel([("created_at", DESCENDING)])
-        ])
-        
-        # Vitals collection indexes
-        await database.vitals.create_indexes([
-            IndexModel([("patient_uid", ASCENDING)]),
-            IndexModel([("recorded_by", ASCENDING)]),
-            IndexModel([("recorded_at", DESCENDING)])
-        ])
-        
-        # Queue collection indexes
-        await database.queue.create_indexes([
-            IndexModel([("doctor_id", ASCENDING)]),
-            IndexModel([("status", ASCENDING)]),
-            IndexModel([("priority", ASCENDING)]),
-            IndexModel([("queue_number", ASCENDING)]),
-            IndexModel([("created_at", ASCENDING)])
-        ])
-        
-        # Doctors collection indexes
-        await database.doctors.create_indexes([
-            IndexModel([("doctor_id", ASCENDING)], unique=True),
-            IndexModel([("specialization", ASCENDING)]),
-            IndexModel([("department", ASCENDING)]),
-            IndexModel([("is_available", ASCENDING)])
-        ])
-        
-        print("Database indexes created successfully!")
+        await reconcile_indexes(database, drop_undeclared=DROP_UNDECLARED_INDEXES)
+        print("Database indexes reconciled successfully!")
         
     except Exception as e:
         print(f"Error creating indexes: {e}")
@@ -134,10 +158,11 @@ async def initialize_default_data():
             if not existing_user:
                 user = User(
                     username=user_data["username"],
-                    hashed_password=get_password_hash(user_data["password"]),
+                    hashed_password=await get_password_hash_async(user_data["password"]),
                     role=user_data["role"]
                 )
                 await database.users.insert_one(user.dict(by_alias=True))
+                principal_cache.invalidate(user.username)
                 print(f"Created {user_data['role']} user: {user_data['username']}")
         
         # Check if any doctors exist, if not create a sample doctor
@@ -162,6 +187,71 @@ async def initialize_default_data():
     except Exception as e:
         print(f"Error initializing default data: {e}")
 
+async def allocate_queue_number(doctor_id: str, day: str) -> int:
+    """Atomically issue the next queue number for a doctor on a given day"""
+    counter = await database.counters.find_one_and_update(
+        {"_id": f"queue:{doctor_id}:{day}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+async def reserve_patient_uid_block(count: int):
+    """Reserve `count` patient UID sequence numbers shared by all workers"""
+    for attempt in range(2):
+        try:
+            # The permutation key is generated once, on the counter's first upsert
+            counter = await database.counters.find_one_and_update(
+                {"_id": "patient_uid"},
+                {"$inc": {"seq": count}, "$setOnInsert": {"key": secrets.token_hex(16)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return counter["seq"] - count, bytes.fromhex(counter["key"])
+        except DuplicateKeyError:
+            # Another worker created the counter concurrently; retry as a plain update
+            if attempt:
+                raise
+
+patient_uid_allocator = PatientUIDAllocator(reserve_patient_uid_block)
+
+def get_patient_uid_allocator():
+    return patient_uid_allocator
+
+async def get_doctor_queue_details(doctor_id: str, limit: int = 100):
+    """Doctor's queue joined with patient names and appointment times in one round-trip"""
+    pipeline = [
+        {"$match": {"doctor_id": doctor_id}},
+        {"$sort": {"queue_day": 1, "queue_number": 1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "patients",
+            "localField": "patient_uid",
+            "foreignField": "patient_uid",
+            "as": "patient"
+        }},
+        {"$lookup": {
+            "from": "appointments",
+            "localField": "appointment_id",
+            "foreignField": "_id",
+            "as": "appointment"
+        }},
+        {"$project": {
+            "_id": 0,
+            "queue_number": 1,
+            "patient_uid": 1,
+            "status": 1,
+            "priority": 1,
+            "created_at": 1,
+            "first_name": {"$arrayElemAt": ["$patient.first_name", 0]},
+            "last_name": {"$arrayElemAt": ["$patient.last_name", 0]},
+            "appointment_time": {"$arrayElemAt": ["$appointment.appointment_time", 0]}
+        }}
+    ]
+    rows = await database.queue.aggregate(pipeline).to_list(length=limit)
+    return [format_queue_row(row) for row in rows]
+
 # Collection getters
 def get_users_collection():
     return database.users
@@ -180,3 +270,13 @@ def get_queue_collection():
 
 def get_doctors_collection():
     return database.doctors
+
+def get_stats_collection():
+    return database.stats
+
+def get_slot_reservations_collection():
+    return database.slot_reservations
+
+def get_analytics_database():
+    """Database handle for read-only analytics queries, routed by MONGO_ANALYTICS_READ_PREFERENCE"""
+    return analytics_database
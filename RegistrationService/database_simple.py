@@ -1,17 +1,61 @@
 # Simple in-memory database for testing
 from typing import Dict, List, Any
 import asyncio
+import secrets
 from datetime import datetime
 from models import User, Patient, Appointment, Vitals, Queue, Doctor, RoleEnum
 from security import get_password_hash
+from utils import format_queue_row
+from uid_allocator import PatientUIDAllocator
+from memory_store import IndexedCollection, field, date_of
+from dedup import normalize_phone
+from persistence import DurableStore, run_snapshots
+from config import SIMPLE_DB_DATA_DIR, SIMPLE_DB_SNAPSHOT_INTERVAL_SECONDS, SIMPLE_DB_FSYNC
 
-# In-memory storage
-users_db: Dict[str, Dict] = {}
-patients_db: Dict[int, Dict] = {}
-appointments_db: Dict[str, Dict] = {}
-vitals_db: Dict[str, Dict] = {}
-queue_db: Dict[str, Dict] = {}
-doctors_db: Dict[str, Dict] = {}
+# In-memory storage, with secondary indexes on the fields the API looks documents up by
+users_db = IndexedCollection()
+# Duplicate detection blocks on date of birth or normalized phone, as with Mongo; the phone key
+# is derived from contact_number so records stored before contact_digits existed are found too
+PATIENT_INDEXES = {
+    "dob": date_of("dob"),
+    "contact_digits": lambda patient: normalize_phone(patient.get("contact_number")) or None
+}
+patients_db = IndexedCollection(PATIENT_INDEXES)
+appointments_db = IndexedCollection({
+    "_id": field("_id"),
+    "patient_uid": field("patient_uid"),
+    "doctor_id": field("doctor_id"),
+    "status": field("status"),
+    "appointment_date": date_of("appointment_time")
+})
+vitals_db = IndexedCollection({
+    "patient_uid": field("patient_uid")
+})
+queue_db = IndexedCollection({
+    "patient_uid": field("patient_uid"),
+    "doctor_id": field("doctor_id"),
+    "status": field("status")
+})
+doctors_db = IndexedCollection()
+counters_db = IndexedCollection()
+
+# Write-ahead log + snapshots, enabled by setting SIMPLE_DB_DATA_DIR
+durable_store = None
+if SIMPLE_DB_DATA_DIR:
+    durable_store = DurableStore(SIMPLE_DB_DATA_DIR, {
+        "users": users_db,
+        "patients": patients_db,
+        "appointments": appointments_db,
+        "vitals": vitals_db,
+        "queue": queue_db,
+        "doctors": doctors_db,
+        "counters": counters_db
+    }, fsync=SIMPLE_DB_FSYNC)
+    restored = durable_store.restore()
+    durable_store.attach()
+    print(f"Restored in-memory database from {SIMPLE_DB_DATA_DIR}: "
+          f"{restored['snapshot_rows']} snapshot rows, {restored['replayed_records']} log records "
+          f"in {restored['seconds']:.2f}s")
 
 # Initialize with default users
 def initialize_default_users():
@@ -70,6 +114,43 @@ def get_queue_collection():
 def get_doctors_collection():
     return doctors_db
 
+async def get_doctor_queue_details(doctor_id: str, limit: int = 100):
+    """In-memory equivalent of the Mongo $lookup join used for queue printing"""
+    queue_items = sorted(
+        queue_db.find("doctor_id", doctor_id),
+        key=lambda q: (q.get("queue_day") or "", q["queue_number"])
+    )[:limit]
+    
+    appointments = {}
+    for appointment_id in {q.get("appointment_id") for q in queue_items}:
+        for appointment in appointments_db.find("_id", appointment_id):
+            appointments[appointment_id] = appointment
+    
+    rows = []
+    for queue_item in queue_items:
+        row = dict(queue_item)
+        patient_data = patients_db.get(queue_item["patient_uid"])
+        if patient_data:
+            row["first_name"] = patient_data.get("first_name", "")
+            row["last_name"] = patient_data.get("last_name", "")
+        appointment_data = appointments.get(queue_item.get("appointment_id"))
+        if appointment_data:
+            row["appointment_time"] = appointment_data.get("appointment_time")
+        rows.append(format_queue_row(row))
+    return rows
+
+async def reserve_patient_uid_block(count: int):
+    """Reserve `count` patient UID sequence numbers from the in-memory counter"""
+    counter = counters_db.get("patient_uid") or {"seq": 0, "key": secrets.token_hex(16)}
+    # Store a new document rather than mutating in place, so the change is logged
+    counters_db["patient_uid"] = {**counter, "seq": counter["seq"] + count}
+    return counter["seq"], bytes.fromhex(counter["key"])
+
+patient_uid_allocator = PatientUIDAllocator(reserve_patient_uid_block)
+
+def get_patient_uid_allocator():
+    return patient_uid_allocator
+
 # Simple database operations
 async def connect_to_mongo():
     """Mock connection for testing"""
@@ -85,3 +166,16 @@ async def close_mongo_connection():
     """Mock close connection"""
     print("Connection closed!")
     return True
+
+def start_snapshots():
+    """Start the periodic snapshot job when durable storage is enabled"""
+    if durable_store is None:
+        return None
+    return asyncio.create_task(run_snapshots(durable_store, SIMPLE_DB_SNAPSHOT_INTERVAL_SECONDS))
+
+async def close_durable_store():
+    """Compact the log into a final snapshot on shutdown"""
+    if durable_store is None:
+        return
+    await durable_store.snapshot()
+    durable_store.close()
@@ -0,0 +1,313 @@
+import asyncio
+import re
+import time
+from datetime import date, datetime, time as midnight
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from pymongo import UpdateOne
+from app_logging import logger
+from config import DEDUP_NAME_THRESHOLD, DEDUP_BUDGET_MS, DEDUP_MAX_CANDIDATES, DEDUP_MAX_BLOCK_SIZE
+
+NON_LETTER = re.compile(r"[^\w]|[\d_]")
+NON_DIGIT = re.compile(r"\D")
+
+# Character bigrams are hashed into this many buckets; collisions only ever raise similarity slightly
+NAME_VECTOR_SIZE = 256
+# Largest name similarity matrix built at once when scoring large blocks offline (float32 cells, 64 MB)
+PAIR_MATRIX_CELLS = 16 * 1024 * 1024
+# Members of one block read per query by the offline scan
+BLOCK_FETCH_SIZE = 10000
+BACKFILL_BATCH_SIZE = 1000
+DEDUP_PROJECTION = {"_id": 0, "patient_uid": 1, "first_name": 1, "last_name": 1, "dob": 1, "contact_number": 1}
+
+
+def normalize_name(first_name: Optional[str], last_name: Optional[str]) -> str:
+    """Lowercase letters of both names, each word padded with spaces so word edges form bigrams"""
+    words = [NON_LETTER.sub("", word) for word in f"{first_name or ''} {last_name or ''}".lower().split()]
+    return " " + " ".join(sorted(word for word in words if word)) + " "
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    # Compare on the last 10 digits so country-code and formatting variants still match
+    return NON_DIGIT.sub("", phone or "")[-10:]
+
+
+def add_dedup_keys(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Store the normalized phone next to contact_number, so differently formatted numbers block together"""
+    document["contact_digits"] = normalize_phone(document.get("contact_number"))
+    return document
+
+
+def normalize_dob(dob: Any) -> Any:
+    # Stored dates of birth may come back from Mongo as midnight datetimes
+    return dob.date() if isinstance(dob, datetime) else dob
+
+
+def name_vectors(names: Iterable[str]) -> np.ndarray:
+    """L2-normalized hashed bigram counts, one row per normalized name.
+
+    Words are sorted in normalize_name, so "Smith John" and "John Smith" get the same vector
+    and swapped first/last names are caught.
+    """
+    names = list(names)
+    rows, columns = [], []
+    for row, name in enumerate(names):
+        for a, b in zip(name, name[1:]):
+            rows.append(row)
+            columns.append((ord(a) * 31 + ord(b)) % NAME_VECTOR_SIZE)
+    vectors = np.zeros((len(names), NAME_VECTOR_SIZE), dtype=np.float32)
+    np.add.at(vectors, (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)), 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+def score_candidates(patient: Dict[str, Any], candidates: List[Dict[str, Any]],
+                     threshold: float = DEDUP_NAME_THRESHOLD) -> List[Dict[str, Any]]:
+    """Candidates that look like the same person, best first.
+
+    A candidate is a duplicate when it shares the date of birth or phone number and its name
+    scores at least `threshold` (cosine similarity of bigram vectors); all names are scored in
+    one matrix product.
+    """
+    if not candidates:
+        return []
+    vectors = name_vectors([normalize_name(patient.get("first_name"), patient.get("last_name"))] + [
+        normalize_name(candidate.get("first_name"), candidate.get("last_name")) for candidate in candidates
+    ])
+    similarities = (vectors[1:] @ vectors[0]).tolist()
+    dob = normalize_dob(patient.get("dob"))
+    phone = normalize_phone(patient.get("contact_number"))
+
+    duplicates = []
+    for candidate, similarity in zip(candidates, similarities):
+        same_dob = dob is not None and normalize_dob(candidate.get("dob")) == dob
+        same_phone = bool(phone) and normalize_phone(candidate.get("contact_number")) == phone
+        if similarity >= threshold and (same_dob or same_phone):
+            duplicates.append({
+                **candidate,
+                "score": round(similarity + 0.5 * same_dob + 0.5 * same_phone, 3),
+                "same_dob": same_dob,
+                "same_phone": same_phone
+            })
+    duplicates.sort(key=lambda duplicate: -duplicate["score"])
+    return duplicates
+
+
+async def _fetch_candidates(patients_collection, patient: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+    # Blocking: only patients sharing the date of birth or the phone number are compared
+    blocks = []
+    dob = normalize_dob(patient.get("dob"))
+    if isinstance(dob, date):
+        # Dates of birth are stored as midnight datetimes (see utils.bson_dates)
+        blocks.append({"dob": datetime.combine(dob, midnight())})
+    phone = normalize_phone(patient.get("contact_number"))
+    if phone:
+        blocks.append({"contact_digits": phone})
+    if not blocks:
+        return []
+    return await patients_collection.find({"$or": blocks}, DEDUP_PROJECTION).to_list(length=limit)
+
+
+async def find_duplicates(patients_collection, patient: Dict[str, Any], budget_ms: float = DEDUP_BUDGET_MS,
+                          max_candidates: int = DEDUP_MAX_CANDIDATES) -> List[Dict[str, Any]]:
+    """Existing patients that look like `patient`, checked within a latency budget.
+
+    Registration must not stall on a slow or failing query, so if the budget runs out or the
+    lookup fails the check is skipped (logged) and no duplicates are reported.
+    """
+    started = time.perf_counter()
+    try:
+        candidates = await asyncio.wait_for(
+            _fetch_candidates(patients_collection, patient, max_candidates), timeout=budget_ms / 1000
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Duplicate check skipped: over latency budget", extra={"budget_ms": budget_ms})
+        return []
+    except Exception:
+        logger.exception("Duplicate check skipped: candidate lookup failed")
+        return []
+    duplicates = score_candidates(patient, candidates)
+    logger.debug("Duplicate check", extra={
+        "candidates": len(candidates), "duplicates": len(duplicates),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+    return duplicates
+
+
+def find_duplicates_in_store(patients_collection, patient: Dict[str, Any],
+                             max_candidates: int = DEDUP_MAX_CANDIDATES) -> List[Dict[str, Any]]:
+    """find_duplicates for the in-memory backend, blocking through its "dob" and "contact_digits" indexes"""
+    candidates: Dict[Any, Dict[str, Any]] = {}
+    dob = normalize_dob(patient.get("dob"))
+    if isinstance(dob, date):
+        for candidate in patients_collection.find("dob", dob):
+            candidates.setdefault(candidate["patient_uid"], candidate)
+    phone = normalize_phone(patient.get("contact_number"))
+    if phone:
+        for candidate in patients_collection.find("contact_digits", phone):
+            candidates.setdefault(candidate["patient_uid"], candidate)
+    projected = [
+        {name: candidate.get(name) for name in DEDUP_PROJECTION if name != "_id"}
+        for candidate in list(candidates.values())[:max_candidates]
+    ]
+    return score_candidates(patient, projected)
+
+
+async def backfill_contact_digits(patients_collection) -> int:
+    """Add contact_digits to patients stored before it existed; run in the background at startup"""
+    updated = 0
+    updates = []
+    async for patient in patients_collection.find({"contact_digits": {"$exists": False}}, {"contact_number": 1}):
+        updates.append(UpdateOne(
+            {"_id": patient["_id"]}, {"$set": {"contact_digits": normalize_phone(patient.get("contact_number"))}}
+        ))
+        if len(updates) >= BACKFILL_BATCH_SIZE:
+            await patients_collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+    if updates:
+        await patients_collection.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    if updated:
+        logger.info("Backfilled contact_digits", extra={"patients": updated})
+    return updated
+
+
+class _DisjointSet:
+    def __init__(self):
+        self.parent: Dict[Any, Any] = {}
+
+    def find(self, item: Any) -> Any:
+        self.parent.setdefault(item, item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: Any, b: Any):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _name_initial(patient: Dict[str, Any]) -> str:
+    # First letter of the alphabetically first name word, so swapped first/last names share a sub-block
+    return normalize_name(patient.get("first_name"), patient.get("last_name")).strip()[:1]
+
+
+def _split_oversized(members: List[Dict[str, Any]], max_block_size: int) -> List[List[Dict[str, Any]]]:
+    """The block itself, or when it is too large to compare pairwise, its sub-blocks by name initial.
+
+    A placeholder date of birth or a shared switchboard number can put tens of thousands of patients
+    in one block. Sub-blocks still over the cap are skipped and logged rather than compared.
+    """
+    if len(members) <= max_block_size:
+        return [members]
+    sub_blocks: Dict[str, List[Dict[str, Any]]] = {}
+    for patient in members:
+        sub_blocks.setdefault(_name_initial(patient), []).append(patient)
+    blocks = []
+    for initial, sub_block in sub_blocks.items():
+        if len(sub_block) > max_block_size:
+            logger.warning("Duplicate scan skipped an oversized block", extra={"name_initial": initial, "patients": len(sub_block)})
+        elif len(sub_block) > 1:
+            blocks.append(sub_block)
+    return blocks
+
+
+def _similar_pairs(members: List[Dict[str, Any]], threshold: float) -> Iterable[Tuple[int, int]]:
+    """Positions of pairs within one block whose names score at least threshold.
+
+    Each batch of rows is only compared with itself and the rows after it, and the batch is sized so
+    the similarity matrix never exceeds PAIR_MATRIX_CELLS, whatever the block size.
+    """
+    vectors = name_vectors(normalize_name(patient.get("first_name"), patient.get("last_name")) for patient in members)
+    batch_size = max(1, PAIR_MATRIX_CELLS // len(members))
+    for start in range(0, len(members), batch_size):
+        similarities = vectors[start:start + batch_size] @ vectors[start:].T
+        rows, columns = np.nonzero(similarities >= threshold)
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            if row < column:
+                yield start + row, start + column
+
+
+def _blocks(patients: List[Dict[str, Any]]) -> Iterable[List[Dict[str, Any]]]:
+    blocks: Dict[Tuple[str, Any], List[Dict[str, Any]]] = {}
+    for patient in patients:
+        dob = normalize_dob(patient.get("dob"))
+        if dob is not None:
+            blocks.setdefault(("dob", dob), []).append(patient)
+        phone = normalize_phone(patient.get("contact_number"))
+        if phone:
+            blocks.setdefault(("phone", phone), []).append(patient)
+    return (members for members in blocks.values() if len(members) > 1)
+
+
+class _ClusterBuilder:
+    """Joins the matching pairs of each block it is given into clusters, keeping only matched patients"""
+
+    def __init__(self, threshold: float, max_block_size: int):
+        self.threshold = threshold
+        self.max_block_size = max_block_size
+        self._sets = _DisjointSet()
+        self._matched: Dict[Any, Dict[str, Any]] = {}
+
+    def add_block(self, block: List[Dict[str, Any]]):
+        for members in _split_oversized(block, self.max_block_size):
+            for a, b in _similar_pairs(members, self.threshold):
+                for patient in (members[a], members[b]):
+                    self._matched[patient["patient_uid"]] = patient
+                self._sets.union(members[a]["patient_uid"], members[b]["patient_uid"])
+
+    def clusters(self) -> List[List[Dict[str, Any]]]:
+        grouped: Dict[Any, List[Dict[str, Any]]] = {}
+        for uid, patient in self._matched.items():
+            grouped.setdefault(self._sets.find(uid), []).append(patient)
+        return [sorted(members, key=lambda patient: patient["patient_uid"]) for members in grouped.values()]
+
+
+def duplicate_clusters(patients: List[Dict[str, Any]], threshold: float = DEDUP_NAME_THRESHOLD,
+                       max_block_size: int = DEDUP_MAX_BLOCK_SIZE) -> List[List[Dict[str, Any]]]:
+    """Groups of patients that are probably the same person, using the same rule as registration.
+
+    Patients are blocked by date of birth and by phone number; names are only compared within
+    a block, and matching pairs are joined transitively into clusters.
+    """
+    builder = _ClusterBuilder(threshold, max_block_size)
+    for block in _blocks(patients):
+        builder.add_block(block)
+    return builder.clusters()
+
+
+async def _stored_blocks(patients_collection, field: str) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Patients sharing a value of field, one block at a time, grouped on the server.
+
+    Only the patient_uids are grouped, so a large block stays a small document; its members are
+    then read in batches.
+    """
+    pipeline = [
+        {"$match": {field: {"$nin": [None, ""]}}},
+        {"$group": {"_id": f"${field}", "uids": {"$push": "$patient_uid"}}},
+        {"$match": {"uids.1": {"$exists": True}}},
+    ]
+    async for group in patients_collection.aggregate(pipeline, allowDiskUse=True):
+        members = []
+        for start in range(0, len(group["uids"]), BLOCK_FETCH_SIZE):
+            uids = group["uids"][start:start + BLOCK_FETCH_SIZE]
+            members.extend(await patients_collection.find({"patient_uid": {"$in": uids}}, DEDUP_PROJECTION).to_list(length=None))
+        yield members
+
+
+async def find_duplicate_clusters(patients_collection, threshold: float = DEDUP_NAME_THRESHOLD,
+                                  max_block_size: int = DEDUP_MAX_BLOCK_SIZE) -> List[List[Dict[str, Any]]]:
+    """Scan the whole patients collection for duplicate clusters (offline job).
+
+    Blocks are streamed from Mongo one at a time, so memory is bounded by the largest block and
+    the patients that matched, not by the collection. Patients without contact_digits (stored
+    before backfill_contact_digits ran) are only blocked by date of birth.
+    """
+    builder = _ClusterBuilder(threshold, max_block_size)
+    for field in ("dob", "contact_digits"):
+        async for block in _stored_blocks(patients_collection, field):
+            builder.add_block(block)
+    return builder.clusters()
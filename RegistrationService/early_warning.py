@@ -0,0 +1,157 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from models import StatusEnum, PriorityEnum
+
+# NEWS2 bands per parameter: a reading <= edges[i] (and above edges[i-1]) scores scores[i],
+# anything above the last edge scores the final entry
+NEWS2_BANDS = {
+    "respiratory_rate": ([8, 11, 20, 24], [3, 1, 0, 2, 3]),
+    "oxygen_saturation": ([91, 93, 95], [3, 2, 1, 0]),
+    "blood_pressure_systolic": ([90, 100, 110, 219], [3, 2, 1, 0, 3]),
+    "heart_rate": ([40, 50, 90, 110, 130], [3, 1, 0, 1, 2, 3]),
+    "temperature": ([35.0, 36.0, 38.0, 39.0], [3, 1, 0, 1, 2]),
+}
+SCORED_FIELDS = list(NEWS2_BANDS)
+
+# The vitals screen records °F; anything above this cannot be a Celsius body temperature
+FAHRENHEIT_THRESHOLD = 45.0
+
+# Queue priority a pending patient is raised to for a given aggregate score
+URGENT_SCORE = 7
+HIGH_SCORE = 5
+_LOWER_PRIORITIES = {
+    PriorityEnum.URGENT: [PriorityEnum.LOW, PriorityEnum.MEDIUM, PriorityEnum.HIGH],
+    PriorityEnum.HIGH: [PriorityEnum.LOW, PriorityEnum.MEDIUM],
+}
+
+
+def to_celsius(temperature: np.ndarray) -> np.ndarray:
+    return np.where(temperature > FAHRENHEIT_THRESHOLD, (temperature - 32.0) * 5.0 / 9.0, temperature)
+
+
+def score_arrays(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Per-parameter and aggregate NEWS2 scores for column arrays of equal length.
+
+    Missing readings (NaN) score 0 and are counted in "missing". Consciousness and
+    supplemental oxygen are not recorded with vitals, so they are not scored.
+    """
+    scores = {}
+    missing = None
+    for name, (edges, band_scores) in NEWS2_BANDS.items():
+        values = columns[name]
+        if name == "temperature":
+            values = to_celsius(values)
+        absent = np.isnan(values)
+        # side="left" puts a reading equal to an edge into the band that edge closes
+        band = np.searchsorted(np.asarray(edges, dtype=float), values, side="left")
+        scores[name] = np.where(absent, 0, np.asarray(band_scores)[np.minimum(band, len(edges))])
+        missing = absent.astype(np.int64) if missing is None else missing + absent
+
+    parameter_scores = np.vstack([scores[name] for name in SCORED_FIELDS])
+    scores["total"] = parameter_scores.sum(axis=0)
+    scores["red_flag"] = (parameter_scores == 3).any(axis=0)
+    scores["missing"] = missing
+    return scores
+
+
+def clinical_risk(total: np.ndarray, red_flag: np.ndarray) -> np.ndarray:
+    """NEWS2 clinical risk band for each aggregate score"""
+    return np.select(
+        [total >= URGENT_SCORE, total >= HIGH_SCORE, red_flag],
+        ["HIGH", "MEDIUM", "LOW_MEDIUM"],
+        default="LOW"
+    )
+
+
+def to_arrays(documents: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    return {
+        name: np.array([document.get(name) for document in documents], dtype=float)
+        for name in SCORED_FIELDS
+    }
+
+
+def score_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Score the latest vitals of many patients in one vectorized pass, highest score first"""
+    if not documents:
+        return []
+    scores = score_arrays(to_arrays(documents))
+    risk = clinical_risk(scores["total"], scores["red_flag"])
+    order = np.lexsort((-scores["red_flag"].astype(np.int64), -scores["total"]))
+
+    # Convert to Python lists once rather than indexing NumPy scalars per patient
+    total, red_flag, missing, risk = (scores["total"].tolist(), scores["red_flag"].tolist(),
+                                      scores["missing"].tolist(), risk.tolist())
+    parameters = [scores[name].tolist() for name in SCORED_FIELDS]
+
+    results = []
+    for i in order.tolist():
+        document = documents[i]
+        results.append({
+            "patient_uid": document["patient_uid"],
+            "recorded_at": document["recorded_at"],
+            "score": total[i],
+            "clinical_risk": risk[i],
+            "red_flag": red_flag[i],
+            "missing_parameters": missing[i],
+            "parameters": {name: values[i] for name, values in zip(SCORED_FIELDS, parameters)}
+        })
+    return results
+
+
+async def latest_vitals(vitals_collection, since: datetime,
+                        patient_uids: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+    """The most recent reading of each patient since a point in time"""
+    match: Dict[str, Any] = {"recorded_at": {"$gte": since}}
+    if patient_uids is not None:
+        match["patient_uid"] = {"$in": list(patient_uids)}
+    pipeline = [
+        {"$match": match},
+        # Follows the (patient_uid, recorded_at) index so $first picks each patient's newest reading
+        {"$sort": {"patient_uid": 1, "recorded_at": -1}},
+        {"$group": {
+            "_id": "$patient_uid",
+            "recorded_at": {"$first": "$recorded_at"},
+            **{name: {"$first": f"${name}"} for name in SCORED_FIELDS}
+        }},
+        {"$project": {"_id": 0, "patient_uid": "$_id", "recorded_at": 1, **{name: 1 for name in SCORED_FIELDS}}}
+    ]
+    return await vitals_collection.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+
+def priority_for_score(score: int) -> Optional[PriorityEnum]:
+    if score >= URGENT_SCORE:
+        return PriorityEnum.URGENT
+    if score >= HIGH_SCORE:
+        return PriorityEnum.HIGH
+    return None
+
+
+async def escalate_queue_priorities(queue_collection, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Raise the priority of pending queue items for high-scoring patients; never lowers one.
+
+    Returns the queue items that changed, with their new priority applied.
+    """
+    patients_by_priority: Dict[PriorityEnum, List[int]] = {}
+    for result in results:
+        priority = priority_for_score(result["score"])
+        if priority is not None:
+            patients_by_priority.setdefault(priority, []).append(result["patient_uid"])
+
+    escalated = []
+    now = datetime.utcnow()
+    for priority, patient_uids in patients_by_priority.items():
+        query = {
+            "patient_uid": {"$in": patient_uids},
+            "status": StatusEnum.PENDING,
+            "priority": {"$in": _LOWER_PRIORITIES[priority]}
+        }
+        items = await queue_collection.find(query).to_list(length=None)
+        if not items:
+            continue
+        await queue_collection.update_many(
+            {**query, "_id": {"$in": [item["_id"] for item in items]}},
+            {"$set": {"priority": priority, "updated_at": now}}
+        )
+        escalated.extend({**item, "priority": priority, "updated_at": now} for item in items)
+    return escalated
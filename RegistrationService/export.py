@@ -0,0 +1,198 @@
+import csv
+import io
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List, Optional, get_args, get_origin
+from bson import ObjectId
+from models import Patient, Appointment, Vitals
+from serializers import dump_document, dumps
+from utils import model_dates
+
+EXPORT_BATCH_SIZE = 5000
+
+# Exportable collections: the model giving the column layout, the field date ranges
+# filter on, and the field a doctor filter applies to (None if it has no doctor)
+EXPORTS = {
+    "patients": {"model": Patient, "date_field": "created_at", "doctor_field": None},
+    "appointments": {"model": Appointment, "date_field": "appointment_time", "doctor_field": "doctor_id"},
+    "vitals": {"model": Vitals, "date_field": "recorded_at", "doctor_field": None},
+}
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_columns(model) -> List[str]:
+    """Column names in model order, with `_id` exposed as `id`"""
+    return ["id" if field.alias == "_id" else name for name, field in model.model_fields.items()]
+
+
+def export_filter(collection: str, start: Optional[datetime], end: Optional[datetime],
+                  doctor_id: Optional[str]) -> Dict[str, Any]:
+    spec = EXPORTS[collection]
+    query: Dict[str, Any] = {}
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start
+    if end is not None:
+        date_range["$lt"] = end
+    if date_range:
+        query[spec["date_field"]] = date_range
+    if doctor_id is not None:
+        if spec["doctor_field"] is None:
+            raise ValueError(f"{collection} cannot be filtered by doctor")
+        query[spec["doctor_field"]] = doctor_id
+    return query
+
+
+async def iter_batches(cursor, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Group a cursor into lists of at most batch_size documents"""
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_ndjson(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield b"".join(dump_document(document) + b"\n" for document in batch)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (list, dict)):
+        return dumps(value).decode()
+    return value
+
+
+async def stream_csv(batches: AsyncIterator[List[Dict[str, Any]]], columns: List[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for batch in batches:
+        for document in map(model_dates, batch):
+            writer.writerow([_csv_value(document.get("_id" if column == "id" else column)) for column in columns])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _arrow_type(annotation):
+    import pyarrow as pa
+
+    if get_origin(annotation) is not None and type(None) in get_args(annotation):
+        annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+    if get_origin(annotation) in (list, List):
+        return pa.list_(_arrow_type(get_args(annotation)[0]))
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    if annotation is datetime:
+        return pa.timestamp("ms")
+    if annotation is date:
+        return pa.date32()
+    # Strings, enums and ObjectIds are stored as text; free-form objects as JSON text
+    return pa.string()
+
+
+def _arrow_value(value, arrow_type):
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, (dict, list)):
+            return dumps(value).decode()
+        return str(value)
+    if pa.types.is_date32(arrow_type) and isinstance(value, datetime):
+        return value.date()
+    if pa.types.is_list(arrow_type):
+        return [_arrow_value(item, arrow_type.value_type) for item in value]
+    return value
+
+
+class _ChunkSink:
+    """Write target that hands back whatever the Parquet writer produced since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def stream_parquet(batches: AsyncIterator[List[Dict[str, Any]]], model) -> AsyncIterator[bytes]:
+    """One Parquet row group per batch; only the current batch is held in memory"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = export_columns(model)
+    types = [_arrow_type(field.annotation) for field in model.model_fields.values()]
+    schema = pa.schema([pa.field(column, arrow_type) for column, arrow_type in zip(columns, types)])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="snappy")
+    try:
+        async for batch in batches:
+            arrays = [
+                pa.array([_arrow_value(document.get("_id" if column == "id" else column), arrow_type)
+                          for document in batch], type=arrow_type)
+                for column, arrow_type in zip(columns, types)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(cursor, collection: str, export_format: str) -> AsyncIterator[bytes]:
+    model = EXPORTS[collection]["model"]
+    batches = iter_batches(cursor)
+    if export_format == "ndjson":
+        return stream_ndjson(batches)
+    if export_format == "csv":
+        return stream_csv(batches, export_columns(model))
+    return stream_parquet(batches, model)
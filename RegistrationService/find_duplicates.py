@@ -0,0 +1,30 @@
+import asyncio
+import sys
+from database import connect_to_mongo, get_analytics_database
+from dedup import find_duplicate_clusters
+from serializers import dumps
+
+async def find_duplicates(output_path=None):
+    """Report clusters of probable duplicate patients, one JSON array of patients per line"""
+    try:
+        await connect_to_mongo()
+        clusters = await find_duplicate_clusters(get_analytics_database().patients)
+        
+        lines = [dumps(cluster).decode() for cluster in clusters]
+        if output_path:
+            with open(output_path, "w", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in lines)
+            print(f"✅ Wrote {len(clusters)} duplicate clusters to {output_path}")
+        else:
+            for line in lines:
+                print(line)
+            print(f"✅ Found {len(clusters)} duplicate clusters ({sum(len(c) for c in clusters)} patients)", file=sys.stderr)
+            
+    except Exception as e:
+        print(f"❌ Error: {e}", file=sys.stderr)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("Usage: python find_duplicates.py [clusters.ndjson]")
+        sys.exit(1)
+    asyncio.run(find_duplicates(sys.argv[1] if len(sys.argv) == 2 else None))
@@ -0,0 +1,202 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from bson import SON
+from datetime import datetime
+from config import VITALS_TIMESERIES
+
+# Every index here either enforces uniqueness or serves a query in main.py;
+# reconcile_indexes can drop anything else so writes don't pay for unused indexes.
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True)
+    ],
+    "patients": [
+        IndexModel([("patient_uid", ASCENDING)], unique=True),
+        IndexModel([("contact_number", ASCENDING)]),
+        # Duplicate detection blocks on date of birth or normalized phone
+        IndexModel([("dob", ASCENDING)]),
+        IndexModel([("contact_digits", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)])
+    ],
+    "appointments": [
+        IndexModel([("queue_token", ASCENDING)], unique=True),
+        IndexModel([("appointment_time", ASCENDING)])
+    ],
+    "vitals": [
+        # Time-series collections only index their meta and time fields
+        IndexModel([("patient_uid", ASCENDING), ("recorded_at", DESCENDING)]) if VITALS_TIMESERIES
+        else IndexModel([("patient_uid", ASCENDING), ("recorded_at", DESCENDING), ("_id", DESCENDING)])
+    ],
+    "queue": [
+        # Legacy items have no queue_day and may repeat numbers, so only dated items are held unique
+        IndexModel(
+            [("doctor_id", ASCENDING), ("queue_day", ASCENDING), ("queue_number", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"queue_day": {"$exists": True}},
+            name="doctor_id_1_queue_day_1_queue_number_1_unique"
+        ),
+        # The partial index can't serve queries that don't filter on queue_day, so listings get their own
+        IndexModel([("doctor_id", ASCENDING), ("queue_day", ASCENDING), ("queue_number", ASCENDING)]),
+        IndexModel([("status", ASCENDING)])
+    ],
+    "slot_reservations": [
+        IndexModel([("slot_start", ASCENDING)])
+    ],
+    "doctors": [
+        IndexModel([("doctor_id", ASCENDING)], unique=True),
+        IndexModel([("is_available", ASCENDING), ("doctor_id", ASCENDING)])
+    ]
+}
+
+# Query shapes issued by the API, used by check_indexes.py to verify each one
+# is answered by an index scan without an in-memory SORT stage.
+QUERY_SHAPES = [
+    {"endpoint": "POST /token", "collection": "users",
+     "filter": {"username": "reception"}},
+    {"endpoint": "GET /api/v1/patients", "collection": "patients",
+     "filter": {}, "sort": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    {"endpoint": "GET /api/v1/patients/{patient_uid}", "collection": "patients",
+     "filter": {"patient_uid": 10000000000}},
+    {"endpoint": "GET /api/v1/patients/search", "collection": "patients",
+     "filter": {"patient_uid": {"$in": [10000000000, 10000000001]}}},
+    {"endpoint": "GET /api/v1/patients/search (index refresh)", "collection": "patients",
+     "filter": {"created_at": {"$gte": datetime(2000, 1, 1)}}},
+    {"endpoint": "POST /api/v1/patients/register (duplicate check)", "collection": "patients",
+     "filter": {"$or": [{"dob": datetime(2000, 1, 1)}, {"contact_digits": "0000000000"}]}},
+    {"endpoint": "GET /api/v1/vitals/patient/{patient_uid}", "collection": "vitals",
+     "filter": {"patient_uid": 10000000000}, "sort": [("recorded_at", DESCENDING), ("_id", DESCENDING)]},
+    {"endpoint": "GET /api/v1/vitals/patient/{patient_uid}/series", "collection": "vitals",
+     "filter": {"patient_uid": 10000000000, "recorded_at": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 1, 2)}},
+     "sort": [("recorded_at", ASCENDING)]},
+    {"endpoint": "GET /api/v1/queue/doctor/{doctor_id}", "collection": "queue",
+     "filter": {"doctor_id": "DOC001"}, "sort": [("queue_day", ASCENDING), ("queue_number", ASCENDING)]},
+    {"endpoint": "wait estimates (pending items of a doctor)", "collection": "queue",
+     "filter": {"doctor_id": "DOC001", "status": "PENDING", "queue_day": "2000-01-01"}},
+    {"endpoint": "GET /api/v1/dashboard/stats (pending queue)", "collection": "queue",
+     "filter": {"status": "PENDING"}},
+    {"endpoint": "GET /api/v1/dashboard/stats (today's appointments)", "collection": "appointments",
+     "filter": {"appointment_time": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 1, 2)}}},
+    {"endpoint": "GET /api/v1/appointments/slots (reservation refresh)", "collection": "slot_reservations",
+     "filter": {"slot_start": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 1, 15)}}},
+    {"endpoint": "GET /api/v1/doctors", "collection": "doctors",
+     "filter": {"is_available": True}, "sort": [("doctor_id", ASCENDING)]},
+    {"endpoint": "GET /api/v1/doctors/{doctor_id}", "collection": "doctors",
+     "filter": {"doctor_id": "DOC001"}}
+]
+
+def _index_matches(existing, declared):
+    """Whether an index reported by list_indexes matches a declared IndexModel document"""
+    return (
+        SON(existing["key"]) == SON(declared["key"])
+        and existing.get("unique", False) == declared.get("unique", False)
+        and existing.get("partialFilterExpression") == declared.get("partialFilterExpression")
+    )
+
+# A changed index is rebuilt under its declared name or this alternate one, whichever is free,
+# so the old definition stays in place until the new one is built
+ALTERNATE_INDEX_SUFFIX = "_next"
+# Mongo refuses a second index over the same keys that differs only in its options
+INDEX_CONFLICT_CODES = (85, 86)
+
+def _alternate_name(name):
+    return name[:-len(ALTERNATE_INDEX_SUFFIX)] if name.endswith(ALTERNATE_INDEX_SUFFIX) else name + ALTERNATE_INDEX_SUFFIX
+
+def _with_name(document, name):
+    options = {key: value for key, value in document.items() if key not in ("key", "name", "v", "ns")}
+    return IndexModel(list(document["key"].items()), name=name, **options)
+
+async def _drop_index(collection, name):
+    """Drop an index, tolerating one already dropped (e.g. by another worker starting at the same time)"""
+    try:
+        await collection.drop_index(name)
+    except OperationFailure as e:
+        print(f"Could not drop index {collection.name}.{name}: {e}")
+        return False
+    print(f"Dropped index {collection.name}.{name}")
+    return True
+
+async def _replace_index(collection, declared, current):
+    """Build a changed index alongside the current one, then drop the current one"""
+    replacement = _with_name(declared, _alternate_name(current["name"]))
+    try:
+        await collection.create_indexes([replacement])
+    except OperationFailure as e:
+        if e.code not in INDEX_CONFLICT_CODES:
+            print(f"Error rebuilding index {collection.name}.{current['name']}, keeping the existing one: {e}")
+            return
+        # Same keys, different options: it has to be rebuilt in place, restoring the old one on failure
+        await _drop_index(collection, current["name"])
+        try:
+            await collection.create_indexes([_with_name(declared, current["name"])])
+        except OperationFailure as e:
+            print(f"Error rebuilding index {collection.name}.{current['name']}, restoring the previous one: {e}")
+            await collection.create_indexes([_with_name(current, current["name"])])
+            return
+        print(f"Rebuilt index {collection.name}.{current['name']}")
+        return
+    print(f"Created index {collection.name}.{replacement.document['name']}")
+    await _drop_index(collection, current["name"])
+
+async def reconcile_indexes(database, drop_undeclared: bool = False):
+    """Create declared indexes, rebuild changed ones and optionally drop undeclared ones.
+
+    Nothing is dropped before its replacement is built, so a failed build (e.g. a unique index
+    over conflicting legacy data) leaves the existing index in place. Drops tolerate indexes
+    another worker already removed, so concurrent startups don't abort reconciliation.
+    """
+    for collection_name, models in INDEXES.items():
+        collection = database[collection_name]
+        existing = {index["name"]: index async for index in collection.list_indexes()}
+
+        missing, changed = [], []
+        for model in models:
+            name = model.document["name"]
+            current = existing.get(name) or existing.get(_alternate_name(name))
+            if current is None:
+                missing.append(model)
+            elif not _index_matches(current, model.document):
+                changed.append((model.document, current))
+
+        if missing:
+            try:
+                await collection.create_indexes(missing)
+            except Exception as e:
+                print(f"Error creating indexes on {collection_name}: {e}")
+            else:
+                for model in missing:
+                    print(f"Created index {collection_name}.{model.document['name']}")
+
+        for declared, current in changed:
+            await _replace_index(collection, declared, current)
+
+        if drop_undeclared:
+            kept = {"_id_"}
+            for model in models:
+                kept.update((model.document["name"], _alternate_name(model.document["name"])))
+            for name in existing:
+                if name not in kept:
+                    await _drop_index(collection, name)
+
+def _plan_stages(plan):
+    """Collect every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+async def explain_query_shape(database, shape):
+    """Return (is_index_backed, stages) for one declared query shape"""
+    cursor = database[shape["collection"]].find(shape["filter"])
+    if shape.get("sort"):
+        cursor = cursor.sort(shape["sort"])
+    explanation = await cursor.explain()
+    stages = _plan_stages(explanation["queryPlanner"]["winningPlan"])
+    index_backed = ("IXSCAN" in stages or "IDHACK" in stages or "EXPRESS_IXSCAN" in stages) \
+        and "COLLSCAN" not in stages and "SORT" not in stages
+    return index_backed, stages
@@ -1,26 +1,54 @@
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from database import (
     get_database, connect_to_mongo, close_mongo_connection, 
     get_users_collection, get_patients_collection, get_appointments_collection,
     get_vitals_collection, get_queue_collection, get_doctors_collection,
-    initialize_default_data
+    get_stats_collection, get_slot_reservations_collection, get_analytics_database, get_patient_uid_allocator, initialize_default_data, get_doctor_queue_details, allocate_queue_number
 )
 from models import (
     Patient, Appointment, Vitals, Queue, Doctor, User, 
-    StatusEnum, RoleEnum, PriorityEnum, generate_patient_uid
+    StatusEnum, RoleEnum, PriorityEnum
 )
 import uuid
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse, JSONResponse
+from fastapi.responses import FileResponse, RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from jose import JWTError, jwt
-from security import verify_password, create_access_token, get_password_hash, SECRET_KEY, ALGORITHM
-from config import MONGODB_URL, DATABASE_NAME
+from security import verify_password, verify_password_async, shutdown_hash_pool, create_access_token, get_password_hash, SECRET_KEY, ALGORITHM
+from auth_cache import principal_cache
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER,
+    PATIENTS_SORT, VITALS_SORT, QUEUE_SORT, DOCTORS_SORT,
+    decode_cursor, parse_fields, fetch_page, page_response
+)
+from config import MONGODB_URL, DATABASE_NAME, QUEUE_CHANGE_STREAM, LOG_LEVEL, ACCESS_LOG
+from queue_events import queue_broadcaster, watch_queue_changes
+from queue_engine import queue_engine, queue_day_today
+from wait_estimator import wait_estimator
+from dedup import find_duplicates, add_dedup_keys, backfill_contact_digits
+from patient_search import patient_search_index, search_patients
+from scheduler import slot_scheduler, OutsideWorkingHours, SlotUnavailable
+from utils import encode_document, bson_dates, naive_utc
+from bulk_import import bulk_register_patients, iter_ndjson, iter_ndjson_lines, iter_json_array
+from vitals_ingest import vitals_ingest_buffer, build_vitals_document, IngestBackpressure
+from pymongo.errors import DuplicateKeyError
+from vitals_series import SERIES_FIELDS, MAX_SERIES_BUCKETS, MAX_SERIES_READINGS, to_arrays, aggregate_series
+from serializers import DocumentResponse, DocumentListResponse
+from pool_metrics import pool_metrics
+from metrics import MetricsMiddleware, render_metrics
+from app_logging import logger, start_logging, stop_logging
+from export import EXPORTS, EXPORT_FORMATS, EXPORT_BATCH_SIZE, export_filter, parquet_available, stream_export
+from early_warning import latest_vitals, score_documents, escalate_queue_priorities
+from stats import (
+    record_patients_registered, record_appointment_booked, record_queue_status_change,
+    reconcile_stats, dashboard_view, run_stats_reconciliation, DASHBOARD_STATS_ID
+)
 from datetime import timedelta, datetime
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from bson import ObjectId
+from pymongo import ReturnDocument
 import asyncio
 
 
@@ -65,8 +93,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+def log_request(scope, route, status_code, seconds, mongo_stats):
+    logger.info("request", extra={
+        "method": scope["method"],
+        "path": scope["path"],
+        "route": route,
+        "status": status_code,
+        "duration_ms": round(seconds * 1000, 2),
+        "mongo_commands": mongo_stats.commands,
+        "mongo_ms": round(mongo_stats.seconds * 1000, 2)
+    })
+
+# Per-route latency and Mongo round-trip histograms, served at /metrics
+app.add_middleware(MetricsMiddleware, on_request=log_request if ACCESS_LOG else None)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -87,14 +130,43 @@ async def read_vitals():
 async def read_queue():
     return FileResponse('static/queue.html')
 
+background_jobs: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def on_startup():
+    start_logging(LOG_LEVEL)
     await connect_to_mongo()
     await initialize_default_data()
+    background_jobs.append(asyncio.create_task(run_stats_reconciliation(
+        get_stats_collection(), get_patients_collection(), get_appointments_collection(), get_queue_collection()
+    )))
+    await queue_engine.rebuild(get_queue_collection())
+    await wait_estimator.load_history(get_queue_collection())
+    await slot_scheduler.load(get_doctors_collection(), get_appointments_collection())
+    await slot_scheduler.refresh(get_slot_reservations_collection())
+    background_jobs.append(asyncio.create_task(slot_scheduler.run(get_slot_reservations_collection())))
+    background_jobs.append(asyncio.create_task(patient_search_index.run(get_patients_collection())))
+    background_jobs.append(asyncio.create_task(backfill_contact_digits(get_patients_collection())))
+    background_jobs.append(asyncio.create_task(wait_estimator.run(get_queue_collection(), queue_engine)))
+    for doctor_id in queue_engine.doctor_ids():
+        wait_estimator.mark_dirty(doctor_id)
+    if QUEUE_CHANGE_STREAM:
+        background_jobs.append(asyncio.create_task(watch_queue_changes(
+            get_queue_collection(), queue_engine.apply, lambda: queue_engine.rebuild(get_queue_collection())
+        )))
+    else:
+        # Other workers' queue writes only reach this worker's call order through a reload
+        background_jobs.append(asyncio.create_task(queue_engine.run(get_queue_collection())))
+    vitals_ingest_buffer.start(get_vitals_collection())
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    for job in background_jobs:
+        job.cancel()
+    await vitals_ingest_buffer.stop()
     await close_mongo_connection()
+    shutdown_hash_pool()
+    stop_logging()
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -109,13 +181,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         if username is None:
             raise credentials_exception
         
+        # Serve repeat requests from the principal cache instead of Mongo
+        user = principal_cache.get(username)
+        if user is not None:
+            return user
+        
         users_collection = get_users_collection()
         user_data = await users_collection.find_one({"username": username})
         if user_data is None:
             raise credentials_exception
         
+        # A deactivated user's unexpired token stops working once the user is re-read;
+        # only active users are ever cached
+        if not user_data.get("is_active", True):
+            principal_cache.invalidate(username)
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Account is deactivated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        
         # Convert to User model
         user = User(**user_data)
+        principal_cache.put(username, user)
         return user
     except JWTError:
         raise credentials_exception
@@ -125,7 +213,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     users_collection = get_users_collection()
     user_data = await users_collection.find_one({"username": form_data.username})
     
-    if not user_data or not verify_password(form_data.password, user_data["hashed_password"]):
+    if not user_data or not await verify_password_async(form_data.password, user_data["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -134,62 +222,138 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     
     # Check if user is active
     if not user_data.get("is_active", True):
+        principal_cache.invalidate(user_data["username"])
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Account is deactivated",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # A fresh login has just re-read the user, so drop any stale cached principal;
+    # the next authenticated request loads it again
+    principal_cache.invalidate(user_data["username"])
+    
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
         data={"sub": user_data["username"], "role": user_data["role"]}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.get("/api/v1/auth/cache/stats")
+async def get_auth_cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit/miss counters for the authenticated user cache"""
+    return principal_cache.stats()
+
 # Patient Management
 @app.post("/api/v1/patients/register", response_model=Patient)
-async def register_patient(patient: Patient, current_user: User = Depends(get_current_user)):
+async def register_patient(patient: Patient, allow_duplicate: bool = False, current_user: User = Depends(get_current_user)):
     try:
-        # Generate unique patient UID
         patients_collection = get_patients_collection()
         
-        # Ensure patient_uid is unique
-        while True:
-    patient.patient_uid = generate_patient_uid()
-            existing = await patients_collection.find_one({"patient_uid": patient.patient_uid})
-            if not existing:
-                break
-        
         # Convert date string to date object if needed
         if isinstance(patient.dob, str):
             from datetime import datetime
             patient.dob = datetime.strptime(patient.dob, "%Y-%m-%d").date()
         
-        patient_dict = patient.dict(by_alias=True)
-        result = await patients_collection.insert_one(patient_dict)
+        # Returning patients are offered their existing records; reception can confirm a new one with allow_duplicate
+        if not allow_duplicate:
+            duplicates = await find_duplicates(patients_collection, patient.dict())
+            if duplicates:
+                logger.info("Possible duplicate registration", extra={"duplicates": [d["patient_uid"] for d in duplicates]})
+                return DocumentResponse(
+                    {"detail": "Patient may already be registered", "duplicates": duplicates}, status_code=409
+                )
+        
+        # UIDs from the allocator are unique by construction, so no existence probe is needed;
+        # the retry only covers a clash with a legacy randomly generated UID
+        for attempt in range(3):
+            patient.patient_uid = await get_patient_uid_allocator().next_uid()
+            patient_dict = patient.dict(by_alias=True)
+            try:
+                result = await patients_collection.insert_one(add_dedup_keys(bson_dates(patient_dict)))
+                break
+            except DuplicateKeyError:
+                if attempt == 2:
+                    raise
         patient_dict["_id"] = result.inserted_id
+        patient_search_index.add(patient_dict)
+        await record_patients_registered(get_stats_collection())
         
-        print(f"✅ Patient registered: {patient.first_name} {patient.last_name} (ID: {patient.patient_uid})")
-        return Patient(**patient_dict)
+        logger.info("Patient registered", extra={"patient_uid": patient.patient_uid})
+        return DocumentResponse(patient_dict)
     except Exception as e:
-        print(f"❌ Error registering patient: {e}")
+        logger.exception("Error registering patient")
         raise HTTPException(status_code=500, detail=f"Error registering patient: {str(e)}")
 
+@app.post("/api/v1/patients/bulk")
+async def bulk_register(request: Request, current_user: User = Depends(get_current_user)):
+    """Register many patients from a JSON array or an NDJSON stream, reporting per-row errors"""
+    if current_user.role != RoleEnum.RECEPTION:
+        raise HTTPException(status_code=403, detail="Only reception staff can register patients in bulk")
+    
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        rows = iter_ndjson(request.stream())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        rows = iter_json_array(body)
+    
+    try:
+        result = await bulk_register_patients(
+            get_patients_collection(), get_patient_uid_allocator(), rows, on_inserted=patient_search_index.add
+        )
+    except Exception as e:
+        logger.exception("Error in bulk registration")
+        raise HTTPException(status_code=500, detail=f"Error in bulk registration: {str(e)}")
+    
+    if result["inserted"]:
+        try:
+            await record_patients_registered(get_stats_collection(), result["inserted"])
+        except Exception:
+            # The stats reconciliation job corrects the counter; the report of what was inserted matters more
+            logger.exception("Error recording bulk registration stats")
+    logger.info("Bulk registration", extra={"inserted": result["inserted"], "failed": result["failed"]})
+    if result["aborted"]:
+        # Partial success: rows before resume_from_row are done and listed in the report
+        return JSONResponse(status_code=503, content=result)
+    return result
+
 @app.get("/api/v1/patients", response_model=List[Patient])
-async def get_all_patients(current_user: User = Depends(get_current_user)):
-    """Get all patients - for reception staff"""
+async def get_all_patients(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get all patients - for reception staff, newest first, paged via X-Next-Cursor"""
     if current_user.role != RoleEnum.RECEPTION:
         raise HTTPException(status_code=403, detail="Only reception staff can view all patients")
     
+    after = decode_cursor(cursor, PATIENTS_SORT)
+    projection = parse_fields(fields, Patient)
     try:
         patients_collection = get_patients_collection()
-        patients_cursor = patients_collection.find({}).sort("created_at", -1)
-        patients_list = await patients_cursor.to_list(length=100)
-        return [Patient(**patient) for patient in patients_list]
+        patients_list, next_cursor = await fetch_page(patients_collection, {}, PATIENTS_SORT, limit, after, projection)
+        return page_response(patients_list, next_cursor)
     except Exception as e:
-        print(f"❌ Error getting patients: {e}")
+        logger.exception("Error getting patients")
         raise HTTPException(status_code=500, detail=f"Error getting patients: {str(e)}")
 
+@app.get("/api/v1/patients/search")
+async def search_patients_endpoint(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Ranked patient lookup by name (typo tolerant), phone number suffix or patient UID prefix"""
+    hits = await search_patients(get_patients_collection(), patient_search_index, q, limit)
+    return DocumentListResponse(content=hits)
+
 @app.get("/api/v1/patients/{patient_uid}", response_model=Patient)
 async def get_patient(patient_uid: int, current_user: User = Depends(get_current_user)):
     patients_collection = get_patients_collection()
@@ -199,8 +363,31 @@ async def get_patient(patient_uid: int, current_user: User = Depends(get_current
     return Patient(**patient_data)
 
 # Appointment Management
+@app.get("/api/v1/appointments/slots")
+async def get_free_slots(
+    specialization: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=200),
+    after: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Earliest free appointment slots across doctors, optionally of one specialization or doctor"""
+    slots = slot_scheduler.next_free_slots(limit, after or datetime.now(), specialization, doctor_id)
+    return DocumentResponse({"slot_minutes": slot_scheduler.slot_minutes, "slots": slots})
+
 @app.post("/api/v1/appointments/book", response_model=Appointment)
 async def book_appointment(appointment_data: AppointmentCreate, current_user: User = Depends(get_current_user)):
+    # Walk-ins join the queue without taking a slot
+    reservation_id = None
+    if not appointment_data.is_walk_in:
+        try:
+            reservation_id = await slot_scheduler.reserve(
+                get_slot_reservations_collection(), appointment_data.doctor_id, appointment_data.appointment_time
+            )
+        except OutsideWorkingHours as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except SlotUnavailable as e:
+            raise HTTPException(status_code=409, detail=str(e))
     try:
         appointments_collection = get_appointments_collection()
         
@@ -214,6 +401,7 @@ async def book_appointment(appointment_data: AppointmentCreate, current_user: Us
             status=appointment_data.status,
             queue_token=queue_token,
             priority=appointment_data.priority,
+            estimated_duration=round(wait_estimator.service_minutes(appointment_data.doctor_id)),
             is_online_booking=appointment_data.is_online_booking,
             is_walk_in=appointment_data.is_walk_in,
             is_kiosk_registration=appointment_data.is_kiosk_registration,
@@ -223,16 +411,23 @@ async def book_appointment(appointment_data: AppointmentCreate, current_user: Us
         appointment_dict = appointment.dict(by_alias=True)
         result = await appointments_collection.insert_one(appointment_dict)
         appointment_dict["_id"] = result.inserted_id
+        # From here on the slot belongs to the saved appointment
+        reservation_id = None
+        await record_appointment_booked(get_stats_collection(), appointment_data.appointment_time)
         
         # Add to queue if not online booking
         if not appointment_data.is_online_booking:
             await add_to_queue(appointment_dict["_id"], appointment_data.patient_uid, 
                               appointment_data.doctor_id, appointment_data.priority)
         
-        print(f"✅ Appointment booked: Patient {appointment_data.patient_uid} with Doctor {appointment_data.doctor_id}")
-        return Appointment(**appointment_dict)
+        logger.info("Appointment booked", extra={"patient_uid": appointment_data.patient_uid, "doctor_id": appointment_data.doctor_id})
+        return DocumentResponse(appointment_dict)
     except Exception as e:
-        print(f"❌ Error booking appointment: {e}")
+        logger.exception("Error booking appointment")
+        if reservation_id is not None:
+            await slot_scheduler.release(
+                get_slot_reservations_collection(), appointment_data.doctor_id, appointment_data.appointment_time
+            )
         raise HTTPException(status_code=500, detail=f"Error booking appointment: {str(e)}")
 
 @app.get("/api/v1/appointments/{appointment_id}", response_model=Appointment)
@@ -268,48 +463,229 @@ async def record_vitals(vitals_data: VitalsInput, current_user: User = Depends(g
     vitals_dict = vitals.dict(by_alias=True)
     result = await vitals_collection.insert_one(vitals_dict)
     vitals_dict["_id"] = result.inserted_id
-    return Vitals(**vitals_dict)
+    return DocumentResponse(vitals_dict)
 
 @app.get("/api/v1/vitals/patient/{patient_uid}", response_model=List[Vitals])
-async def get_patient_vitals(patient_uid: int, current_user: User = Depends(get_current_user)):
+async def get_patient_vitals(
+    patient_uid: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    after = decode_cursor(cursor, VITALS_SORT)
+    projection = parse_fields(fields, Vitals)
     vitals_collection = get_vitals_collection()
-    vitals_cursor = vitals_collection.find({"patient_uid": patient_uid}).sort("recorded_at", -1)
-    vitals_list = await vitals_cursor.to_list(length=100)
-    return [Vitals(**vitals) for vitals in vitals_list]
+    vitals_list, next_cursor = await fetch_page(
+        vitals_collection, {"patient_uid": patient_uid}, VITALS_SORT, limit, after, projection
+    )
+    return page_response(vitals_list, next_cursor)
+
+@app.get("/api/v1/vitals/patient/{patient_uid}/series")
+async def get_patient_vitals_series(
+    patient_uid: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket_minutes: int = Query(60, ge=1),
+    current_user: User = Depends(get_current_user)
+):
+    """Min/mean/max of each vital per time bucket, for trend charts (default: last 24 hours)"""
+    # recorded_at is stored as naive UTC, and aware bounds can't be compared with naive ones
+    end = naive_utc(end) or datetime.utcnow()
+    start = naive_utc(start) or end - timedelta(hours=24)
+    bucket = timedelta(minutes=bucket_minutes)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start) / bucket > MAX_SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range covers more than {MAX_SERIES_BUCKETS} buckets")
+    
+    vitals_collection = get_analytics_database().vitals
+    projection = {"_id": 0, "recorded_at": 1, **{name: 1 for name in SERIES_FIELDS}}
+    vitals_cursor = vitals_collection.find(
+        {"patient_uid": patient_uid, "recorded_at": {"$gte": start, "$lt": end}}, projection
+    ).sort("recorded_at", 1)
+    vitals_list = await vitals_cursor.to_list(length=MAX_SERIES_READINGS + 1)
+    if len(vitals_list) > MAX_SERIES_READINGS:
+        raise HTTPException(status_code=400, detail=f"Range has more than {MAX_SERIES_READINGS} readings; request a shorter range")
+    
+    times, columns = to_arrays(vitals_list)
+    return {
+        "patient_uid": patient_uid,
+        "start": start,
+        "end": end,
+        "bucket_minutes": bucket_minutes,
+        "readings": len(vitals_list),
+        "buckets": aggregate_series(times, columns, start, bucket)
+    }
+
+async def score_early_warnings(doctor_id: Optional[str], since_hours: int):
+    since = datetime.utcnow() - timedelta(hours=since_hours)
+    analytics_database = get_analytics_database()
+    patient_uids = None
+    if doctor_id is not None:
+        patient_uids = await analytics_database.queue.distinct("patient_uid", {
+            "doctor_id": doctor_id,
+            "status": {"$in": [StatusEnum.PENDING, StatusEnum.IN_PROGRESS]}
+        })
+    
+    latest = await latest_vitals(analytics_database.vitals, since, patient_uids)
+    return since, score_documents(latest)
+
+@app.get("/api/v1/vitals/early-warning")
+async def get_early_warning_scores(
+    doctor_id: Optional[str] = None,
+    since_hours: int = Query(24, ge=1, le=24 * 7),
+    current_user: User = Depends(get_current_user)
+):
+    """NEWS2 early-warning scores from each patient's latest vitals, highest risk first.
+
+    With doctor_id only patients waiting in or being seen from that doctor's queue are
+    scored. Read-only; queue priorities are raised through the escalate endpoint.
+    """
+    since, results = await score_early_warnings(doctor_id, since_hours)
+    return {
+        "since": since,
+        "patients_scored": len(results),
+        "scores": results
+    }
+
+@app.post("/api/v1/vitals/early-warning/escalate")
+async def escalate_early_warnings(
+    doctor_id: Optional[str] = None,
+    since_hours: int = Query(24, ge=1, le=24 * 7),
+    current_user: User = Depends(get_current_user)
+):
+    """Score patients as the early-warning view does and raise their pending queue items:
+    5-6 to HIGH and 7+ to URGENT"""
+    if current_user.role not in [RoleEnum.NURSE, RoleEnum.DOCTOR]:
+        raise HTTPException(status_code=403, detail="Only nurses and doctors can escalate queue priorities")
+    
+    since, results = await score_early_warnings(doctor_id, since_hours)
+    escalated = await escalate_queue_priorities(get_queue_collection(), results)
+    for queue_item in escalated:
+        queue_item_changed("updated", queue_item)
+    
+    return {
+        "since": since,
+        "patients_scored": len(results),
+        "queue_items_escalated": len(escalated),
+        "scores": results
+    }
+
+# Device Vitals Ingestion
+@app.post("/api/v1/vitals/ingest")
+async def ingest_vitals(request: Request, current_user: User = Depends(get_current_user)):
+    """Accept an NDJSON stream of device readings; they are written in batches by the ingest buffer"""
+    if current_user.role not in [RoleEnum.NURSE, RoleEnum.DOCTOR]:
+        raise HTTPException(status_code=403, detail="Only nurses and doctors can record vitals")
+    
+    accepted = 0
+    errors = []
+    async for index, reading in iter_ndjson(request.stream()):
+        try:
+            if isinstance(reading, Exception):
+                raise reading
+            # Waiting here while the queue is full stops reading the body, pushing back on the device
+            await vitals_ingest_buffer.submit(build_vitals_document(reading, current_user.username))
+            accepted += 1
+        except IngestBackpressure:
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": "1"},
+                content={"detail": "Vitals ingest queue is full", "accepted": accepted, "resume_from_row": index, "errors": errors}
+            )
+        except (ValueError, TypeError) as e:
+            errors.append({"row": index, "error": str(e)})
+    
+    return {"accepted": accepted, "errors": errors}
+
+@app.websocket("/api/v1/vitals/ingest/ws")
+async def ingest_vitals_stream(websocket: WebSocket, token: str = Query(...)):
+    """Stream device readings over a WebSocket; each frame holds one reading or NDJSON lines"""
+    try:
+        current_user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if current_user.role not in [RoleEnum.NURSE, RoleEnum.DOCTOR]:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    try:
+        while True:
+            frame = await websocket.receive_text()
+            accepted = 0
+            errors = []
+            for index, reading in iter_ndjson_lines(frame.splitlines()):
+                try:
+                    if isinstance(reading, Exception):
+                        raise reading
+                    await vitals_ingest_buffer.submit(build_vitals_document(reading, current_user.username))
+                    accepted += 1
+                except IngestBackpressure:
+                    errors.append({"row": index, "error": "Vitals ingest queue is full"})
+                except (ValueError, TypeError) as e:
+                    errors.append({"row": index, "error": str(e)})
+            await websocket.send_json({"accepted": accepted, "errors": errors})
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/api/v1/vitals/ingest/stats")
+async def get_vitals_ingest_stats(current_user: User = Depends(get_current_user)):
+    """Queue depth, batch sizes and ingest throughput of the device ingestion path"""
+    return vitals_ingest_buffer.stats()
 
 # Queue Management (New Feature)
+def queue_item_changed(event_type: str, queue_item: Dict[str, Any]):
+    """Apply a queue write to this worker's call order and, without a change stream, to live displays"""
+    queue_engine.apply(queue_item)
+    wait_estimator.mark_dirty(queue_item["doctor_id"])
+    if not QUEUE_CHANGE_STREAM:
+        queue_broadcaster.publish_item(event_type, queue_item)
+
 async def add_to_queue(appointment_id: ObjectId, patient_uid: int, doctor_id: str, priority: PriorityEnum):
     try:
         queue_collection = get_queue_collection()
         
-        # Get next queue number for this doctor
-        last_queue = await queue_collection.find_one(
-            {"doctor_id": doctor_id}, 
-            sort=[("queue_number", -1)]
-        )
-        next_queue_number = (last_queue["queue_number"] + 1) if last_queue else 1
+        # Numbers come from a per-doctor, per-day counter document so concurrent
+        # bookings can never be handed the same number
+        queue_day = queue_day_today()
+        next_queue_number = await allocate_queue_number(doctor_id, queue_day)
         
         queue_item = Queue(
             appointment_id=appointment_id,
             patient_uid=patient_uid,
             doctor_id=doctor_id,
             queue_number=next_queue_number,
+            queue_day=queue_day,
             status=StatusEnum.PENDING,
             priority=priority
         )
         
         queue_dict = queue_item.dict(by_alias=True)
         await queue_collection.insert_one(queue_dict)
-        print(f"✅ Added to queue: Patient {patient_uid} - Queue #{next_queue_number} for Doctor {doctor_id}")
+        await record_queue_status_change(get_stats_collection(), None, queue_dict["status"])
+        queue_item_changed("added", queue_dict)
+        logger.info("Added to queue", extra={"patient_uid": patient_uid, "doctor_id": doctor_id, "queue_number": next_queue_number})
     except Exception as e:
-        print(f"❌ Error adding to queue: {e}")
+        logger.exception("Error adding to queue")
 
 @app.get("/api/v1/queue/doctor/{doctor_id}", response_model=List[Queue])
-async def get_doctor_queue(doctor_id: str, current_user: User = Depends(get_current_user)):
+async def get_doctor_queue(
+    doctor_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    after = decode_cursor(cursor, QUEUE_SORT)
+    projection = parse_fields(fields, Queue)
     queue_collection = get_queue_collection()
-    queue_cursor = queue_collection.find({"doctor_id": doctor_id}).sort("queue_number", 1)
-    queue_list = await queue_cursor.to_list(length=100)
-    return [Queue(**queue_item) for queue_item in queue_list]
+    queue_list, next_cursor = await fetch_page(
+        queue_collection, {"doctor_id": doctor_id}, QUEUE_SORT, limit, after, projection
+    )
+    return page_response(queue_list, next_cursor)
 
 @app.put("/api/v1/queue/{queue_id}/update")
 async def update_queue_status(queue_id: str, update_data: QueueUpdate, current_user: User = Depends(get_current_user)):
@@ -324,23 +700,94 @@ async def update_queue_status(queue_id: str, update_data: QueueUpdate, current_u
     elif update_data.status == StatusEnum.COMPLETED:
         update_dict["served_at"] = datetime.utcnow()
     
-    result = await queue_collection.update_one(
+    previous_item = await queue_collection.find_one_and_update(
         {"_id": ObjectId(queue_id)}, 
-        {"$set": update_dict}
+        {"$set": update_dict},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if previous_item is None:
         raise HTTPException(status_code=404, detail="Queue item not found")
     
+    queue_item = {**previous_item, **update_dict}
+    if update_data.status == StatusEnum.COMPLETED:
+        wait_estimator.observe(queue_item["doctor_id"], queue_item.get("called_at"), queue_item.get("served_at"))
+    await record_queue_status_change(get_stats_collection(), previous_item.get("status"), queue_item["status"])
+    
+    queue_item_changed("updated", queue_item)
+    
     return {"message": "Queue status updated successfully"}
 
+@app.get("/api/v1/queue/doctor/{doctor_id}/next")
+async def get_next_in_queue(
+    doctor_id: str,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """Who the doctor should call next: pending patients by priority, then arrival, with aging.
+
+    Answered from the in-memory queue engine without a database round-trip.
+    """
+    upcoming = queue_engine.ordered_for(doctor_id, limit)
+    return {
+        "doctor_id": doctor_id,
+        "waiting": queue_engine.waiting(doctor_id),
+        "average_consultation_minutes": round(wait_estimator.service_minutes(doctor_id), 1),
+        "next": encode_document(upcoming[0]) if upcoming else None,
+        "upcoming": [encode_document(queue_item) for queue_item in upcoming]
+    }
+
+@app.websocket("/api/v1/queue/doctor/{doctor_id}/stream")
+async def stream_doctor_queue(websocket: WebSocket, doctor_id: str, token: str = Query(...)):
+    """Push queue deltas for one doctor; browsers cannot set headers, so the JWT comes as ?token="""
+    try:
+        await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    events = queue_broadcaster.subscribe(doctor_id)
+    # Confirm the subscription so the display loads the full queue only once no delta can be missed
+    await websocket.send_json({"event": "subscribed", "doctor_id": doctor_id})
+    
+    async def forward_events():
+        while True:
+            await websocket.send_json(await events.get())
+    
+    forwarder = asyncio.create_task(forward_events())
+    try:
+        # Displays never send anything; receiving only serves to notice disconnects
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        queue_broadcaster.unsubscribe(doctor_id, events)
+        forwarder.cancel()
+        # Collect the forwarder's outcome; a send that failed because the display went away is expected
+        await asyncio.gather(forwarder, return_exceptions=True)
+
+@app.get("/api/v1/queue/stream/stats")
+async def get_queue_stream_stats(current_user: User = Depends(get_current_user)):
+    """Subscriber and event counters for the live queue fanout"""
+    return queue_broadcaster.stats()
+
 # Doctor Management
 @app.get("/api/v1/doctors", response_model=List[Doctor])
-async def get_doctors(current_user: User = Depends(get_current_user)):
+async def get_doctors(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    after = decode_cursor(cursor, DOCTORS_SORT)
+    projection = parse_fields(fields, Doctor)
     doctors_collection = get_doctors_collection()
-    doctors_cursor = doctors_collection.find({"is_available": True})
-    doctors_list = await doctors_cursor.to_list(length=100)
-    return [Doctor(**doctor) for doctor in doctors_list]
+    doctors_list, next_cursor = await fetch_page(
+        doctors_collection, {"is_available": True}, DOCTORS_SORT, limit, after, projection
+    )
+    return page_response(doctors_list, next_cursor)
 
 @app.get("/api/v1/doctors/{doctor_id}", response_model=Doctor)
 async def get_doctor(doctor_id: str, current_user: User = Depends(get_current_user)):
@@ -354,33 +801,10 @@ async def get_doctor(doctor_id: str, current_user: User = Depends(get_current_us
 @app.get("/api/v1/doctors/{doctor_id}/queue/print")
 async def print_doctor_queue(doctor_id: str, current_user: User = Depends(get_current_user)):
     try:
-        queue_collection = get_queue_collection()
-        patients_collection = get_patients_collection()
-        appointments_collection = get_appointments_collection()
-        
-        # Get queue for this doctor
-        queue_cursor = queue_collection.find({"doctor_id": doctor_id}).sort("queue_number", 1)
-        queue_list = await queue_cursor.to_list(length=100)
+        # Queue, patient names and appointment times come back joined in one aggregation
+        queue_with_patients = await get_doctor_queue_details(doctor_id, limit=100)
         
-        # Get patient details for each queue item
-        queue_with_patients = []
-        for queue_item in queue_list:
-            patient_data = await patients_collection.find_one({"patient_uid": queue_item["patient_uid"]})
-            appointment_data = await appointments_collection.find_one({"_id": queue_item["appointment_id"]})
-            
-            queue_with_patients.append({
-                "queue_number": queue_item["queue_number"],
-                "patient_uid": queue_item["patient_uid"],
-                "patient_name": f"{patient_data.get('first_name', '')} {patient_data.get('last_name', '')}" if patient_data else "Unknown",
-                "status": queue_item["status"],
-                "priority": queue_item["priority"],
-                "appointment_time": appointment_data.get("appointment_time") if appointment_data else None,
-                "created_at": queue_item["created_at"]
-            })
-        
-        print(f"📋 Doctor {doctor_id} Queue Print:")
-        for item in queue_with_patients:
-            print(f"  #{item['queue_number']}: {item['patient_name']} (ID: {item['patient_uid']}) - {item['status']} - {item['priority']}")
+        logger.info("Doctor queue printed", extra={"doctor_id": doctor_id, "total_patients": len(queue_with_patients)})
         
         return {
             "doctor_id": doctor_id,
@@ -389,31 +813,73 @@ async def print_doctor_queue(doctor_id: str, current_user: User = Depends(get_cu
             "printed_at": datetime.utcnow()
         }
     except Exception as e:
-        print(f"❌ Error printing doctor queue: {e}")
+        logger.exception("Error printing doctor queue")
         raise HTTPException(status_code=500, detail=f"Error printing doctor queue: {str(e)}")
 
+# Data Export
+@app.get("/api/v1/export/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    doctor_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream a whole collection (optionally a date range / one doctor) as NDJSON, CSV or Parquet"""
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Cannot export {collection}")
+    if collection == "patients" and current_user.role != RoleEnum.RECEPTION:
+        raise HTTPException(status_code=403, detail="Only reception staff can export patients")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed")
+    try:
+        query = export_filter(collection, start, end, doctor_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Unsorted, so the server streams batches in natural order instead of sorting the whole range
+    cursor = get_analytics_database()[collection].find(query).batch_size(EXPORT_BATCH_SIZE)
+    return StreamingResponse(
+        stream_export(cursor, collection, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{collection}.{format}"'}
+    )
+
+@app.get("/api/v1/db/pool/stats")
+async def get_db_pool_stats(current_user: User = Depends(get_current_user)):
+    """Connection pool usage per MongoDB server"""
+    return pool_metrics.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition: request/Mongo histograms plus cache, pool, queue and ingest stats"""
+    pool = pool_metrics.stats()
+    gauges = {
+        "auth_cache": {(): principal_cache.stats()},
+        "queue_engine": {(): queue_engine.stats()},
+        "wait_estimator": {(): wait_estimator.stats()},
+        "slot_scheduler": {(): slot_scheduler.stats()},
+        "patient_search": {(): patient_search_index.stats()},
+        "queue_stream": {(): queue_broadcaster.stats()},
+        "vitals_ingest": {(): vitals_ingest_buffer.stats()},
+        "mongo_pool": {(("server", server),): server_stats for server, server_stats in pool["servers"].items()},
+        "mongo_pool_config": {(): {"max_pool_size": pool["max_pool_size"]}}
+    }
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
 # Dashboard Statistics
 @app.get("/api/v1/dashboard/stats")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     try:
-        patients_collection = get_patients_collection()
-        appointments_collection = get_appointments_collection()
-        queue_collection = get_queue_collection()
+        # Counters are maintained incrementally by the write endpoints; this is one point read
+        stats_document = await get_analytics_database().stats.find_one({"_id": DASHBOARD_STATS_ID})
+        if stats_document is None:
+            stats_document = await reconcile_stats(
+                get_stats_collection(), get_patients_collection(), get_appointments_collection(), get_queue_collection()
+            )
         
-        total_patients = await patients_collection.count_documents({})
-        today_appointments = await appointments_collection.count_documents({
-            "appointment_time": {
-                "$gte": datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
-                "$lt": datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
-            }
-        })
-        pending_queue = await queue_collection.count_documents({"status": StatusEnum.PENDING})
-        
-        return {
-            "total_patients": total_patients,
-            "today_appointments": today_appointments,
-            "pending_queue": pending_queue
-        }
+        return dashboard_view(stats_document)
     except Exception as e:
-        print(f"❌ Error getting dashboard stats: {e}")
-        raise HTTPException(status_code=500, detail=f"Error getting dashboard stats: {str(e)}")
+        logger.exception("Error getting dashboard stats")
+        raise HTTPException(status_code=500, detail=f"Error getting dashboard stats: {str(e)}")
\ No newline at end of file
@@ -4,17 +4,20 @@ from fastapi.middleware.cors import CORSMiddleware
 from database_simple import (
     get_users_collection, get_patients_collection, get_appointments_collection,
     get_vitals_collection, get_queue_collection, get_doctors_collection,
-    initialize_default_data
+    initialize_default_data, get_doctor_queue_details, get_patient_uid_allocator,
+    start_snapshots, close_durable_store
 )
 from models import (
     Patient, Appointment, Vitals, Queue, Doctor, User, 
-    StatusEnum, RoleEnum, PriorityEnum, generate_patient_uid
+    StatusEnum, RoleEnum, PriorityEnum
 )
 import uuid
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, RedirectResponse, JSONResponse
 from jose import JWTError, jwt
-from security import verify_password, create_access_token, get_password_hash, SECRET_KEY, ALGORITHM
+from serializers import DocumentResponse, DocumentListResponse
+from dedup import add_dedup_keys, find_duplicates_in_store
+from security import verify_password, verify_password_async, shutdown_hash_pool, create_access_token, get_password_hash, SECRET_KEY, ALGORITHM
 from datetime import timedelta, datetime
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
@@ -84,13 +87,20 @@ async def read_vitals():
 async def read_queue():
     return FileResponse('static/queue.html')
 
+snapshot_task: Optional[asyncio.Task] = None
+
 @app.on_event("startup")
 async def on_startup():
+    global snapshot_task
     await initialize_default_data()
+    snapshot_task = start_snapshots()
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    pass
+    if snapshot_task:
+        snapshot_task.cancel()
+    await close_durable_store()
+    shutdown_hash_pool()
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
@@ -108,6 +118,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         user_data = users_collection.get(username)
         if user_data is None:
             raise credentials_exception
+        if not user_data.get("is_active", True):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Account is deactivated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         
         # Convert to User model
         user = User(**user_data)
@@ -120,7 +136,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     users_collection = get_users_collection()
     user_data = users_collection.get(form_data.username)
     
-    if not user_data or not verify_password(form_data.password, user_data["hashed_password"]):
+    if not user_data or not await verify_password_async(form_data.password, user_data["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -143,19 +159,23 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 # Patient Management
 @app.post("/api/v1/patients/register", response_model=Patient)
-async def register_patient(patient: Patient, current_user: User = Depends(get_current_user)):
-    # Generate unique patient UID
+async def register_patient(patient: Patient, allow_duplicate: bool = False, current_user: User = Depends(get_current_user)):
     patients_collection = get_patients_collection()
     
-    # Ensure patient_uid is unique
-    while True:
-        patient.patient_uid = generate_patient_uid()
-        if patient.patient_uid not in patients_collection:
-            break
+    # Same duplicate check as the Mongo backend: returning patients are offered their existing records
+    if not allow_duplicate:
+        duplicates = find_duplicates_in_store(patients_collection, patient.dict())
+        if duplicates:
+            return DocumentResponse(
+                {"detail": "Patient may already be registered", "duplicates": duplicates}, status_code=409
+            )
+    
+    # Allocated UIDs are unique by construction
+    patient.patient_uid = await get_patient_uid_allocator().next_uid()
     
     patient_dict = patient.dict(by_alias=True)
-    patients_collection[patient.patient_uid] = patient_dict
-    return Patient(**patient_dict)
+    patients_collection[patient.patient_uid] = add_dedup_keys(dict(patient_dict))
+    return DocumentResponse(patient_dict)
 
 @app.get("/api/v1/patients/{patient_uid}", response_model=Patient)
 async def get_patient(patient_uid: int, current_user: User = Depends(get_current_user)):
@@ -190,7 +210,7 @@ async def book_appointment(appointment_data: AppointmentCreate, current_user: Us
     appointment_id = str(uuid.uuid4())
     appointments_collection[appointment_id] = appointment_dict
     
-    return Appointment(**appointment_dict)
+    return DocumentResponse(appointment_dict)
 
 @app.get("/api/v1/appointments/{appointment_id}", response_model=Appointment)
 async def get_appointment(appointment_id: str, current_user: User = Depends(get_current_user)):
@@ -225,14 +245,25 @@ async def record_vitals(vitals_data: VitalsInput, current_user: User = Depends(g
     vitals_dict = vitals.dict(by_alias=True)
     vitals_id = str(uuid.uuid4())
     vitals_collection[vitals_id] = vitals_dict
-    return Vitals(**vitals_dict)
+    return DocumentResponse(vitals_dict)
 
 @app.get("/api/v1/vitals/patient/{patient_uid}", response_model=List[Vitals])
 async def get_patient_vitals(patient_uid: int, current_user: User = Depends(get_current_user)):
     vitals_collection = get_vitals_collection()
-    vitals_list = [Vitals(**vitals) for vitals in vitals_collection.values() 
-                   if vitals.get("patient_uid") == patient_uid]
-    return vitals_list
+    patient_vitals = sorted(vitals_collection.find("patient_uid", patient_uid),
+                            key=lambda vitals: vitals["recorded_at"], reverse=True)
+    return DocumentListResponse(patient_vitals)
+
+# Doctor Queue Printing
+@app.get("/api/v1/doctors/{doctor_id}/queue/print")
+async def print_doctor_queue(doctor_id: str, current_user: User = Depends(get_current_user)):
+    queue_with_patients = await get_doctor_queue_details(doctor_id, limit=100)
+    return {
+        "doctor_id": doctor_id,
+        "queue": queue_with_patients,
+        "total_patients": len(queue_with_patients),
+        "printed_at": datetime.utcnow()
+    }
 
 # Dashboard Statistics
 @app.get("/api/v1/dashboard/stats")
@@ -242,10 +273,8 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     queue_collection = get_queue_collection()
     
     total_patients = len(patients_collection)
-    today_appointments = len([a for a in appointments_collection.values() 
-                             if a.get("appointment_time", "").startswith(str(datetime.now().date()))])
-    pending_queue = len([q for q in queue_collection.values() 
-                        if q.get("status") == "PENDING"])
+    today_appointments = appointments_collection.count("appointment_date", datetime.now().date())
+    pending_queue = queue_collection.count("status", StatusEnum.PENDING)
     
     return {
         "total_patients": total_patients,
@@ -0,0 +1,132 @@
+from collections import defaultdict
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+# Maps a stored document to the value it is indexed under (None means "not indexed")
+KeyFunction = Callable[[Dict[str, Any]], Any]
+
+# Called as listener(op, key, document) after every write; op is "set", "del" or "clear"
+ChangeListener = Callable[[str, Any, Optional[Dict[str, Any]]], None]
+
+
+def field(name: str) -> KeyFunction:
+    """Index documents on a top-level field"""
+    def key(document):
+        value = document.get(name)
+        return value.value if isinstance(value, Enum) else value
+    return key
+
+
+def date_of(name: str) -> KeyFunction:
+    """Index documents on the calendar day of a datetime (or ISO string) field"""
+    def key(document):
+        value = document.get(name)
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        if isinstance(value, str) and len(value) >= 10:
+            try:
+                return date.fromisoformat(value[:10])
+            except ValueError:
+                return None
+        return None
+    return key
+
+
+class IndexedCollection(dict):
+    """A dict of documents that maintains secondary indexes on every write.
+
+    Reads and writes through the normal dict API keep the indexes current. Stored
+    documents are never mutated in place: update_document stores an updated copy,
+    so they are re-indexed and reported to the change listener, and snapshots can
+    serialize them from another thread.
+    """
+
+    def __init__(self, indexes: Optional[Dict[str, KeyFunction]] = None):
+        super().__init__()
+        self._key_functions: Dict[str, KeyFunction] = dict(indexes or {})
+        self._indexes: Dict[str, Dict[Any, Set[Any]]] = {name: defaultdict(set) for name in self._key_functions}
+        self.listener: Optional[ChangeListener] = None
+
+    def _notify(self, op, key=None, document=None):
+        if self.listener is not None:
+            self.listener(op, key, document)
+
+    def _add_to_indexes(self, key, document):
+        for name, key_function in self._key_functions.items():
+            value = key_function(document)
+            if value is not None:
+                self._indexes[name][value].add(key)
+
+    def _remove_from_indexes(self, key, document):
+        for name, key_function in self._key_functions.items():
+            value = key_function(document)
+            if value is None:
+                continue
+            keys = self._indexes[name].get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._indexes[name][value]
+
+    def __setitem__(self, key, document):
+        if key in self:
+            self._remove_from_indexes(key, dict.__getitem__(self, key))
+        super().__setitem__(key, document)
+        self._add_to_indexes(key, document)
+        self._notify("set", key, document)
+
+    def __delitem__(self, key):
+        self._remove_from_indexes(key, dict.__getitem__(self, key))
+        super().__delitem__(key)
+        self._notify("del", key)
+
+    def pop(self, key, *default):
+        if key in self:
+            document = dict.__getitem__(self, key)
+            del self[key]
+            return document
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        key, document = super().popitem()
+        self._remove_from_indexes(key, document)
+        self._notify("del", key)
+        return key, document
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, document in dict(*args, **kwargs).items():
+            self[key] = document
+
+    def clear(self):
+        super().clear()
+        for index in self._indexes.values():
+            index.clear()
+        self._notify("clear")
+
+    def update_document(self, key, changes: Dict[str, Any]):
+        """Store a copy of a document with field changes applied"""
+        document = {**dict.__getitem__(self, key), **changes}
+        self[key] = document
+        return document
+
+    def keys_for(self, index: str, value) -> Iterable[Any]:
+        if isinstance(value, Enum):
+            value = value.value
+        return self._indexes[index].get(value, ())
+
+    def find(self, index: str, value) -> List[Dict[str, Any]]:
+        """All documents whose indexed value equals `value`"""
+        return [dict.__getitem__(self, key) for key in self.keys_for(index, value)]
+
+    def count(self, index: str, value) -> int:
+        return len(self.keys_for(index, value))
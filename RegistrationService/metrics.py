@@ -0,0 +1,203 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import monitoring
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the per-request Mongo round-trip histogram
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label set, in the Prometheus exposition model"""
+
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[Labels, List] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum and count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", LATENCY_BUCKETS
+)
+http_request_mongo_round_trips = Histogram(
+    "http_request_mongo_round_trips", "MongoDB commands issued while serving one HTTP request", ROUND_TRIP_BUCKETS
+)
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round-trip time by command", LATENCY_BUCKETS
+)
+
+
+class RequestMongoStats:
+    """Mongo round-trips made on behalf of the current request"""
+
+    __slots__ = ("commands", "seconds", "_lock")
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.commands += 1
+            self.seconds += seconds
+
+
+# Motor copies the caller's context onto its worker threads, so command events can
+# find the request that issued them
+current_request_stats: ContextVar[Optional[RequestMongoStats]] = ContextVar("current_request_stats", default=None)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every Mongo command and attributes it to the HTTP request that issued it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures: Dict[str, int] = {}
+
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_duration.observe(seconds, (("command", event.command_name),))
+        request_stats = current_request_stats.get()
+        if request_stats is not None:
+            request_stats.add(seconds)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+        with self._lock:
+            self.failures[event.command_name] = self.failures.get(event.command_name, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = ["# HELP mongo_command_failures_total Failed MongoDB commands by command",
+                 "# TYPE mongo_command_failures_total counter"]
+        with self._lock:
+            failures = dict(self.failures)
+        for command, count in sorted(failures.items()):
+            lines.append(f"mongo_command_failures_total{_labels((('command', command),))} {count}")
+        return lines
+
+
+command_metrics = CommandMetrics()
+
+http_requests_in_progress = 0
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request end to end, including streamed bodies"""
+
+    def __init__(self, app, on_request=None):
+        self.app = app
+        # Optional callback(scope, route, status, seconds, mongo_stats), e.g. for access logging
+        self.on_request = on_request
+
+    async def __call__(self, scope, receive, send):
+        global http_requests_in_progress
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        request_stats = RequestMongoStats()
+        token = current_request_stats.set(request_stats)
+        http_requests_in_progress += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_progress -= 1
+            current_request_stats.reset(token)
+            # Label by route template so path parameters don't create a series per patient
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            labels = (("method", scope["method"]), ("route", route_path), ("status", str(status_code)))
+            http_request_duration.observe(elapsed, labels)
+            http_request_mongo_round_trips.observe(request_stats.commands, (("route", route_path),))
+            if self.on_request is not None:
+                self.on_request(scope, route_path, status_code, elapsed, request_stats)
+
+
+def render_gauges(prefix: str, rows: Dict[Labels, Dict[str, Any]]) -> List[str]:
+    """Numeric entries of component stats() dicts as gauges, one sample per label set.
+
+    Non-numeric and nested values are skipped.
+    """
+    samples: Dict[str, List[str]] = {}
+    for labels, values in rows.items():
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            samples.setdefault(f"{prefix}_{key}", []).append(f"{prefix}_{key}{_labels(labels)} {value}")
+    lines = []
+    for name, name_samples in samples.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(name_samples)
+    return lines
+
+
+def render_metrics(gauges: Dict[str, Dict[Labels, Dict[str, Any]]]) -> str:
+    """Prometheus text exposition of every histogram plus component stats as gauges"""
+    lines = []
+    for histogram in (http_request_duration, http_request_mongo_round_trips, mongo_command_duration):
+        lines.extend(histogram.render())
+    lines.extend(command_metrics.render())
+    lines.extend(["# TYPE http_requests_in_progress gauge", f"http_requests_in_progress {http_requests_in_progress}"])
+    for prefix, rows in gauges.items():
+        lines.extend(render_gauges(prefix, rows))
+    return "\n".join(lines) + "\n"
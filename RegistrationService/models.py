@@ -1,5 +1,4 @@
 import uuid
-import random
 from datetime import date, datetime
 from enum import Enum
 from typing import Optional, List, Dict, Any
@@ -19,9 +18,16 @@ class PyObjectId(ObjectId):
         return ObjectId(v)
 
     @classmethod
-    def __get_pydantic_json_schema__(cls, field_schema):
-        field_schema.update(type="string")
-        return field_schema
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        # pydantic 2 no longer calls __get_validators__; validate the same way and serialize as a string
+        from pydantic_core import core_schema
+        return core_schema.no_info_plain_validator_function(
+            cls.validate, serialization=core_schema.plain_serializer_function_ser_schema(str, when_used="json")
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {"type": "string"}
 
 class RoleEnum(str, Enum):
     DOCTOR = "DOCTOR"
@@ -42,9 +48,6 @@ class PriorityEnum(str, Enum):
     HIGH = "HIGH"
     URGENT = "URGENT"
 
-def generate_patient_uid():
-    return random.randint(100_000_000_00, 999_999_999_99)
-
 class User(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     username: str = Field(..., unique=True)
@@ -129,6 +132,7 @@ class Queue(BaseModel):
     patient_uid: int
     doctor_id: str
     queue_number: int
+    queue_day: Optional[str] = None  # YYYY-MM-DD the queue number was issued for
     status: StatusEnum
     priority: PriorityEnum
     estimated_wait_time: Optional[int] = None  # minutes
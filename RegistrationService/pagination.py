@@ -0,0 +1,88 @@
+import base64
+from typing import Optional, List, Tuple, Dict, Any
+from bson import json_util
+from fastapi import HTTPException, Response
+from serializers import DocumentListResponse
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Keyset sort orders; each ends in a unique field so the cursor position is unambiguous
+PATIENTS_SORT = [("created_at", -1), ("_id", -1)]
+VITALS_SORT = [("recorded_at", -1), ("_id", -1)]
+QUEUE_SORT = [("queue_day", 1), ("queue_number", 1)]
+DOCTORS_SORT = [("doctor_id", 1)]
+
+def encode_cursor(document: Dict[str, Any], sort: List[Tuple[str, int]]) -> str:
+    """Opaque cursor holding the sort key values of the last document on a page"""
+    values = [document.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: Optional[str], sort: List[Tuple[str, int]]) -> Optional[list]:
+    if not cursor:
+        return None
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(sort: List[Tuple[str, int]], after: list) -> Dict[str, Any]:
+    """Filter matching documents strictly after `after` in the given sort order"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {sort[j][0]: after[j] for j in range(i)}
+        if after[i] is None:
+            # Missing values sort first and $gt/$lt never match null, so handle them explicitly
+            if direction == -1:
+                continue
+            clause[field] = {"$ne": None}
+        else:
+            clause[field] = {"$gt" if direction == 1 else "$lt": after[i]}
+        clauses.append(clause)
+    return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+def parse_fields(fields: Optional[str], model) -> Optional[Dict[str, int]]:
+    """Turn a comma-separated `fields` parameter into a Mongo projection"""
+    if not fields:
+        return None
+    allowed = set(model.__fields__)
+    projection = {}
+    for name in (f.strip() for f in fields.split(",")):
+        if not name:
+            continue
+        if name not in allowed:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {name}")
+        projection["_id" if name == "id" else name] = 1
+    return projection or None
+
+async def fetch_page(collection, query: Dict[str, Any], sort: List[Tuple[str, int]], limit: int,
+                     after: Optional[list] = None, projection: Optional[Dict[str, int]] = None):
+    """Fetch one keyset page; returns (documents, next_cursor)"""
+    if after is not None:
+        query = {"$and": [query, keyset_filter(sort, after)]}
+    if projection is not None:
+        # Sort keys are always needed to build the next cursor
+        projection = {**projection, **{field: 1 for field, _ in sort}}
+
+    cursor = collection.find(query, projection).sort(sort).limit(limit + 1)
+    documents = await cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], sort)
+    return documents, next_cursor
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+def page_response(documents: List[Dict[str, Any]], next_cursor: Optional[str]) -> DocumentListResponse:
+    """Return a page of raw documents, serialized without building or re-validating models"""
+    response = DocumentListResponse(content=documents)
+    set_next_cursor(response, next_cursor)
+    return response
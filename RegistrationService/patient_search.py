@@ -0,0 +1,367 @@
+import asyncio
+import bisect
+import heapq
+import re
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from app_logging import logger
+from config import PATIENT_SEARCH_REFRESH_SECONDS, PATIENT_SEARCH_REFRESH_OVERLAP_SECONDS
+
+NAME_TOKEN = re.compile(r"[^\W\d_]+")
+NON_DIGIT = re.compile(r"\D")
+
+# Tokens shorter than this are only matched exactly or by prefix; typos in them are too ambiguous
+TYPO_MIN_LENGTH = 4
+# Vocabulary tokens a query token may expand to by prefix, and patients a single query token may touch
+PREFIX_EXPANSION = 64
+MAX_TOKEN_CANDIDATES = 100000
+# Number matches rank above name matches: exact UID, then exact phone, phone suffix, UID prefix
+UID_EXACT_SCORE = 4.0
+PHONE_EXACT_SCORE = 3.0
+PHONE_SUFFIX_SCORE = 2.0
+UID_PREFIX_SCORE = 1.5
+# Fields read to index a patient, and fields returned for each hit
+INDEX_PROJECTION = {"_id": 0, "patient_uid": 1, "first_name": 1, "last_name": 1, "contact_number": 1, "created_at": 1}
+SEARCH_PROJECTION = {"_id": 1, "patient_uid": 1, "first_name": 1, "last_name": 1, "dob": 1, "contact_number": 1}
+# Patients read per query when catching up on ones the incremental refresh missed
+CATCH_UP_BATCH_SIZE = 1000
+
+
+def name_tokens(*names: Optional[str]) -> List[str]:
+    tokens = []
+    for name in names:
+        for token in NAME_TOKEN.findall((name or "").lower()):
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
+
+def phone_digits(phone: Optional[str]) -> str:
+    return NON_DIGIT.sub("", phone or "")
+
+
+def deletes(token: str) -> List[str]:
+    """The token with each single character removed"""
+    return [token[:i] + token[i + 1:] for i in range(len(token))]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent transpositions count once), capped at limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _merge_pairs(keys: List[str], values: List[Any], tail: List[Tuple[str, Any]]) -> Tuple[List[str], List[Any]]:
+    merged = list(heapq.merge(zip(keys, values), sorted(tail)))
+    return [key for key, _ in merged], [value for _, value in merged]
+
+
+class PrefixIndex:
+    """Sorted (key, value) pairs answering prefix lookups by binary search.
+
+    New pairs collect in a short unsorted tail that lookups scan, and are merged into the
+    sorted lists once the tail reaches merge_every, so single inserts stay cheap. On an event
+    loop the merge runs in the default executor and is swapped in when done; pairs added
+    meanwhile stay in the tail.
+    """
+
+    def __init__(self, merge_every: int = 4096):
+        self.merge_every = merge_every
+        self._keys: List[str] = []
+        self._values: List[Any] = []
+        self._tail: List[Tuple[str, Any]] = []
+        self._merging: Optional[asyncio.Future] = None
+        # Bumped by synchronous merges, so a background merge started before one is discarded
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._keys) + len(self._tail)
+
+    def add(self, key: str, value: Any, merge: bool = True):
+        self._tail.append((key, value))
+        if merge and len(self._tail) >= self.merge_every and self._merging is None:
+            self._merge_in_background()
+
+    def _merge_in_background(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.merge()
+            return
+        count, generation = len(self._tail), self._generation
+        self._merging = loop.run_in_executor(None, _merge_pairs, self._keys, self._values, self._tail[:count])
+
+        def finish(future):
+            self._merging = None
+            if generation != self._generation or future.cancelled():
+                return
+            if future.exception() is not None:
+                logger.error("Error merging search index", exc_info=future.exception())
+                return
+            self._keys, self._values = future.result()
+            del self._tail[:count]
+
+        self._merging.add_done_callback(finish)
+
+    def merge(self):
+        if not self._tail:
+            return
+        self._keys, self._values = _merge_pairs(self._keys, self._values, self._tail)
+        self._tail = []
+        self._generation += 1
+
+    def lookup(self, prefix: str, limit: int) -> List[Tuple[str, Any]]:
+        """Up to `limit` pairs whose key starts with prefix, in key order"""
+        matches = []
+        position = bisect.bisect_left(self._keys, prefix)
+        while position < len(self._keys) and len(matches) < limit and self._keys[position].startswith(prefix):
+            matches.append((self._keys[position], self._values[position]))
+            position += 1
+        matches.extend(pair for pair in self._tail if pair[0].startswith(prefix))
+        matches.sort()
+        return matches[:limit]
+
+
+class PatientSearchIndex:
+    """In-process index for reception lookups by name, phone suffix or UID prefix.
+
+    Names are split into tokens; each distinct token keeps the patients carrying it, and the
+    vocabulary is searchable exactly, by prefix (typing in progress) and within one edit
+    (a single-character deletion index, so transpositions and typos are found without
+    scanning). Phones are indexed reversed so suffixes become prefixes. Only identifiers and
+    tokens are held in memory; the hits are read from Mongo by patient_uid.
+    """
+
+    def __init__(self, refresh_overlap_seconds: float = PATIENT_SEARCH_REFRESH_OVERLAP_SECONDS):
+        self.refresh_overlap = timedelta(seconds=refresh_overlap_seconds)
+        self._reset()
+        self.searches = 0
+        self.catch_ups = 0
+
+    def _reset(self):
+        self._patients: Set[int] = set()
+        self._token_ids: Dict[str, int] = {}
+        self._tokens: List[str] = []
+        # Patient UIDs per token as int64 arrays, so scoring can view them with NumPy without copying
+        self._token_patients: List[array] = []
+        self._vocabulary = PrefixIndex()
+        self._token_deletes: Dict[str, List[int]] = {}
+        self._uids = PrefixIndex()
+        self._phones = PrefixIndex()
+        self._loaded_until: Optional[datetime] = None
+        # Collection size when the index last caught up on everything, so a count that can't be
+        # matched (e.g. rows without a patient_uid) doesn't trigger a catch-up on every refresh
+        self._caught_up_at = 0
+        self.ready = False
+
+    def __len__(self):
+        return len(self._patients)
+
+    def _token_id(self, token: str, merge: bool) -> int:
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            token_id = self._token_ids[token] = len(self._tokens)
+            self._tokens.append(token)
+            self._token_patients.append(array("q"))
+            self._vocabulary.add(token, token_id, merge)
+            if len(token) >= TYPO_MIN_LENGTH:
+                for variant in deletes(token):
+                    self._token_deletes.setdefault(variant, []).append(token_id)
+        return token_id
+
+    def add(self, patient: Dict[str, Any], merge: bool = True) -> bool:
+        """Index one patient document; already indexed patients are skipped"""
+        uid = patient.get("patient_uid")
+        if uid is None or uid in self._patients:
+            return False
+        self._patients.add(uid)
+        for token in name_tokens(patient.get("first_name"), patient.get("last_name")):
+            self._token_patients[self._token_id(token, merge)].append(uid)
+        self._uids.add(str(uid), uid, merge)
+        digits = phone_digits(patient.get("contact_number"))
+        if digits:
+            self._phones.add(digits[::-1], uid, merge)
+        created_at = patient.get("created_at")
+        if created_at is not None and (self._loaded_until is None or created_at > self._loaded_until):
+            self._loaded_until = created_at
+        return True
+
+    async def rebuild(self, patients_collection) -> int:
+        """Load every patient; called once at startup"""
+        self._reset()
+        async for patient in patients_collection.find({}, INDEX_PROJECTION).batch_size(10000):
+            # Sorting once at the end is far cheaper than merging every few thousand rows
+            self.add(patient, merge=False)
+        for index in (self._vocabulary, self._uids, self._phones):
+            index.merge()
+        self.ready = True
+        return len(self._patients)
+
+    async def refresh(self, patients_collection) -> int:
+        """Pick up patients registered through other workers since the newest one indexed.
+
+        Rows can be stamped well before they are inserted (a slow bulk import) or by a worker with
+        a skewed clock, so a window of refresh_overlap before the newest one is re-read; re-adds are
+        skipped by UID. Anything older than that shows up as a collection larger than the index and
+        is caught up with a scan of UIDs.
+        """
+        query = {}
+        if self._loaded_until is not None:
+            query = {"created_at": {"$gte": self._loaded_until - self.refresh_overlap}}
+        added = 0
+        async for patient in patients_collection.find(query, INDEX_PROJECTION):
+            added += self.add(patient)
+        total = await patients_collection.estimated_document_count()
+        if total > max(len(self._patients), self._caught_up_at):
+            added += await self._catch_up(patients_collection)
+            self._caught_up_at = total
+        return added
+
+    async def _catch_up(self, patients_collection) -> int:
+        missing = [
+            patient["patient_uid"]
+            async for patient in patients_collection.find({}, {"_id": 0, "patient_uid": 1}).batch_size(10000)
+            if patient.get("patient_uid") is not None and patient["patient_uid"] not in self._patients
+        ]
+        added = 0
+        for start in range(0, len(missing), CATCH_UP_BATCH_SIZE):
+            query = {"patient_uid": {"$in": missing[start:start + CATCH_UP_BATCH_SIZE]}}
+            async for patient in patients_collection.find(query, INDEX_PROJECTION):
+                added += self.add(patient)
+        self.catch_ups += 1
+        if added:
+            logger.warning("Patient search index caught up on patients the refresh missed", extra={"patients": added})
+        return added
+
+    async def run(self, patients_collection, interval: float = PATIENT_SEARCH_REFRESH_SECONDS):
+        """Background job: build the index, then keep it in step with registrations on other workers.
+
+        Building a large index takes a while, so it runs here instead of delaying startup;
+        searches made meanwhile see the patients loaded so far.
+        """
+        try:
+            loaded = await self.rebuild(patients_collection)
+            logger.info("Patient search index built", extra={"patients": loaded})
+        except Exception:
+            logger.exception("Error building patient search index")
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(patients_collection)
+            except Exception:
+                logger.exception("Error refreshing patient search index")
+
+    def _token_matches(self, query_token: str) -> Dict[int, float]:
+        """Vocabulary tokens similar to a query token, with a similarity in (0, 1]"""
+        matches: Dict[int, float] = {}
+        exact = self._token_ids.get(query_token)
+        if exact is not None:
+            matches[exact] = 1.0
+
+        # Shorter completions are closer to what was typed, so they are taken first
+        completions = self._vocabulary.lookup(query_token, PREFIX_EXPANSION * 4)
+        completions.sort(key=lambda pair: len(pair[0]))
+        for token, token_id in completions[:PREFIX_EXPANSION]:
+            matches.setdefault(token_id, 0.5 + 0.5 * len(query_token) / len(token))
+
+        # Tokens one deletion away from the query, and with a query long enough, tokens sharing
+        # a deletion with it or equal to one of its deletions
+        candidates = set(self._token_deletes.get(query_token, ()))
+        if len(query_token) >= TYPO_MIN_LENGTH:
+            for variant in deletes(query_token):
+                candidates.update(self._token_deletes.get(variant, ()))
+                variant_id = self._token_ids.get(variant)
+                if variant_id is not None:
+                    candidates.add(variant_id)
+        for token_id in candidates:
+            if token_id in matches:
+                continue
+            token = self._tokens[token_id]
+            if edit_distance(query_token, token, 1) <= 1:
+                matches[token_id] = 1.0 - 1.0 / max(len(token), len(query_token))
+        return matches
+
+    def _search_name(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Each matching patient's similarity averaged over the query tokens, as (uids, scores)"""
+        uid_parts, score_parts = [], []
+        for query_token in query_tokens:
+            postings, similarities, candidates = [], [], 0
+            for token_id, similarity in sorted(self._token_matches(query_token).items(), key=lambda match: -match[1]):
+                if candidates >= MAX_TOKEN_CANDIDATES:
+                    break
+                uids = np.frombuffer(self._token_patients[token_id], dtype=np.int64)
+                postings.append(uids)
+                similarities.append(np.full(len(uids), similarity))
+                candidates += len(uids)
+            if not postings:
+                continue
+            # Matches are in descending similarity, so a patient's first occurrence is its best one
+            uids, first = np.unique(np.concatenate(postings), return_index=True)
+            uid_parts.append(uids)
+            score_parts.append(np.concatenate(similarities)[first])
+        if not uid_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        uids, inverse = np.unique(np.concatenate(uid_parts), return_inverse=True)
+        return uids, np.bincount(inverse, weights=np.concatenate(score_parts)) / len(query_tokens)
+
+    def _search_number(self, digits: str, limit: int) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for key, uid in self._uids.lookup(digits, limit):
+            scores[uid] = UID_EXACT_SCORE if key == digits else UID_PREFIX_SCORE
+        reversed_digits = digits[::-1]
+        for key, uid in self._phones.lookup(reversed_digits, limit):
+            score = PHONE_EXACT_SCORE if key == reversed_digits else PHONE_SUFFIX_SCORE
+            scores[uid] = max(scores.get(uid, 0.0), score)
+        return scores
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """Best (patient_uid, score) pairs for a name, phone or UID query, best first"""
+        self.searches += 1
+        query_tokens = name_tokens(query)
+        if query_tokens:
+            uids, scores = self._search_name(query_tokens)
+            # np.unique returns UIDs ascending and the sort is stable, so ties go to the lower UID
+            best = np.argsort(-scores, kind="stable")[:limit]
+            return list(zip(uids[best].tolist(), scores[best].tolist()))
+        digits = phone_digits(query)
+        scores = self._search_number(digits, limit) if digits else {}
+        return heapq.nsmallest(limit, scores.items(), key=lambda hit: (-hit[1], hit[0]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "patients": len(self._patients),
+            "name_tokens": len(self._tokens),
+            "phones": len(self._phones),
+            "searches": self.searches,
+            "catch_ups": self.catch_ups,
+            "ready": self.ready
+        }
+
+
+async def search_patients(patients_collection, index: PatientSearchIndex, query: str, limit: int) -> List[Dict[str, Any]]:
+    """Ranked hits for a query, read from Mongo in one round trip and returned in rank order"""
+    hits = index.search(query, limit)
+    if not hits:
+        return []
+    documents = {
+        document["patient_uid"]: document
+        async for document in patients_collection.find({"patient_uid": {"$in": [uid for uid, _ in hits]}}, SEARCH_PROJECTION)
+    }
+    return [{**documents[uid], "score": round(score, 3)} for uid, score in hits if uid in documents]
+
+
+patient_search_index = PatientSearchIndex()
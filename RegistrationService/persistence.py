@@ -0,0 +1,183 @@
+import asyncio
+import os
+import shutil
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict
+import msgpack
+from bson import ObjectId
+from memory_store import IndexedCollection
+from app_logging import logger
+
+SNAPSHOT_FILE = "snapshot.msgpack"
+LOG_FILE = "wal.msgpack"
+# The log being folded into a snapshot; only left behind if the process stops mid-snapshot
+PREVIOUS_LOG_FILE = "wal.prev.msgpack"
+
+# msgpack extension type codes for values BSON documents carry but msgpack lacks
+_EXT_DATETIME = 1
+_EXT_DATE = 2
+_EXT_OBJECT_ID = 3
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode())
+    if isinstance(value, date):
+        return msgpack.ExtType(_EXT_DATE, value.isoformat().encode())
+    if isinstance(value, ObjectId):
+        return msgpack.ExtType(_EXT_OBJECT_ID, value.binary)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Cannot persist value of type {type(value).__name__}")
+
+
+def _decode(code, data):
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == _EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == _EXT_OBJECT_ID:
+        return ObjectId(data)
+    return msgpack.ExtType(code, data)
+
+
+def _pack(value) -> bytes:
+    return msgpack.packb(value, default=_encode, use_bin_type=True)
+
+
+def _unpacker(file) -> msgpack.Unpacker:
+    return msgpack.Unpacker(file, ext_hook=_decode, raw=False, strict_map_key=False)
+
+
+class DurableStore:
+    """Write-ahead log plus periodic compact snapshots for the in-memory collections"""
+
+    def __init__(self, data_dir: str, collections: Dict[str, IndexedCollection], fsync: bool = False):
+        self.data_dir = data_dir
+        self.collections = collections
+        self.fsync = fsync
+        self.snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+        self.log_path = os.path.join(data_dir, LOG_FILE)
+        self.previous_log_path = os.path.join(data_dir, PREVIOUS_LOG_FILE)
+        self.log_records = 0
+        self._log = None
+
+    def restore(self) -> Dict[str, Any]:
+        """Load the latest snapshot, then replay the log written since it was taken"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        started = datetime.utcnow()
+        snapshot_rows = 0
+        replayed = 0
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = next(_unpacker(f))
+            for name, rows in snapshot.items():
+                collection = self.collections.get(name)
+                if collection is None:
+                    continue
+                for key, document in rows:
+                    collection[key] = document
+                snapshot_rows += len(rows)
+
+        for log_path in (self.previous_log_path, self.log_path):
+            if os.path.exists(log_path):
+                replayed += self._replay(log_path)
+
+        self.log_records = replayed
+        return {
+            "snapshot_rows": snapshot_rows,
+            "replayed_records": replayed,
+            "seconds": (datetime.utcnow() - started).total_seconds()
+        }
+
+    def _replay(self, log_path: str) -> int:
+        replayed = 0
+        with open(log_path, "r+b") as f:
+            unpacker = _unpacker(f)
+            good_offset = 0
+            try:
+                for op, name, key, document in unpacker:
+                    self._apply(op, name, key, document)
+                    replayed += 1
+                    good_offset = unpacker.tell()
+            except (ValueError, TypeError, msgpack.UnpackException):
+                pass
+            # Cut off a torn final record from a crash mid-write so new records append cleanly
+            if f.seek(0, os.SEEK_END) > good_offset:
+                logger.warning("Discarding truncated record at the end of the log", extra={"log_path": log_path})
+                f.truncate(good_offset)
+        return replayed
+
+    def _apply(self, op, name, key, document):
+        collection = self.collections.get(name)
+        if collection is None:
+            return
+        if op == "set":
+            collection[key] = document
+        elif op == "del":
+            collection.pop(key, None)
+        elif op == "clear":
+            collection.clear()
+
+    def attach(self):
+        """Start logging every write made to the collections"""
+        self._log = open(self.log_path, "ab")
+        for name, collection in self.collections.items():
+            collection.listener = self._make_listener(name)
+
+    def _make_listener(self, name):
+        def listener(op, key, document):
+            self._log.write(_pack([op, name, key, document]))
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            self.log_records += 1
+        return listener
+
+    async def snapshot(self):
+        """Write a compact snapshot of every collection and start a fresh log"""
+        # Copying the item lists and rotating the log happen together on the event loop,
+        # so the snapshot holds exactly the writes in the rotated log
+        rows = {name: list(collection.items()) for name, collection in self.collections.items()}
+        if self._log is not None:
+            self._log.close()
+        if os.path.exists(self.previous_log_path):
+            # An earlier snapshot failed part-way; fold this log onto the one it left behind
+            with open(self.previous_log_path, "ab") as previous, open(self.log_path, "rb") as current:
+                shutil.copyfileobj(current, previous)
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.previous_log_path)
+        self._log = open(self.log_path, "ab")
+        self.log_records = 0
+
+        # Documents are never mutated in place, so packing can run off the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_snapshot, rows)
+        os.remove(self.previous_log_path)
+
+    def _write_snapshot(self, rows):
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(_pack(rows))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+async def run_snapshots(store: DurableStore, interval_seconds: float):
+    """Periodically compact the log into a snapshot while there are new writes"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        if store.log_records:
+            try:
+                await store.snapshot()
+            except Exception:
+                logger.exception("Error writing snapshot")
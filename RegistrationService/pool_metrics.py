@@ -0,0 +1,83 @@
+import threading
+from typing import Any, Dict
+from pymongo import monitoring
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters per server, fed by the driver's pool events.
+
+    Motor runs the driver on worker threads, so the callbacks update under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Dict[str, int]] = {}
+        # Set by connect_to_mongo so utilization can be reported against the configured limit
+        self.max_pool_size = None
+
+    def _server(self, address) -> Dict[str, int]:
+        key = f"{address[0]}:{address[1]}"
+        server = self._servers.get(key)
+        if server is None:
+            server = self._servers[key] = {
+                "open": 0, "checked_out": 0, "peak_checked_out": 0, "created": 0, "closed": 0,
+                "checkouts": 0, "checkout_failures": 0, "pool_cleared": 0
+            }
+        return server
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._server(event.address)["pool_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["created"] += 1
+            server["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["closed"] += 1
+            server["open"] -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._server(event.address)["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["checkouts"] += 1
+            server["checked_out"] += 1
+            server["peak_checked_out"] = max(server["peak_checked_out"], server["checked_out"])
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._server(event.address)["checked_out"] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            servers = {key: dict(server) for key, server in self._servers.items()}
+        if self.max_pool_size:
+            for server in servers.values():
+                server["utilization"] = round(server["checked_out"] / self.max_pool_size, 3)
+        return {"max_pool_size": self.max_pool_size, "servers": servers}
+
+
+pool_metrics = PoolMetrics()
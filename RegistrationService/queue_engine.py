@@ -0,0 +1,234 @@
+import asyncio
+import heapq
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from models import StatusEnum, PriorityEnum
+from app_logging import logger
+from config import QUEUE_PRIORITY_AGING_MINUTES, QUEUE_PRIORITY_MAX_PROMOTION, QUEUE_ENGINE_REFRESH_SECONDS
+
+PRIORITY_RANK = {
+    PriorityEnum.URGENT.value: 0,
+    PriorityEnum.HIGH.value: 1,
+    PriorityEnum.MEDIUM.value: 2,
+    PriorityEnum.LOW.value: 3,
+}
+
+# (priority rank, arrival timestamp, queue_day, queue_number, item id)
+HeapEntry = Tuple[int, float, str, int, str]
+
+
+def queue_day_today() -> str:
+    """The queue_day new queue items are issued for"""
+    return datetime.now().date().isoformat()
+
+
+def heap_entry(queue_item: Dict[str, Any]) -> HeapEntry:
+    created_at = queue_item.get("created_at") or datetime.utcnow()
+    priority = queue_item.get("priority")
+    rank = PRIORITY_RANK.get(getattr(priority, "value", priority), PRIORITY_RANK[PriorityEnum.MEDIUM.value])
+    return rank, created_at.timestamp(), queue_item.get("queue_day") or "", queue_item["queue_number"], str(queue_item["_id"])
+
+
+def call_key(entry: HeapEntry, now: float, aging_seconds: float, max_promotion: int) -> HeapEntry:
+    """Order by priority, then arrival; waiting promotes a patient by at most max_promotion levels.
+
+    Every aging_seconds waited counts as one level up, but never past the cap and never into
+    URGENT, so a long wait can only move a patient ahead of newer patients of nearby priorities.
+    """
+    rank = entry[0]
+    if aging_seconds > 0 and rank > PRIORITY_RANK[PriorityEnum.URGENT.value]:
+        promotion = min(int((now - entry[1]) // aging_seconds), max_promotion)
+        rank = max(rank - max(promotion, 0), PRIORITY_RANK[PriorityEnum.HIGH.value])
+    return (rank,) + entry[1:]
+
+
+def call_order(queue_items: List[Dict[str, Any]], aging_seconds: float, max_promotion: int) -> List[int]:
+    """Positions of queue_items in call order, as call_key orders them, in one vectorized pass"""
+    if not queue_items:
+        return []
+    entries = [heap_entry(queue_item) for queue_item in queue_items]
+    ranks = np.array([entry[0] for entry in entries], dtype=np.int64)
+    arrivals = np.array([entry[1] for entry in entries], dtype=np.float64)
+    numbers = np.array([entry[3] for entry in entries], dtype=np.int64)
+    if aging_seconds > 0:
+        waited = datetime.utcnow().timestamp() - arrivals
+        promotion = np.clip(waited // aging_seconds, 0, max_promotion).astype(np.int64)
+        promoted = np.maximum(ranks - promotion, PRIORITY_RANK[PriorityEnum.HIGH.value])
+        ranks = np.where(ranks > PRIORITY_RANK[PriorityEnum.URGENT.value], promoted, ranks)
+    return np.lexsort((numbers, arrivals, ranks)).tolist()
+
+
+class DoctorQueueHeap:
+    """Pending items of one doctor's queue, one heap per priority rank, with lazy deletion.
+
+    Each rank's heap is in arrival order, so its top is also the one aged the most and the next
+    call is the best of at most four tops. Changing an item pushes a fresh entry and leaves the
+    old one in its heap; stale entries are skipped when they reach the top and purged once they
+    outnumber live ones.
+    """
+
+    def __init__(self):
+        self._heaps: Dict[int, List[HeapEntry]] = {}
+        self._items: Dict[str, Tuple[HeapEntry, Dict[str, Any]]] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def upsert(self, entry: HeapEntry, queue_item: Dict[str, Any]):
+        current = self._items.get(entry[4])
+        self._items[entry[4]] = (entry, queue_item)
+        if current is None or current[0] != entry:
+            heapq.heappush(self._heaps.setdefault(entry[0], []), entry)
+            self._compact()
+
+    def remove(self, item_id: str):
+        if self._items.pop(item_id, None) is not None:
+            self._compact()
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        current = self._items.get(item_id)
+        return current[1] if current is not None else None
+
+    def _is_live(self, entry: HeapEntry) -> bool:
+        current = self._items.get(entry[4])
+        return current is not None and current[0] == entry
+
+    def peek(self, key: Callable[[HeapEntry], HeapEntry]) -> Optional[Dict[str, Any]]:
+        tops = []
+        for heap in self._heaps.values():
+            while heap and not self._is_live(heap[0]):
+                heapq.heappop(heap)
+            if heap:
+                tops.append(heap[0])
+        if not tops:
+            return None
+        return self._items[min(tops, key=key)[4]][1]
+
+    def ordered(self, limit: int, key: Callable[[HeapEntry], HeapEntry]) -> List[Dict[str, Any]]:
+        entries = heapq.nsmallest(limit, (entry for entry, _ in self._items.values()), key=key)
+        return [self._items[entry[4]][1] for entry in entries]
+
+    def _compact(self):
+        if sum(len(heap) for heap in self._heaps.values()) > 2 * len(self._items) + 32:
+            self._heaps = {}
+            for entry, _ in self._items.values():
+                self._heaps.setdefault(entry[0], []).append(entry)
+            for heap in self._heaps.values():
+                heapq.heapify(heap)
+
+
+class QueueEngine:
+    """Per-doctor priority heaps of today's pending queue items, kept in step with Mongo.
+
+    Writes made through this worker are applied as they happen. Writes made through other
+    workers arrive through the change stream or, without one, through the periodic reload
+    in run. At day rollover the heaps are emptied, since items left pending are never called.
+    """
+
+    def __init__(self, aging_minutes: float = QUEUE_PRIORITY_AGING_MINUTES,
+                 max_promotion: int = QUEUE_PRIORITY_MAX_PROMOTION):
+        self.aging_seconds = aging_minutes * 60
+        self.max_promotion = max_promotion
+        self._doctors: Dict[str, DoctorQueueHeap] = {}
+        self._doctor_of: Dict[str, str] = {}
+        self._day = queue_day_today()
+        # Items applied while a reload is reading Mongo, re-applied on top of what it read
+        self._applied_during_rebuild: Optional[List[Dict[str, Any]]] = None
+        self.rebuilds = 0
+
+    async def rebuild(self, queue_collection) -> int:
+        """Reload today's pending items; the heaps are swapped in once the read completes"""
+        day = queue_day_today()
+        self._applied_during_rebuild = []
+        try:
+            queue_items = await queue_collection.find({"status": StatusEnum.PENDING, "queue_day": day}).to_list(length=None)
+        finally:
+            applied, self._applied_during_rebuild = self._applied_during_rebuild, None
+        self._doctors, self._doctor_of, self._day = {}, {}, day
+        for queue_item in queue_items + applied:
+            self.apply(queue_item)
+        self.rebuilds += 1
+        return len(queue_items)
+
+    async def run(self, queue_collection, interval: float = QUEUE_ENGINE_REFRESH_SECONDS):
+        """Background job reloading the heaps, for deployments without the change stream"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.rebuild(queue_collection)
+            except Exception:
+                logger.exception("Error reloading queue call order")
+
+    def _roll_over(self):
+        today = queue_day_today()
+        if today != self._day:
+            self._doctors, self._doctor_of, self._day = {}, {}, today
+
+    def apply(self, queue_item: Dict[str, Any]):
+        """Reflect an inserted or updated queue item; O(log n)"""
+        self._roll_over()
+        if self._applied_during_rebuild is not None:
+            self._applied_during_rebuild.append(queue_item)
+        item_id = str(queue_item["_id"])
+        doctor_id = queue_item["doctor_id"]
+        previous_doctor = self._doctor_of.get(item_id)
+        if previous_doctor is not None and previous_doctor != doctor_id:
+            self._remove(item_id)
+
+        if queue_item.get("status") != StatusEnum.PENDING or queue_item.get("queue_day") != self._day:
+            self._remove(item_id)
+            return
+
+        self._doctors.setdefault(doctor_id, DoctorQueueHeap()).upsert(heap_entry(queue_item), queue_item)
+        self._doctor_of[item_id] = doctor_id
+
+    def _remove(self, item_id: str):
+        doctor_id = self._doctor_of.pop(item_id, None)
+        if doctor_id is None:
+            return
+        heap = self._doctors[doctor_id]
+        heap.remove(item_id)
+        if not heap:
+            del self._doctors[doctor_id]
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """The pending item as last applied, or None once it left the queue"""
+        doctor_id = self._doctor_of.get(item_id)
+        return self._doctors[doctor_id].get(item_id) if doctor_id is not None else None
+
+    def doctor_ids(self) -> List[str]:
+        self._roll_over()
+        return list(self._doctors)
+
+    def _call_key(self) -> Callable[[HeapEntry], HeapEntry]:
+        now = datetime.utcnow().timestamp()
+        return lambda entry: call_key(entry, now, self.aging_seconds, self.max_promotion)
+
+    def next_for(self, doctor_id: str) -> Optional[Dict[str, Any]]:
+        self._roll_over()
+        heap = self._doctors.get(doctor_id)
+        return heap.peek(self._call_key()) if heap is not None else None
+
+    def ordered_for(self, doctor_id: str, limit: int) -> List[Dict[str, Any]]:
+        self._roll_over()
+        heap = self._doctors.get(doctor_id)
+        return heap.ordered(limit, self._call_key()) if heap is not None else []
+
+    def waiting(self, doctor_id: str) -> int:
+        self._roll_over()
+        heap = self._doctors.get(doctor_id)
+        return len(heap) if heap is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "doctors": len(self._doctors),
+            "pending": len(self._doctor_of),
+            "aging_minutes": self.aging_seconds / 60,
+            "max_promotion": self.max_promotion,
+            "queue_day": self._day,
+            "rebuilds": self.rebuilds
+        }
+
+
+queue_engine = QueueEngine()
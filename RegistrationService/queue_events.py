@@ -0,0 +1,121 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Set, Any
+from pymongo.errors import OperationFailure
+from utils import encode_document
+from app_logging import logger
+from config import QUEUE_STREAM_BUFFER_SIZE
+
+# Change stream errors after which the resume token can't be used again
+CHANGE_STREAM_FATAL_ERROR = 280
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+class QueueBroadcaster:
+    """In-process pub/sub fanout of queue deltas to per-doctor subscribers"""
+
+    def __init__(self, buffer_size: int = QUEUE_STREAM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.published = 0
+        self.resyncs = 0
+
+    def subscribe(self, doctor_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.buffer_size)
+        self._subscribers[doctor_id].add(queue)
+        return queue
+
+    def unsubscribe(self, doctor_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(doctor_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[doctor_id]
+
+    def publish(self, doctor_id: str, event: Dict[str, Any]):
+        """Push an event to every subscriber of a doctor's queue without blocking"""
+        self.published += 1
+        for queue in self._subscribers.get(doctor_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow display fell behind; replace its backlog with a resync marker
+                # so it reloads the full queue instead of applying stale deltas
+                self._resync(doctor_id, queue)
+
+    def _resync(self, doctor_id: str, queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({"event": "resync", "doctor_id": doctor_id})
+        self.resyncs += 1
+
+    def resync_all(self):
+        """Tell every subscriber to reload, e.g. after changes may have been missed"""
+        for doctor_id, queues in self._subscribers.items():
+            for queue in queues:
+                self._resync(doctor_id, queue)
+
+    def publish_item(self, event_type: str, queue_item: Dict[str, Any]):
+        self.publish(queue_item["doctor_id"], {
+            "event": event_type,
+            "doctor_id": queue_item["doctor_id"],
+            "item": encode_document(queue_item)
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "doctors": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "resyncs": self.resyncs
+        }
+
+
+queue_broadcaster = QueueBroadcaster()
+
+
+async def watch_queue_changes(queue_collection, on_change=None, on_resync=None,
+                              initial_backoff: float = 1.0, max_backoff: float = 30.0):
+    """Feed the broadcaster (and on_change, if given) from a Mongo change stream so every worker sees every change.
+
+    The stream is reopened with exponential backoff whenever it fails, resuming after the last
+    change seen. If it has to restart without a usable resume token, changes may have been
+    missed, so on_resync (an async callable, e.g. rebuilding in-memory state) is awaited and
+    every subscriber is told to reload.
+    """
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    resume_token = None
+    missed_changes = False
+    backoff = initial_backoff
+    while True:
+        try:
+            async with queue_collection.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                if missed_changes:
+                    if on_resync is not None:
+                        await on_resync()
+                    queue_broadcaster.resync_all()
+                    missed_changes = False
+                resume_token = stream.resume_token
+                async for change in stream:
+                    backoff = initial_backoff
+                    resume_token = stream.resume_token
+                    queue_item = change.get("fullDocument")
+                    if not queue_item:
+                        continue
+                    event_type = "added" if change["operationType"] == "insert" else "updated"
+                    if on_change is not None:
+                        on_change(queue_item)
+                    queue_broadcaster.publish_item(event_type, queue_item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, OperationFailure) and e.code in (CHANGE_STREAM_FATAL_ERROR, CHANGE_STREAM_HISTORY_LOST):
+                resume_token = None
+            if resume_token is None:
+                missed_changes = True
+            logger.exception("Queue change stream failed, reopening", extra={
+                "retry_in_seconds": backoff, "resuming": resume_token is not None
+            })
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, max_backoff)
@@ -0,0 +1,240 @@
+import asyncio
+import heapq
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+from models import StatusEnum
+from app_logging import logger
+from config import APPOINTMENT_SLOT_MINUTES, SCHEDULER_HORIZON_DAYS, SCHEDULER_REFRESH_SECONDS
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+class OutsideWorkingHours(Exception):
+    """Raised when a booking falls outside the doctor's working hours"""
+
+
+class SlotUnavailable(Exception):
+    """Raised when the requested slot is already booked"""
+
+
+def _minutes(value: str) -> int:
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class DoctorSchedule:
+    """A doctor's working hours as (first slot minute, slot count) per weekday"""
+
+    def __init__(self, doctor: Dict[str, Any], slot_minutes: int):
+        self.doctor_id = doctor["doctor_id"]
+        self.name = doctor.get("name")
+        self.specialization = doctor.get("specialization")
+        self.is_available = doctor.get("is_available", True)
+        self.days: Dict[int, Tuple[int, int]] = {}
+        for weekday, hours in (doctor.get("working_hours") or {}).items():
+            if weekday.lower() not in WEEKDAYS or not isinstance(hours, dict):
+                continue
+            try:
+                start, end = _minutes(hours["start"]), _minutes(hours["end"])
+            except (KeyError, ValueError, AttributeError):
+                continue
+            if end > start:
+                self.days[WEEKDAYS.index(weekday.lower())] = (start, (end - start) // slot_minutes)
+
+    def day(self, day: date) -> Optional[Tuple[int, int]]:
+        return self.days.get(day.weekday())
+
+
+class SlotScheduler:
+    """Fixed-length appointment slots with a booked-slot bitmap per doctor per day.
+
+    The bitmaps answer availability searches from memory. Bookings are made atomic by
+    a slot_reservations document whose _id is the slot, so two workers racing for the
+    same slot cannot both insert it. Each worker re-reads upcoming reservations every few
+    seconds so searches also reflect bookings made through other workers.
+    """
+
+    def __init__(self, slot_minutes: int = APPOINTMENT_SLOT_MINUTES, horizon_days: int = SCHEDULER_HORIZON_DAYS):
+        self.slot_minutes = slot_minutes
+        self.horizon_days = horizon_days
+        self._doctors: Dict[str, DoctorSchedule] = {}
+        self._booked: Dict[Tuple[str, date], int] = {}
+        # Slots held by appointments at startup, kept so refreshes from reservations don't drop
+        # appointments booked before reservations existed
+        self._appointment_slots: Dict[Tuple[str, date], int] = {}
+
+    async def load(self, doctors_collection, appointments_collection) -> int:
+        """Read doctors and every upcoming slot-holding appointment; called at startup"""
+        self._doctors = {}
+        async for doctor in doctors_collection.find({}):
+            self.add_doctor(doctor)
+
+        today = datetime.combine(date.today(), datetime.min.time())
+        booked: Dict[Tuple[str, date], int] = {}
+        loaded = 0
+        cursor = appointments_collection.find(
+            {"appointment_time": {"$gte": today}, "is_walk_in": {"$ne": True}, "status": {"$ne": StatusEnum.CANCELLED}},
+            {"_id": 0, "doctor_id": 1, "appointment_time": 1}
+        )
+        async for appointment in cursor:
+            loaded += self._mark(booked, appointment["doctor_id"], appointment["appointment_time"])
+        self._appointment_slots = booked
+        self._booked = dict(booked)
+        return loaded
+
+    async def refresh(self, reservations_collection) -> int:
+        """Rebuild the bitmaps from startup appointments plus current reservations within the horizon"""
+        today = datetime.combine(date.today(), datetime.min.time())
+        booked = dict(self._appointment_slots)
+        reserved = 0
+        cursor = reservations_collection.find(
+            {"slot_start": {"$gte": today, "$lt": today + timedelta(days=self.horizon_days)}},
+            {"_id": 0, "doctor_id": 1, "slot_start": 1}
+        )
+        async for reservation in cursor:
+            reserved += self._mark(booked, reservation["doctor_id"], reservation["slot_start"])
+        self._booked = booked
+        return reserved
+
+    async def run(self, reservations_collection, interval: float = SCHEDULER_REFRESH_SECONDS):
+        """Background job keeping the bitmaps in step with bookings made through other workers"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(reservations_collection)
+            except Exception:
+                logger.exception("Error refreshing appointment slots")
+
+    def _mark(self, booked: Dict[Tuple[str, date], int], doctor_id: str, when: datetime) -> int:
+        try:
+            day, index, _ = self.slot_for(doctor_id, when)
+        except OutsideWorkingHours:
+            return 0
+        if index is None:
+            return 0
+        booked[(doctor_id, day)] = booked.get((doctor_id, day), 0) | (1 << index)
+        return 1
+
+    def add_doctor(self, doctor: Dict[str, Any]):
+        self._doctors[doctor["doctor_id"]] = DoctorSchedule(doctor, self.slot_minutes)
+
+    def slot_for(self, doctor_id: str, when: datetime) -> Tuple[date, Optional[int], Optional[datetime]]:
+        """The slot containing a time: (day, slot index, slot start).
+
+        The index is None when the doctor is unknown or has no working hours configured,
+        in which case bookings are not slot-checked.
+        """
+        day = when.date()
+        schedule = self._doctors.get(doctor_id)
+        if schedule is None or not schedule.days:
+            return day, None, None
+        hours = schedule.day(day)
+        offset = when.hour * 60 + when.minute - (hours[0] if hours else 0)
+        if hours is None or offset < 0 or offset // self.slot_minutes >= hours[1]:
+            raise OutsideWorkingHours(f"Doctor {doctor_id} is not working at {when.isoformat()}")
+        index = offset // self.slot_minutes
+        start = datetime.combine(day, datetime.min.time()) + timedelta(minutes=hours[0] + index * self.slot_minutes)
+        return day, index, start
+
+    def _set(self, doctor_id: str, day: date, index: int):
+        self._booked[(doctor_id, day)] = self._booked.get((doctor_id, day), 0) | (1 << index)
+
+    def _clear(self, doctor_id: str, day: date, index: int):
+        key = (doctor_id, day)
+        booked = self._booked.get(key, 0) & ~(1 << index)
+        if booked:
+            self._booked[key] = booked
+        else:
+            self._booked.pop(key, None)
+
+    def is_booked(self, doctor_id: str, day: date, index: int) -> bool:
+        return bool(self._booked.get((doctor_id, day), 0) >> index & 1)
+
+    @staticmethod
+    def reservation_id(doctor_id: str, slot_start: datetime) -> str:
+        return f"{doctor_id}|{slot_start:%Y-%m-%dT%H:%M}"
+
+    async def reserve(self, reservations_collection, doctor_id: str, when: datetime) -> Optional[str]:
+        """Claim the slot containing `when`; returns the reservation id, or None if unchecked"""
+        day, index, slot_start = self.slot_for(doctor_id, when)
+        if index is None:
+            return None
+        if self.is_booked(doctor_id, day, index):
+            raise SlotUnavailable(f"Slot {slot_start:%Y-%m-%d %H:%M} with doctor {doctor_id} is already booked")
+
+        reservation_id = self.reservation_id(doctor_id, slot_start)
+        try:
+            await reservations_collection.insert_one({
+                "_id": reservation_id,
+                "doctor_id": doctor_id,
+                "slot_start": slot_start,
+                "created_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            # Booked through another worker since this one loaded its bitmaps
+            self._set(doctor_id, day, index)
+            raise SlotUnavailable(f"Slot {slot_start:%Y-%m-%d %H:%M} with doctor {doctor_id} is already booked")
+        self._set(doctor_id, day, index)
+        return reservation_id
+
+    async def release(self, reservations_collection, doctor_id: str, when: datetime):
+        """Give back a slot claimed by reserve, e.g. when the booking could not be saved"""
+        day, index, slot_start = self.slot_for(doctor_id, when)
+        if index is None:
+            return
+        await reservations_collection.delete_one({"_id": self.reservation_id(doctor_id, slot_start)})
+        self._clear(doctor_id, day, index)
+
+    def _free_slots(self, schedule: DoctorSchedule, after: datetime) -> Iterator[Tuple[datetime, str]]:
+        """A doctor's free slot starts after a time, in order, up to the horizon"""
+        for offset in range(self.horizon_days):
+            day = after.date() + timedelta(days=offset)
+            hours = schedule.day(day)
+            if hours is None:
+                continue
+            first_minute, count = hours
+            free = ((1 << count) - 1) & ~self._booked.get((schedule.doctor_id, day), 0)
+            if offset == 0:
+                # Drop slots that have already started
+                elapsed = after.hour * 60 + after.minute - first_minute
+                started = min(max(-(-elapsed // self.slot_minutes), 0), count)
+                free &= ~((1 << started) - 1)
+            midnight = datetime.combine(day, datetime.min.time())
+            while free:
+                lowest = free & -free
+                index = lowest.bit_length() - 1
+                yield midnight + timedelta(minutes=first_minute + index * self.slot_minutes), schedule.doctor_id
+                free ^= lowest
+
+    def next_free_slots(self, count: int, after: datetime, specialization: Optional[str] = None,
+                        doctor_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The earliest `count` free slots across matching doctors, merged in time order"""
+        schedules = [
+            schedule for schedule in self._doctors.values()
+            if schedule.is_available
+            and (doctor_id is None or schedule.doctor_id == doctor_id)
+            and (specialization is None or (schedule.specialization or "").lower() == specialization.lower())
+        ]
+        merged = heapq.merge(*(self._free_slots(schedule, after) for schedule in schedules))
+        return [
+            {
+                "doctor_id": slot_doctor_id,
+                "doctor_name": self._doctors[slot_doctor_id].name,
+                "specialization": self._doctors[slot_doctor_id].specialization,
+                "start": start,
+                "end": start + timedelta(minutes=self.slot_minutes)
+            }
+            for start, slot_doctor_id in islice(merged, count)
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "doctors": len(self._doctors),
+            "booked_doctor_days": len(self._booked),
+            "slot_minutes": self.slot_minutes
+        }
+
+
+slot_scheduler = SlotScheduler()
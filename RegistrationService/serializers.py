@@ -0,0 +1,53 @@
+from typing import Any, Dict, Iterable
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from utils import model_dates
+
+
+def _default(value):
+    # orjson handles datetime, date, time and Enum natively; only BSON types need help
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Cannot serialize value of type {type(value).__name__}")
+
+
+def _expose_id(document: Dict[str, Any]) -> Dict[str, Any]:
+    document = model_dates(document)
+    if "_id" in document:
+        return {("id" if key == "_id" else key): value for key, value in document.items()}
+    return document
+
+
+def dumps(value: Any) -> bytes:
+    """orjson encoding that also accepts ObjectId values"""
+    return orjson.dumps(value, default=_default)
+
+
+def dump_document(document: Dict[str, Any]) -> bytes:
+    """JSON bytes for a stored document, with `_id` exposed as `id` like encode_document"""
+    return dumps(_expose_id(document))
+
+
+def dump_documents(documents: Iterable[Dict[str, Any]]) -> bytes:
+    return dumps([_expose_id(document) for document in documents])
+
+
+class DocumentResponse(JSONResponse):
+    """Response for a document that was already validated when it was built for the insert.
+
+    Returning it from an endpoint skips the response_model re-validation, so write endpoints
+    build their document once and serialize that same dict straight to JSON.
+    """
+
+    def render(self, content: Dict[str, Any]) -> bytes:
+        return dump_document(content)
+
+
+class DocumentListResponse(JSONResponse):
+    """Raw Mongo documents encoded in one orjson call, without building a model per document"""
+
+    def render(self, content: Iterable[Dict[str, Any]]) -> bytes:
+        return dump_documents(content)
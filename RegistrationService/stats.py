@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ReturnDocument
+from models import StatusEnum
+from app_logging import logger
+from utils import naive_utc
+from config import STATS_RECONCILE_INTERVAL_SECONDS, STATS_DAYS_KEPT
+
+# A single document holds every dashboard counter so the dashboard is one point read
+DASHBOARD_STATS_ID = "dashboard"
+# Recounts retried when increments keep landing while the source collections are counted
+RECONCILE_ATTEMPTS = 3
+
+
+def _day_key(value: datetime) -> str:
+    """The UTC day of a datetime, as stored appointment times are UTC"""
+    return naive_utc(value).date().isoformat()
+
+
+def _utc_midnight() -> datetime:
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def _increment(stats_collection, increments):
+    # Every increment bumps the version, so a reconciliation that counted before it can tell
+    await stats_collection.update_one({"_id": DASHBOARD_STATS_ID}, {"$inc": {**increments, "version": 1}}, upsert=True)
+
+
+async def record_patients_registered(stats_collection, count: int = 1):
+    await _increment(stats_collection, {"total_patients": count})
+
+
+async def record_appointment_booked(stats_collection, appointment_time: datetime):
+    await _increment(stats_collection, {f"appointments_by_day.{_day_key(appointment_time)}": 1})
+
+
+async def record_queue_status_change(stats_collection, old_status: Optional[str], new_status: Optional[str]):
+    """Adjust the pending counter when a queue item enters or leaves PENDING"""
+    delta = int(new_status == StatusEnum.PENDING) - int(old_status == StatusEnum.PENDING)
+    if delta:
+        await _increment(stats_collection, {"pending_queue": delta})
+
+
+async def reconcile_stats(stats_collection, patients_collection, appointments_collection, queue_collection):
+    """Recount the counters from the source collections to correct any drift.
+
+    The counts are written with a compare-and-set on the document version, so an increment made
+    while they were being taken is never overwritten; the recount is retried instead. Per-day
+    appointment counters older than STATS_DAYS_KEPT days are dropped in the same write.
+    """
+    for _ in range(RECONCILE_ATTEMPTS):
+        document = await stats_collection.find_one_and_update(
+            {"_id": DASHBOARD_STATS_ID},
+            {"$setOnInsert": {"version": 0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        today = _utc_midnight()
+        total_patients = await patients_collection.count_documents({})
+        today_appointments = await appointments_collection.count_documents({
+            "appointment_time": {"$gte": today, "$lt": today + timedelta(days=1)}
+        })
+        pending_queue = await queue_collection.count_documents({"status": StatusEnum.PENDING})
+
+        oldest_kept = _day_key(today - timedelta(days=STATS_DAYS_KEPT))
+        update = {
+            "$set": {
+                "total_patients": total_patients,
+                "pending_queue": pending_queue,
+                f"appointments_by_day.{_day_key(today)}": today_appointments,
+                "reconciled_at": datetime.utcnow()
+            },
+            "$inc": {"version": 1}
+        }
+        stale_days = {
+            f"appointments_by_day.{day}": ""
+            for day in document.get("appointments_by_day", {}) if day < oldest_kept
+        }
+        if stale_days:
+            update["$unset"] = stale_days
+
+        # A missing version (documents from before it existed) matches None
+        reconciled = await stats_collection.find_one_and_update(
+            {"_id": DASHBOARD_STATS_ID, "version": document.get("version")},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+        if reconciled is not None:
+            return reconciled
+
+    logger.warning("Dashboard stats kept changing while being recounted; leaving them for the next run")
+    return await stats_collection.find_one({"_id": DASHBOARD_STATS_ID})
+
+
+def dashboard_view(document) -> dict:
+    return {
+        "total_patients": document.get("total_patients", 0),
+        "today_appointments": document.get("appointments_by_day", {}).get(_day_key(_utc_midnight()), 0),
+        "pending_queue": document.get("pending_queue", 0)
+    }
+
+
+async def run_stats_reconciliation(stats_collection, patients_collection, appointments_collection, queue_collection,
+                                   interval_seconds: float = STATS_RECONCILE_INTERVAL_SECONDS):
+    """Periodic reconciliation job started with the app"""
+    while True:
+        try:
+            await reconcile_stats(stats_collection, patients_collection, appointments_collection, queue_collection)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error reconciling dashboard stats")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+import main
+from auth_cache import principal_cache
+from models import RoleEnum, User
+from security import create_access_token
+
+
+def users_collection(monkeypatch):
+    collection = AsyncMongoMockClient()["test"]["users"]
+    monkeypatch.setattr(main, "get_users_collection", lambda: collection)
+    principal_cache.clear()
+    return collection
+
+
+def test_deactivated_user_is_rejected_and_never_cached(monkeypatch):
+    users = users_collection(monkeypatch)
+    user = User(username="nurse", hashed_password="x", role=RoleEnum.NURSE, is_active=False)
+    asyncio.run(users.insert_one(user.dict(by_alias=True)))
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(main.get_current_user(create_access_token({"sub": "nurse"})))
+    assert raised.value.status_code == 401
+    assert principal_cache.get("nurse") is None
+
+
+def test_deactivation_takes_effect_once_the_cached_user_is_dropped(monkeypatch):
+    users = users_collection(monkeypatch)
+    user = User(username="nurse", hashed_password="x", role=RoleEnum.NURSE)
+    asyncio.run(users.insert_one(user.dict(by_alias=True)))
+    token = create_access_token({"sub": "nurse"})
+
+    assert asyncio.run(main.get_current_user(token)).username == "nurse"
+    asyncio.run(users.update_one({"username": "nurse"}, {"$set": {"is_active": False}}))
+    principal_cache.invalidate("nurse")
+    with pytest.raises(HTTPException):
+        asyncio.run(main.get_current_user(token))
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import AutoReconnect
+from bulk_import import bulk_register_patients, iter_json_array
+
+
+class Allocator:
+    def __init__(self):
+        self.next = 10000000000
+
+    async def allocate(self, count):
+        uids = list(range(self.next, self.next + count))
+        self.next += count
+        return uids
+
+
+def rows(count):
+    return iter_json_array([
+        {"first_name": f"First{i}", "last_name": "Last", "dob": "1990-05-15", "contact_number": "555", "address": "x"}
+        for i in range(count)
+    ])
+
+
+def test_dob_is_stored_as_a_datetime():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["patients"]
+        result = await bulk_register_patients(collection, Allocator(), rows(3))
+        return result, await collection.find_one({})
+    result, stored = asyncio.run(run())
+    assert result["inserted"] == 3 and result["failed"] == 0 and result["aborted"] is None
+    assert stored["dob"] == datetime(1990, 5, 15)
+
+
+def test_failed_batch_stops_import_and_reports_what_was_inserted():
+    class FlakyCollection:
+        def __init__(self):
+            self.calls = 0
+            self.documents = []
+
+        async def insert_many(self, documents, ordered=True):
+            self.calls += 1
+            if self.calls == 2:
+                raise AutoReconnect("connection lost")
+            self.documents.extend(documents)
+
+    collection = FlakyCollection()
+    result = asyncio.run(bulk_register_patients(collection, Allocator(), rows(7), batch_size=3))
+    assert result["inserted"] == 3
+    assert [patient["row"] for patient in result["patients"]] == [0, 1, 2]
+    assert [error["row"] for error in result["errors"]] == [3, 4, 5]
+    assert result["aborted"] == "connection lost"
+    assert result["resume_from_row"] == 3
+    assert collection.calls == 2
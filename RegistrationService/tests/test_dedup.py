@@ -0,0 +1,108 @@
+import asyncio
+import os
+import random
+import string
+import time
+from datetime import date, datetime, timedelta
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from dedup import add_dedup_keys, duplicate_clusters, find_duplicate_clusters, find_duplicates, score_candidates
+from utils import bson_dates
+
+SCALE_TESTS = os.getenv("SCALE_TESTS", "False").lower() == "true"
+
+
+def patient(uid, first_name, last_name, dob, phone):
+    return {"patient_uid": uid, "first_name": first_name, "last_name": last_name, "dob": dob, "contact_number": phone}
+
+
+def test_matches_need_a_similar_name_and_a_shared_dob_or_phone():
+    new = patient(0, "John", "Smith", date(1990, 1, 1), "555-000-1111")
+    candidates = [
+        patient(1, "Jon", "Smith", datetime(1991, 2, 2), "+1 (555) 000-1111"),  # same phone, close name
+        patient(2, "Smith", "John", datetime(1990, 1, 1), ""),  # same dob, swapped names
+        patient(3, "Jane", "Smith", datetime(1990, 1, 1), "555-000-1111"),  # different person in the family
+        patient(4, "John", "Smith", datetime(1970, 1, 1), "555-999-9999"),  # namesake
+    ]
+    assert sorted(duplicate["patient_uid"] for duplicate in score_candidates(new, candidates)) == [1, 2]
+
+
+def test_registration_check_queries_stored_datetimes_and_normalized_phones():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["patients"]
+        await collection.insert_many([
+            add_dedup_keys(bson_dates(patient(1, "John", "Smith", date(1990, 1, 1), "+1 (555) 000-1111"))),
+            add_dedup_keys(bson_dates(patient(2, "Jon", "Smith", date(1985, 3, 3), "555.000.1111"))),
+            add_dedup_keys(bson_dates(patient(3, "John", "Smith", date(1970, 1, 1), "555-999-9999"))),
+        ])
+        return await find_duplicates(collection, patient(0, "John", "Smith", date(1990, 1, 1), "5550001111"))
+    assert sorted(duplicate["patient_uid"] for duplicate in asyncio.run(run())) == [1, 2]
+
+
+def test_failed_lookup_does_not_block_registration():
+    class Broken:
+        def find(self, *args):
+            raise ConnectionError("down")
+    assert asyncio.run(find_duplicates(Broken(), patient(0, "A", "B", date(1990, 1, 1), "1"))) == []
+
+
+def test_clusters_join_matches_transitively():
+    patients = [
+        patient(1, "John", "Smith", datetime(1990, 1, 1), "5550001111"),
+        patient(2, "Jon", "Smith", datetime(1991, 1, 1), "555-000-1111"),
+        patient(3, "Jon", "Smith", datetime(1991, 1, 1), ""),
+        patient(4, "Maria", "Garcia", datetime(1990, 1, 1), "5550002222"),
+    ]
+    clusters = duplicate_clusters(patients)
+    assert [[member["patient_uid"] for member in cluster] for cluster in clusters] == [[1, 2, 3]]
+
+
+def test_oversized_blocks_are_split_by_name_initial():
+    # A placeholder date of birth shared by everyone; only the swapped-name pair and the typo pair are duplicates
+    patients = [
+        patient(1, "John", "Smith", datetime(1900, 1, 1), ""),
+        patient(2, "Smith", "John", datetime(1900, 1, 1), ""),
+        patient(3, "Maria", "Garcia", datetime(1900, 1, 1), ""),
+        patient(4, "Maria", "Garcia", datetime(1900, 1, 1), ""),
+        patient(5, "Wei", "Zhang", datetime(1900, 1, 1), ""),
+    ]
+    clusters = duplicate_clusters(patients, max_block_size=2)
+    assert sorted([member["patient_uid"] for member in cluster] for cluster in clusters) == [[1, 2], [3, 4]]
+
+
+def test_similarity_batches_cover_every_pair(monkeypatch):
+    monkeypatch.setattr("dedup.PAIR_MATRIX_CELLS", 3)
+    patients = [patient(uid, "John", "Smith", datetime(1990, 1, 1), "") for uid in range(1, 6)]
+    assert [[member["patient_uid"] for member in cluster] for cluster in duplicate_clusters(patients)] == [[1, 2, 3, 4, 5]]
+
+
+def test_collection_scan_streams_blocks_from_mongo():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["patients"]
+        await collection.insert_many([
+            add_dedup_keys(bson_dates(patient(1, "John", "Smith", date(1990, 1, 1), "5550001111"))),
+            add_dedup_keys(bson_dates(patient(2, "Jon", "Smith", date(1991, 1, 1), "555-000-1111"))),
+            add_dedup_keys(bson_dates(patient(3, "Jon", "Smith", date(1991, 1, 1), ""))),
+            add_dedup_keys(bson_dates(patient(4, "Maria", "Garcia", date(1990, 1, 1), "5550002222"))),
+        ])
+        return await find_duplicate_clusters(collection)
+    assert [[member["patient_uid"] for member in cluster] for cluster in asyncio.run(run())] == [[1, 2, 3]]
+
+
+@pytest.mark.skipif(not SCALE_TESTS, reason="set SCALE_TESTS=True to time clustering 200k patients")
+def test_clusters_two_hundred_thousand_patients():
+    rng = random.Random(11)
+    names = [("".join(rng.choices(string.ascii_lowercase, k=7)), "".join(rng.choices(string.ascii_lowercase, k=8)))
+             for _ in range(190_000)]
+    patients = [patient(uid, first, last, datetime(1940, 1, 1) + timedelta(days=rng.randrange(25_000)),
+                        f"555{rng.randrange(10 ** 7):07d}") for uid, (first, last) in enumerate(names)]
+    # 10k re-registrations under the same phone with a placeholder date of birth, which makes one oversized block
+    patients += [patient(190_000 + uid, first, last, datetime(1900, 1, 1), patients[uid]["contact_number"])
+                 for uid, (first, last) in enumerate(names[:10_000])]
+    started = time.perf_counter()
+    clusters = duplicate_clusters(patients, max_block_size=5000)
+    seconds = time.perf_counter() - started
+    print(f"clustered {len(patients)} patients into {len(clusters)} duplicate clusters in {seconds:.1f}s")
+    found = {tuple(member["patient_uid"] for member in cluster) for cluster in clusters}
+    assert found == {(uid, 190_000 + uid) for uid in range(10_000)}
+    assert seconds < 60
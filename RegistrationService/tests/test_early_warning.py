@@ -0,0 +1,58 @@
+import os
+import random
+import time
+from datetime import datetime
+import pytest
+from early_warning import NEWS2_BANDS, FAHRENHEIT_THRESHOLD, score_documents
+
+SCALE_TESTS = os.getenv("SCALE_TESTS", "False").lower() == "true"
+
+
+def reference_score(document):
+    """NEWS2 total for one document, band by band in plain Python"""
+    total = 0
+    for name, (edges, band_scores) in NEWS2_BANDS.items():
+        value = document.get(name)
+        if value is None:
+            continue
+        if name == "temperature" and value > FAHRENHEIT_THRESHOLD:
+            value = (value - 32.0) * 5.0 / 9.0
+        total += band_scores[next((band for band, edge in enumerate(edges) if value <= edge), len(edges))]
+    return total
+
+
+def ward(patients, seed=7):
+    rng = random.Random(seed)
+
+    def maybe(value):
+        return None if rng.random() < 0.05 else value
+
+    return [{
+        "patient_uid": uid,
+        "recorded_at": datetime(2024, 1, 1, 9, 30),
+        "respiratory_rate": maybe(rng.randint(5, 30)),
+        "oxygen_saturation": maybe(round(rng.uniform(85, 100), 1)),
+        "blood_pressure_systolic": maybe(rng.randint(80, 230)),
+        "heart_rate": maybe(rng.randint(35, 140)),
+        "temperature": maybe(rng.choice([round(rng.uniform(34, 40), 1), round(rng.uniform(95, 104), 1)])),
+    } for uid in range(patients)]
+
+
+def test_vectorized_scores_match_band_by_band_scoring():
+    documents = ward(2000)
+    results = score_documents(documents)
+    assert {result["patient_uid"]: result["score"] for result in results} == {
+        document["patient_uid"]: reference_score(document) for document in documents
+    }
+    assert [result["score"] for result in results] == sorted((result["score"] for result in results), reverse=True)
+
+
+@pytest.mark.skipif(not SCALE_TESTS, reason="set SCALE_TESTS=True to time scoring a 50k patient ward")
+def test_scores_a_fifty_thousand_patient_ward():
+    documents = ward(50_000)
+    started = time.perf_counter()
+    results = score_documents(documents)
+    seconds = time.perf_counter() - started
+    print(f"scored {len(documents)} patients in {seconds:.2f}s")
+    assert len(results) == len(documents)
+    assert seconds < 5
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import uuid
+import pytest
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from indexes import INDEXES, QUERY_SHAPES, explain_query_shape, reconcile_indexes
+
+MONGODB_TEST_URL = os.getenv("MONGODB_TEST_URL")
+
+
+class FakeCollection:
+    """list_indexes/create_indexes/drop_index over a dict, with Mongo's conflict and missing-index errors"""
+
+    def __init__(self, name, indexes_by_name, fail_builds=False):
+        self.name = name
+        self.indexes = indexes_by_name
+        self.fail_builds = fail_builds
+
+    async def list_indexes(self):
+        for index in list(self.indexes.values()):
+            yield index
+
+    async def create_indexes(self, models):
+        for model in models:
+            document = dict(model.document)
+            if self.fail_builds and document.get("unique"):
+                raise OperationFailure("E11000 duplicate key error", 11000)
+            for index in self.indexes.values():
+                if list(index["key"].items()) == list(document["key"].items()) and index["name"] != document["name"] \
+                        and index.get("partialFilterExpression") == document.get("partialFilterExpression"):
+                    raise OperationFailure("Index already exists with different options", 85)
+            self.indexes[document["name"]] = {**document, "key": dict(document["key"])}
+
+    async def drop_index(self, name):
+        if self.indexes.pop(name, None) is None:
+            raise OperationFailure(f"index not found with name [{name}]", 27)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection(name, {"_id_": {"name": "_id_", "key": {"_id": 1}}})
+        return collection
+
+
+def declared(collection_name):
+    return {model.document["name"] for model in INDEXES[collection_name]} | {"_id_"}
+
+
+def test_missing_indexes_are_created_and_operator_indexes_kept_by_default():
+    database = FakeDatabase()
+    database["patients"].indexes["operator_1"] = {"name": "operator_1", "key": {"operator": 1}}
+    asyncio.run(reconcile_indexes(database))
+    assert set(database["patients"].indexes) == declared("patients") | {"operator_1"}
+    assert set(database["queue"].indexes) == declared("queue")
+
+
+def test_changed_index_is_built_before_the_old_one_is_dropped(monkeypatch):
+    database = FakeDatabase()
+    changed = IndexModel([("doctor_id", ASCENDING), ("is_available", ASCENDING)], name="doctor_id_1_is_available_1_x")
+    monkeypatch.setitem(INDEXES, "doctors", [INDEXES["doctors"][0], changed])
+    database["doctors"].indexes["doctor_id_1_is_available_1_x"] = {
+        "name": "doctor_id_1_is_available_1_x", "key": {"is_available": 1, "doctor_id": 1}
+    }
+    asyncio.run(reconcile_indexes(database))
+    assert "doctor_id_1_is_available_1_x" not in database["doctors"].indexes
+    assert database["doctors"].indexes["doctor_id_1_is_available_1_x_next"]["key"] == {"doctor_id": 1, "is_available": 1}
+    # Already up to date under the alternate name, so another startup changes nothing
+    before = dict(database["doctors"].indexes)
+    asyncio.run(reconcile_indexes(database))
+    assert database["doctors"].indexes == before
+
+
+def test_failed_unique_rebuild_keeps_the_existing_index():
+    database = FakeDatabase()
+    unique_name = "doctor_id_1_queue_day_1_queue_number_1_unique"
+    old = {"name": unique_name, "key": {"doctor_id": 1, "queue_day": 1, "queue_number": 1}}
+    database["queue"] = FakeCollection("queue", {"_id_": {"name": "_id_", "key": {"_id": 1}}, unique_name: old},
+                                       fail_builds=True)
+    asyncio.run(reconcile_indexes(database))
+    assert database["queue"].indexes[unique_name] == old
+
+
+def test_concurrent_drops_do_not_abort_reconciliation():
+    database = FakeDatabase()
+    database["patients"].indexes["operator_1"] = {"name": "operator_1", "key": {"operator": 1}}
+    collection = database["patients"]
+    drop_index = collection.drop_index
+
+    async def dropped_by_another_worker_first(name):
+        collection.indexes.pop(name, None)
+        await drop_index(name)
+
+    collection.drop_index = dropped_by_another_worker_first
+    asyncio.run(reconcile_indexes(database, drop_undeclared=True))
+    assert "operator_1" not in collection.indexes
+    assert set(database["queue"].indexes) == declared("queue")
+
+
+@pytest.mark.skipif(not MONGODB_TEST_URL, reason="set MONGODB_TEST_URL to explain query shapes against MongoDB")
+@pytest.mark.parametrize("shape", QUERY_SHAPES, ids=[shape["endpoint"] for shape in QUERY_SHAPES])
+def test_query_shape_is_index_backed_without_a_sort_stage(shape):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        client = AsyncIOMotorClient(MONGODB_TEST_URL)
+        database = client[f"index_check_{uuid.uuid4().hex[:8]}"]
+        try:
+            await reconcile_indexes(database)
+            return await explain_query_shape(database, shape)
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    index_backed, stages = asyncio.run(run())
+    assert index_backed, " -> ".join(stages)
+
+
+@pytest.mark.parametrize("fail_builds", [False, True])
+def test_option_only_change_is_rebuilt_in_place_and_restored_on_failure(fail_builds):
+    database = FakeDatabase()
+    old = {"name": "doctor_id_1", "key": {"doctor_id": 1}}
+    database["doctors"] = FakeCollection("doctors", {"_id_": {"name": "_id_", "key": {"_id": 1}}, "doctor_id_1": dict(old)},
+                                         fail_builds=fail_builds)
+    asyncio.run(reconcile_indexes(database))
+    rebuilt = database["doctors"].indexes["doctor_id_1"]
+    assert rebuilt.get("unique", False) is not fail_builds
+    assert "doctor_id_1_next" not in database["doctors"].indexes
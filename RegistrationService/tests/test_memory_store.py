@@ -0,0 +1,217 @@
+import asyncio
+import random
+from datetime import date, datetime, timedelta
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from models import StatusEnum
+from memory_store import IndexedCollection, field, date_of
+
+STATUSES = list(StatusEnum)
+DOCTORS = ["D1", "D2", "D3"]
+DAYS = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(4)]
+
+
+def appointments():
+    return IndexedCollection({
+        "doctor_id": field("doctor_id"),
+        "status": field("status"),
+        "appointment_date": date_of("appointment_time")
+    })
+
+
+def random_appointment(rng):
+    appointment = {"doctor_id": rng.choice(DOCTORS), "status": rng.choice(STATUSES)}
+    when = rng.choice([
+        datetime.combine(rng.choice(DAYS), datetime.min.time()) + timedelta(hours=rng.randrange(24)),
+        rng.choice(DAYS),
+        rng.choice(DAYS).isoformat() + "T10:00:00",
+        None
+    ])
+    if when is not None:
+        appointment["appointment_time"] = when
+    return appointment
+
+
+def scan(collection, name, value):
+    """What the lookup replaced: a full pass over the documents"""
+    def matches(document):
+        if name == "appointment_date":
+            when = document.get("appointment_time")
+            when = date.fromisoformat(when[:10]) if isinstance(when, str) else when
+            when = when.date() if isinstance(when, datetime) else when
+            return when == value
+        return document.get(name) == value
+    return sorted(key for key, document in dict.items(collection) if matches(document))
+
+
+def assert_lookups_match_scans(collection):
+    for name, values in [("doctor_id", DOCTORS), ("status", STATUSES), ("appointment_date", DAYS)]:
+        for value in values:
+            assert sorted(collection.keys_for(name, value)) == scan(collection, name, value), (name, value)
+            assert collection.count(name, value) == len(scan(collection, name, value))
+
+
+def test_indexed_lookups_match_dict_scans_through_every_write():
+    rng = random.Random(7)
+    collection = appointments()
+    for step in range(2000):
+        key = rng.randrange(60)
+        operation = rng.random()
+        if operation < 0.45:
+            collection[key] = random_appointment(rng)
+        elif operation < 0.65 and key in collection:
+            collection.update_document(key, {"status": rng.choice(STATUSES), "doctor_id": rng.choice(DOCTORS)})
+        elif operation < 0.8:
+            collection.pop(key, None)
+        elif operation < 0.88 and key in collection:
+            del collection[key]
+        elif operation < 0.93:
+            collection.setdefault(key, random_appointment(rng))
+        elif operation < 0.97:
+            collection.update({rng.randrange(60): random_appointment(rng) for _ in range(3)})
+        elif operation < 0.995 and collection:
+            collection.popitem()
+        else:
+            collection.clear()
+        if step % 50 == 0:
+            assert_lookups_match_scans(collection)
+    assert_lookups_match_scans(collection)
+
+
+def test_find_accepts_enum_members_and_returns_current_documents():
+    collection = appointments()
+    collection[1] = {"doctor_id": "D1", "status": StatusEnum.PENDING}
+    collection.update_document(1, {"status": StatusEnum.COMPLETED})
+    assert collection.find("status", StatusEnum.PENDING) == []
+    assert collection.find("status", StatusEnum.COMPLETED) == [{"doctor_id": "D1", "status": StatusEnum.COMPLETED}]
+    assert collection.find("status", "COMPLETED") == collection.find("status", StatusEnum.COMPLETED)
+
+
+class MemoryBackend:
+    """IndexedCollection driven through the calls main_simple makes"""
+
+    def __init__(self):
+        self.collection = appointments()
+
+    async def insert(self, key, document):
+        self.collection[key] = dict(document)
+
+    async def update(self, key, changes):
+        if key in self.collection:
+            self.collection.update_document(key, changes)
+
+    async def delete(self, key):
+        self.collection.pop(key, None)
+
+    async def find(self, name, value):
+        return sorted(self.collection.keys_for(name, value))
+
+    async def find_one(self, key):
+        document = self.collection.get(key)
+        return None if document is None else {"_id": key, **document}
+
+    async def count(self, name, value):
+        return self.collection.count(name, value)
+
+
+class MongoBackend:
+    """A mongomock-motor collection driven through the queries main.py issues for the same lookups"""
+
+    def __init__(self):
+        self.collection = AsyncMongoMockClient()["test"]["appointments"]
+
+    @staticmethod
+    def _filter(name, value):
+        if name == "appointment_date":
+            start = datetime.combine(value, datetime.min.time())
+            return {"appointment_time": {"$gte": start, "$lt": start + timedelta(days=1)}}
+        return {name: value}
+
+    async def insert(self, key, document):
+        await self.collection.replace_one({"_id": key}, document, upsert=True)
+
+    async def update(self, key, changes):
+        await self.collection.update_one({"_id": key}, {"$set": changes})
+
+    async def delete(self, key):
+        await self.collection.delete_one({"_id": key})
+
+    async def find(self, name, value):
+        return sorted([document["_id"] async for document in self.collection.find(self._filter(name, value), {"_id": 1})])
+
+    async def find_one(self, key):
+        return await self.collection.find_one({"_id": key})
+
+    async def count(self, name, value):
+        return await self.collection.count_documents(self._filter(name, value))
+
+
+def stored_appointment(rng):
+    # Both backends store what main.py writes: enum values and datetimes
+    return {
+        "doctor_id": rng.choice(DOCTORS),
+        "status": rng.choice(STATUSES).value,
+        "appointment_time": datetime.combine(rng.choice(DAYS), datetime.min.time()) + timedelta(minutes=rng.randrange(24 * 60))
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_memory_store_answers_queries_like_mongo(seed):
+    async def run():
+        rng = random.Random(seed)
+        backends = [MemoryBackend(), MongoBackend()]
+        for _ in range(300):
+            key = rng.randrange(40)
+            operation = rng.random()
+            if operation < 0.5:
+                document = stored_appointment(rng)
+                for backend in backends:
+                    await backend.insert(key, document)
+            elif operation < 0.8:
+                changes = {"status": rng.choice(STATUSES).value, "doctor_id": rng.choice(DOCTORS)}
+                for backend in backends:
+                    await backend.update(key, changes)
+            else:
+                for backend in backends:
+                    await backend.delete(key)
+
+        memory, mongo = backends
+        for name, values in [("doctor_id", DOCTORS), ("status", [status.value for status in STATUSES]),
+                             ("appointment_date", DAYS)]:
+            for value in values:
+                assert await memory.find(name, value) == await mongo.find(name, value), (name, value)
+                assert await memory.count(name, value) == await mongo.count(name, value), (name, value)
+        for key in range(40):
+            assert await memory.find_one(key) == await mongo.find_one(key), key
+
+    asyncio.run(run())
+
+
+def test_duplicate_check_matches_between_backends():
+    from database_simple import PATIENT_INDEXES
+    from dedup import add_dedup_keys, find_duplicates, find_duplicates_in_store
+    from utils import bson_dates
+
+    existing = [
+        {"patient_uid": 1, "first_name": "John", "last_name": "Smith", "dob": date(1990, 1, 1), "contact_number": "+1 (555) 000-1111"},
+        {"patient_uid": 2, "first_name": "Jon", "last_name": "Smith", "dob": date(1985, 3, 3), "contact_number": "555.000.1111"},
+        {"patient_uid": 3, "first_name": "John", "last_name": "Smith", "dob": date(1970, 1, 1), "contact_number": "555-999-9999"},
+        {"patient_uid": 4, "first_name": "Smith", "last_name": "John", "dob": date(1990, 1, 1), "contact_number": ""},
+    ]
+    new = {"first_name": "John", "last_name": "Smith", "dob": date(1990, 1, 1), "contact_number": "(555) 000 1111"}
+
+    async def from_mongo():
+        collection = AsyncMongoMockClient()["test"]["patients"]
+        await collection.insert_many([add_dedup_keys(bson_dates(patient)) for patient in existing])
+        return await find_duplicates(collection, new)
+
+    memory = IndexedCollection(PATIENT_INDEXES)
+    for patient in existing:
+        memory[patient["patient_uid"]] = add_dedup_keys(dict(patient))
+
+    def summary(duplicates):
+        return [(duplicate["patient_uid"], duplicate["score"], duplicate["same_dob"], duplicate["same_phone"])
+                for duplicate in duplicates]
+
+    assert summary(find_duplicates_in_store(memory, new)) == summary(asyncio.run(from_mongo()))
+    assert {uid for uid, *_ in summary(find_duplicates_in_store(memory, new))} == {1, 2, 4}
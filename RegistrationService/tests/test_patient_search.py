@@ -0,0 +1,129 @@
+import asyncio
+import random
+import string
+from datetime import datetime, timedelta
+from mongomock_motor import AsyncMongoMockClient
+from patient_search import PatientSearchIndex, PrefixIndex, edit_distance, search_patients
+
+PATIENTS = [
+    {"patient_uid": 10000000001, "first_name": "John", "last_name": "Smith", "contact_number": "+1 (555) 010-2030"},
+    {"patient_uid": 10000000002, "first_name": "Johnny", "last_name": "Smithers", "contact_number": "555-777-2030"},
+    {"patient_uid": 10000000003, "first_name": "Maria", "last_name": "Garcia", "contact_number": "555-123-4567"},
+    {"patient_uid": 10000000104, "first_name": "Jane", "last_name": "Smyth", "contact_number": "555-999-0000"},
+]
+
+
+def index_of(patients):
+    index = PatientSearchIndex()
+    for patient in patients:
+        index.add(patient)
+    return index
+
+
+def test_prefix_lookups_match_a_scan_before_and_after_merging():
+    rng = random.Random(3)
+    index = PrefixIndex(merge_every=50)
+    pairs = []
+    for value in range(400):
+        key = "".join(rng.choice("abc") for _ in range(rng.randrange(1, 6)))
+        index.add(key, value)
+        pairs.append((key, value))
+        if value % 37 == 0:
+            for prefix in ["", "a", "ab", "cab", "bbb"]:
+                expected = sorted(pair for pair in pairs if pair[0].startswith(prefix))[:20]
+                assert index.lookup(prefix, 20) == expected
+
+
+def test_edit_distance_matches_the_full_computation_within_the_limit():
+    def full(a, b):
+        # Optimal string alignment: a swap of adjacent characters counts as one edit
+        table = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+        for i in range(1, len(a) + 1):
+            for j in range(1, len(b) + 1):
+                table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+                if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                    table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+        return table[-1][-1]
+
+    rng = random.Random(5)
+    for _ in range(500):
+        a = "".join(rng.choice(string.ascii_lowercase[:4]) for _ in range(rng.randrange(0, 7)))
+        b = "".join(rng.choice(string.ascii_lowercase[:4]) for _ in range(rng.randrange(0, 7)))
+        assert min(edit_distance(a, b, 1), 2) == min(full(a, b), 2), (a, b)
+
+
+def test_names_match_exactly_by_prefix_and_with_one_typo():
+    index = index_of(PATIENTS)
+    assert index.search("john smith", 1)[0][0] == 10000000001
+    assert {uid for uid, _ in index.search("smi", 10)} == {10000000001, 10000000002}
+    assert index.search("mraia", 10)[0][0] == 10000000003  # transposition
+    assert index.search("garcai", 10)[0][0] == 10000000003
+    assert index.search("zzzz", 10) == []
+
+
+def test_numbers_match_uids_and_phone_suffixes():
+    index = index_of(PATIENTS)
+    assert index.search("10000000003", 10)[0][0] == 10000000003
+    assert {uid for uid, _ in index.search("2030", 10)} == {10000000001, 10000000002}
+    assert index.search("100000001", 10) == [(10000000104, 1.5)]
+    # A full phone number ranks above a suffix match
+    assert index.search("5550102030", 10)[0][0] == 10000000001
+
+
+def test_refresh_picks_up_patients_added_elsewhere_and_hits_come_back_in_rank_order():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["patients"]
+        now = datetime.utcnow()
+        await collection.insert_many([{**patient, "created_at": now - timedelta(minutes=10)} for patient in PATIENTS[:2]])
+        index = PatientSearchIndex()
+        await index.rebuild(collection)
+        await collection.insert_many([{**patient, "created_at": now} for patient in PATIENTS[2:]])
+        added = await index.refresh(collection)
+        hits = await search_patients(collection, index, "smith", 10)
+        return added, len(index), [hit["patient_uid"] for hit in hits]
+
+    added, indexed, ranked = asyncio.run(run())
+    assert (added, indexed) == (2, 4)
+    assert ranked[0] == 10000000001
+    assert set(ranked) == {10000000001, 10000000002, 10000000104}
+
+
+def test_refresh_finds_patients_stamped_before_the_newest_indexed_one():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["patients"]
+        now = datetime.utcnow()
+        await collection.insert_one({**PATIENTS[0], "created_at": now})
+        index = PatientSearchIndex(refresh_overlap_seconds=300)
+        await index.rebuild(collection)
+        # A slow bulk import on another worker, and a worker whose clock is a day behind
+        await collection.insert_one({**PATIENTS[1], "created_at": now - timedelta(minutes=2)})
+        await collection.insert_one({**PATIENTS[2], "created_at": now - timedelta(days=1)})
+        added = await index.refresh(collection)
+        again = await index.refresh(collection)
+        return added, again, index.catch_ups, {uid for uid, _ in index.search("maria", 10)}
+
+    added, again, catch_ups, maria = asyncio.run(run())
+    assert (added, again, catch_ups) == (2, 0, 1)
+    assert maria == {10000000003}
+
+
+def test_merges_on_the_event_loop_run_in_the_background_without_losing_pairs():
+    async def run():
+        index = PrefixIndex(merge_every=100)
+        pairs = []
+        for value in range(1000):
+            key = f"{value * 7919 % 1000:03d}"
+            index.add(key, value)
+            pairs.append((key, value))
+            # Lookups stay exact while a merge is in flight
+            assert index.lookup(key[:2], 1000) == sorted(pair for pair in pairs if pair[0].startswith(key[:2]))
+            if value % 150 == 0:
+                await asyncio.sleep(0.01)
+        while index._merging is not None:
+            await asyncio.sleep(0.01)
+        return index, pairs
+
+    index, pairs = asyncio.run(run())
+    assert len(index) == 1000
+    assert index.lookup("", 2000) == sorted(pairs)
+    assert len(index._tail) < 1000
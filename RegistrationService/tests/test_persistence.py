@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from datetime import date, datetime
+import pytest
+from bson import ObjectId
+from memory_store import IndexedCollection, field
+from persistence import DurableStore, LOG_FILE
+
+SCALE_TESTS = os.getenv("SCALE_TESTS", "False").lower() == "true"
+
+
+def collections():
+    return {
+        "patients": IndexedCollection(),
+        "queue": IndexedCollection({"doctor_id": field("doctor_id"), "status": field("status")})
+    }
+
+
+def restored(data_dir):
+    fresh = collections()
+    store = DurableStore(str(data_dir), fresh)
+    store.restore()
+    store.close()
+    return fresh
+
+
+def assert_same(expected, actual):
+    for name, collection in expected.items():
+        assert dict(actual[name]) == dict(collection)
+    for index, values in [("doctor_id", ["D0", "D1", "D2"]), ("status", ["PENDING", "COMPLETED"])]:
+        for value in values:
+            assert sorted(actual["queue"].keys_for(index, value)) == sorted(expected["queue"].keys_for(index, value))
+
+
+def test_restore_replays_snapshot_and_log_into_the_same_state(tmp_path):
+    async def run():
+        live = collections()
+        store = DurableStore(str(tmp_path), live)
+        store.restore()
+        store.attach()
+        live["patients"][1] = {"_id": ObjectId(), "dob": date(1990, 1, 1), "created_at": datetime(2024, 1, 1, 9, 30)}
+        for number in range(10):
+            live["queue"][number] = {"doctor_id": f"D{number % 3}", "status": "PENDING"}
+        await store.snapshot()
+        live["queue"].update_document(3, {"status": "COMPLETED"})
+        del live["queue"][4]
+        live["patients"][2] = {"dob": date(1985, 5, 5)}
+        store.close()
+        return live
+
+    live = asyncio.run(run())
+    assert_same(live, restored(tmp_path))
+
+
+def test_truncated_log_record_is_dropped_on_restore(tmp_path):
+    live = collections()
+    store = DurableStore(str(tmp_path), live)
+    store.restore()
+    store.attach()
+    live["queue"][1] = {"doctor_id": "D1", "status": "PENDING"}
+    live["queue"][2] = {"doctor_id": "D2", "status": "PENDING"}
+    store.close()
+    log_path = os.path.join(tmp_path, LOG_FILE)
+    with open(log_path, "r+b") as f:
+        f.truncate(os.path.getsize(log_path) - 3)
+
+    recovered = restored(tmp_path)
+    assert dict(recovered["queue"]) == {1: {"doctor_id": "D1", "status": "PENDING"}}
+    assert list(recovered["queue"].keys_for("doctor_id", "D2")) == []
+
+
+@pytest.mark.skipif(not SCALE_TESTS, reason="set SCALE_TESTS=True to time a restart with 1M vitals rows")
+def test_restart_with_a_million_vitals_rows(tmp_path):
+    rows = 1_000_000
+
+    def vitals(number):
+        return {"_id": ObjectId(), "patient_uid": number % 5000, "heart_rate": 72, "oxygen_saturation": 97.5,
+                "temperature": 36.8, "recorded_by": "nurse", "recorded_at": datetime(2024, 1, 1, 9, 30)}
+
+    async def write():
+        live = {"vitals": IndexedCollection({"patient_uid": field("patient_uid")})}
+        store = DurableStore(str(tmp_path), live)
+        store.restore()
+        store.attach()
+        # Most rows come from the snapshot and the rest are replayed from the log, as after a normal day
+        for number in range(rows):
+            live["vitals"][number] = vitals(number)
+            if number == rows * 9 // 10:
+                await store.snapshot()
+        store.close()
+
+    asyncio.run(write())
+    started = time.perf_counter()
+    fresh = {"vitals": IndexedCollection({"patient_uid": field("patient_uid")})}
+    store = DurableStore(str(tmp_path), fresh)
+    store.restore()
+    store.close()
+    seconds = time.perf_counter() - started
+    print(f"restored {rows} vitals rows in {seconds:.1f}s")
+    assert len(fresh["vitals"]) == rows
+    assert len(list(fresh["vitals"].keys_for("patient_uid", 7))) == rows // 5000
+    assert seconds < 60
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta
+from mongomock_motor import AsyncMongoMockClient
+import queue_engine
+from queue_engine import QueueEngine
+
+
+def queue_item(item_id, priority, waited_minutes, status="PENDING", queue_day=None):
+    return {
+        "_id": item_id, "doctor_id": "D1", "queue_number": item_id, "priority": priority, "status": status,
+        "queue_day": queue_day or datetime.now().date().isoformat(),
+        "created_at": datetime.utcnow() - timedelta(minutes=waited_minutes)
+    }
+
+
+def test_priority_comes_before_arrival_and_aging_is_capped():
+    engine = QueueEngine(aging_minutes=15, max_promotion=1)
+    for item in [
+        queue_item(1, "LOW", 120),  # waited long, but promoted at most to MEDIUM
+        queue_item(2, "URGENT", 0),
+        queue_item(3, "MEDIUM", 5),
+        queue_item(4, "HIGH", 1),
+        queue_item(5, "MEDIUM", 20),  # promoted to HIGH, and older than item 4
+    ]:
+        engine.apply(item)
+    assert [item["_id"] for item in engine.ordered_for("D1", 10)] == [2, 5, 4, 1, 3]
+    assert engine.next_for("D1")["_id"] == 2
+
+    engine.apply({**queue_item(2, "URGENT", 0), "status": "IN_PROGRESS"})
+    assert engine.next_for("D1")["_id"] == 5
+    assert engine.waiting("D1") == 4
+
+
+def test_rebuild_skips_items_left_pending_on_earlier_days():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["queue"]
+        yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
+        await collection.insert_many([
+            queue_item(1, "MEDIUM", 60 * 24, queue_day=yesterday),
+            queue_item(2, "MEDIUM", 10),
+            queue_item(3, "MEDIUM", 5, status="COMPLETED"),
+        ])
+        engine = QueueEngine()
+        loaded = await engine.rebuild(collection)
+        return loaded, engine.next_for("D1")["_id"]
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_items_from_earlier_days_are_dropped_at_rollover(monkeypatch):
+    engine = QueueEngine()
+    engine.apply(queue_item(1, "MEDIUM", 60))
+    today = datetime.now().date()
+    monkeypatch.setattr(queue_engine, "queue_day_today", lambda: (today + timedelta(days=1)).isoformat())
+    assert engine.next_for("D1") is None
+    engine.apply(queue_item(2, "MEDIUM", 5, queue_day=(today + timedelta(days=1)).isoformat()))
+    engine.apply(queue_item(3, "MEDIUM", 5))  # yesterday's item updated by another worker
+    assert [item["_id"] for item in engine.ordered_for("D1", 10)] == [2]
+
+
+def test_reload_picks_up_other_workers_writes_and_keeps_writes_made_meanwhile():
+    class SlowCollection:
+        def __init__(self, collection, during_read):
+            self.collection, self.during_read = collection, during_read
+
+        def find(self, query):
+            cursor = self.collection.find(query)
+            during_read = self.during_read
+
+            class Cursor:
+                async def to_list(self, length=None):
+                    items = await cursor.to_list(length=length)
+                    during_read()
+                    return items
+            return Cursor()
+
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["queue"]
+        engine = QueueEngine()
+        await collection.insert_many([queue_item(1, "MEDIUM", 30), queue_item(2, "MEDIUM", 20)])
+        await engine.rebuild(collection)
+        # Another worker calls item 1 and adds item 3; this worker adds item 4 while reloading
+        await collection.update_one({"_id": 1}, {"$set": {"status": "IN_PROGRESS"}})
+        await collection.insert_one(queue_item(3, "MEDIUM", 10))
+        await engine.rebuild(SlowCollection(collection, lambda: engine.apply(queue_item(4, "MEDIUM", 1))))
+        return [item["_id"] for item in engine.ordered_for("D1", 10)]
+
+    assert asyncio.run(run()) == [2, 3, 4]
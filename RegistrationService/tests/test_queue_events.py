@@ -0,0 +1,179 @@
+import asyncio
+import gc
+from fastapi import WebSocketDisconnect
+from pymongo.errors import OperationFailure, PyMongoError
+import main
+import queue_events
+from queue_events import queue_broadcaster, watch_queue_changes
+
+
+class FakeStream:
+    def __init__(self, changes, fail_after=None):
+        self.changes = list(changes)
+        self.fail_after = fail_after
+        self.resume_token = {"_data": "opened"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.changes:
+            change = self.changes.pop(0)
+            self.resume_token = change["_id"]
+            return change
+        if self.fail_after is not None:
+            raise self.fail_after
+        await asyncio.sleep(3600)
+
+
+class FakeQueueCollection:
+    """Serves one prepared stream per watch() call and records the resume token each was opened with"""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.resumed_after = []
+
+    def watch(self, pipeline, full_document=None, resume_after=None):
+        self.resumed_after.append(resume_after)
+        stream = self.streams.pop(0)
+        if isinstance(stream, Exception):
+            raise stream
+        return stream
+
+
+def change(token, queue_id, status="PENDING"):
+    return {"_id": {"_data": token}, "operationType": "update",
+            "fullDocument": {"_id": queue_id, "doctor_id": "D1", "status": status}}
+
+
+async def watch_until(collection, expected_changes, on_resync=None):
+    seen = []
+    task = asyncio.create_task(watch_queue_changes(collection, seen.append, on_resync, initial_backoff=0.001))
+    while len(seen) < expected_changes or collection.streams:
+        await asyncio.sleep(0.005)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return seen
+
+
+def test_failed_stream_is_reopened_after_the_last_change_seen():
+    collection = FakeQueueCollection([
+        FakeStream([change("t1", 1), change("t2", 2)], fail_after=PyMongoError("connection reset")),
+        PyMongoError("not primary"),
+        FakeStream([change("t3", 3)]),
+    ])
+    seen = asyncio.run(watch_until(collection, 3))
+    assert [item["_id"] for item in seen] == [1, 2, 3]
+    assert collection.resumed_after == [None, {"_data": "t2"}, {"_data": "t2"}]
+
+
+def test_lost_resume_token_rebuilds_and_resyncs_subscribers():
+    rebuilds = []
+
+    async def rebuild():
+        rebuilds.append(True)
+
+    collection = FakeQueueCollection([
+        FakeStream([change("t1", 1)], fail_after=OperationFailure("history lost", queue_events.CHANGE_STREAM_HISTORY_LOST)),
+        FakeStream([change("t2", 2)]),
+    ])
+
+    async def run():
+        display = queue_broadcaster.subscribe("D1")
+        try:
+            await watch_until(collection, 2, rebuild)
+            events = []
+            while not display.empty():
+                events.append(display.get_nowait()["event"])
+            return events
+        finally:
+            queue_broadcaster.unsubscribe("D1", display)
+
+    events = asyncio.run(run())
+    assert collection.resumed_after == [None, None]
+    assert rebuilds == [True]
+    assert events == ["resync", "updated"]
+
+
+class FakeDisplay:
+    """A waiting-room display on the queue WebSocket; it disconnects when told to"""
+
+    def __init__(self, failing_sends=False):
+        self.sent = []
+        self.failing_sends = failing_sends
+        self.disconnected = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        if self.failing_sends and self.sent:
+            raise RuntimeError("Cannot call send once a close message has been sent")
+        self.sent.append(data)
+
+    async def receive_text(self):
+        await self.disconnected.wait()
+        raise WebSocketDisconnect()
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_thousand_idle_subscribers_each_receive_a_delta(monkeypatch):
+    async def authenticated(token):
+        return None
+    monkeypatch.setattr(main, "get_current_user", authenticated)
+
+    async def run():
+        displays = [FakeDisplay() for _ in range(1000)]
+        streams = [asyncio.create_task(main.stream_doctor_queue(display, "D1", token="t")) for display in displays]
+        await until(lambda: queue_broadcaster.stats()["subscribers"] == 1000)
+        queue_broadcaster.publish_item("updated", {"_id": "q1", "doctor_id": "D1", "status": "IN_PROGRESS"})
+        await until(lambda: all(len(display.sent) == 2 for display in displays))
+        for display in displays:
+            display.disconnected.set()
+        await asyncio.gather(*streams)
+        return displays
+    displays = asyncio.run(run())
+    assert all(display.sent[1]["item"]["id"] == "q1" for display in displays)
+    assert queue_broadcaster.stats()["subscribers"] == 0
+
+
+def test_stream_collects_its_forwarder_on_disconnect(monkeypatch):
+    async def authenticated(token):
+        return None
+    monkeypatch.setattr(main, "get_current_user", authenticated)
+    create_task = asyncio.create_task
+    forwarders = []
+    monkeypatch.setattr(asyncio, "create_task", lambda coro: forwarders.append(create_task(coro)) or forwarders[-1])
+    unhandled = []
+
+    async def disconnect(display, publish):
+        async def display_leaves():
+            await until(lambda: display.sent)
+            if publish:
+                queue_broadcaster.publish("D1", {"event": "resync", "doctor_id": "D1"})
+                await asyncio.sleep(0.01)
+            display.disconnected.set()
+        leaving = create_task(display_leaves())
+        await main.stream_doctor_queue(display, "D1", token="t")
+        await leaving
+        # The forwarder has finished by the time the endpoint returns, not merely been asked to cancel
+        return forwarders.pop().done()
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        idle = await disconnect(FakeDisplay(), publish=False)
+        failed_send = await disconnect(FakeDisplay(failing_sends=True), publish=True)
+        gc.collect()
+        return idle, failed_send
+    assert asyncio.run(run()) == (True, True)
+    assert unhandled == []
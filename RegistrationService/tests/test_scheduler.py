@@ -0,0 +1,33 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from mongomock_motor import AsyncMongoMockClient
+from scheduler import SlotScheduler, WEEKDAYS
+
+
+def test_refresh_picks_up_reservations_from_other_workers():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        await db.doctors.insert_one({
+            "doctor_id": "D1",
+            "working_hours": {day: {"start": "09:00", "end": "10:00"} for day in WEEKDAYS}
+        })
+        this_worker, other_worker = SlotScheduler(slot_minutes=30), SlotScheduler(slot_minutes=30)
+        await this_worker.load(db.doctors, db.appointments)
+        await other_worker.load(db.doctors, db.appointments)
+
+        tomorrow_nine = datetime.combine(date.today() + timedelta(days=1), datetime.min.time()) + timedelta(hours=9)
+        after = tomorrow_nine - timedelta(hours=1)
+        await other_worker.reserve(db.slot_reservations, "D1", tomorrow_nine)
+        before_refresh = this_worker.next_free_slots(1, after)[0]["start"]
+        await this_worker.refresh(db.slot_reservations)
+        after_refresh = this_worker.next_free_slots(1, after)[0]["start"]
+
+        await other_worker.release(db.slot_reservations, "D1", tomorrow_nine)
+        await this_worker.refresh(db.slot_reservations)
+        after_release = this_worker.next_free_slots(1, after)[0]["start"]
+        return tomorrow_nine, before_refresh, after_refresh, after_release
+
+    tomorrow_nine, before_refresh, after_refresh, after_release = asyncio.run(run())
+    assert before_refresh == tomorrow_nine
+    assert after_refresh == tomorrow_nine + timedelta(minutes=30)
+    assert after_release == tomorrow_nine
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date, datetime
+import pytest
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from export import stream_csv, stream_ndjson
+from models import Appointment, Patient, Vitals
+from serializers import DocumentResponse, dump_documents
+from utils import bson_dates, encode_document
+
+SCALE_TESTS = os.getenv("SCALE_TESTS", "False").lower() == "true"
+
+
+def stored_patient():
+    return bson_dates({"_id": ObjectId(), "patient_uid": 1, "dob": date(1990, 1, 1), "created_at": datetime(2026, 1, 2, 3, 4)})
+
+
+async def collect(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+async def one_batch(documents):
+    yield documents
+
+
+def test_stored_dates_of_birth_serialize_as_dates_everywhere():
+    patient = stored_patient()
+    assert isinstance(patient["dob"], datetime)
+
+    assert json.loads(dump_documents([patient]))[0]["dob"] == "1990-01-01"
+    assert encode_document(patient)["dob"] == "1990-01-01"
+    assert json.loads(asyncio.run(collect(stream_ndjson(one_batch([patient])))))["dob"] == "1990-01-01"
+    csv_rows = asyncio.run(collect(stream_csv(one_batch([patient]), ["patient_uid", "dob"]))).decode().splitlines()
+    assert csv_rows[1] == "1,1990-01-01"
+    # Timestamps keep their time of day
+    assert json.loads(dump_documents([patient]))[0]["created_at"] == "2026-01-02T03:04:00"
+
+
+def write_documents():
+    """The documents register_patient, book_appointment and record_vitals insert and return"""
+    patient = Patient(patient_uid=1, first_name="John", last_name="Smith", dob=date(1990, 1, 1),
+                      contact_number="5550001111", address="1 Main St", allergies=["penicillin"])
+    appointment = Appointment(patient_uid=1, doctor_id="DOC001", appointment_time=datetime(2026, 1, 2, 9, 30),
+                              status="WALK_IN", queue_token="WALK_IN-1A2B3C")
+    vitals = Vitals(patient_uid=1, recorded_by="nurse", temperature=36.8, heart_rate=72, oxygen_saturation=97.0,
+                    device_info={"id": "m1"})
+    return [(Patient, patient.dict(by_alias=True)), (Appointment, appointment.dict(by_alias=True)),
+            (Vitals, vitals.dict(by_alias=True))]
+
+
+def model_round_trip(model, document):
+    """What the write endpoints used to do: rebuild the model, re-validate it for response_model, encode it"""
+    rebuilt = model(**document)
+    validated = model.model_validate(rebuilt.model_dump(by_alias=True))
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+@pytest.mark.parametrize("model, document", write_documents(), ids=lambda value: getattr(value, "__name__", ""))
+def test_document_response_matches_the_model_response(model, document):
+    expected = json.loads(model_round_trip(model, document))
+    expected["id"] = expected.pop("_id", expected.get("id"))
+    assert json.loads(DocumentResponse(document).body) == expected
+
+
+@pytest.mark.skipif(not SCALE_TESTS, reason="set SCALE_TESTS=True to time write endpoint serialization")
+@pytest.mark.parametrize("model, document", write_documents(), ids=lambda value: getattr(value, "__name__", ""))
+def test_document_response_costs_less_cpu_than_the_model_round_trip(model, document):
+    requests = 10_000
+
+    def per_request(serialize):
+        started = time.process_time()
+        for _ in range(requests):
+            serialize()
+        return (time.process_time() - started) / requests * 1e6
+
+    before = per_request(lambda: model_round_trip(model, document))
+    after = per_request(lambda: DocumentResponse(document).body)
+    print(f"{model.__name__}: {before:.1f} us -> {after:.1f} us per response")
+    assert after < before
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from mongomock_motor import AsyncMongoMockClient
+from stats import DASHBOARD_STATS_ID, dashboard_view, reconcile_stats, record_appointment_booked
+
+
+def collections():
+    database = AsyncMongoMockClient()["test"]
+    return database.stats, database.patients, database.appointments, database.queue
+
+
+def test_booking_counts_on_the_utc_day():
+    async def run():
+        stats, *_ = collections()
+        # 23:30 in New York is already the next day in UTC
+        await record_appointment_booked(stats, datetime(2026, 3, 1, 23, 30, tzinfo=timezone(timedelta(hours=-5))))
+        await record_appointment_booked(stats, datetime(2026, 3, 2, 4, 30))
+        return await stats.find_one({"_id": DASHBOARD_STATS_ID})
+    assert asyncio.run(run())["appointments_by_day"] == {"2026-03-02": 2}
+
+
+def test_reconcile_counts_today_and_drops_old_days():
+    async def run():
+        stats, patients, appointments, queue = collections()
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        await appointments.insert_many([
+            {"appointment_time": today + timedelta(hours=1)},
+            {"appointment_time": today + timedelta(days=1)},
+        ])
+        old_day = (today - timedelta(days=30)).date().isoformat()
+        future_day = (today + timedelta(days=1)).date().isoformat()
+        await stats.insert_one({"_id": DASHBOARD_STATS_ID, "appointments_by_day": {old_day: 4, future_day: 1}})
+        document = await reconcile_stats(stats, patients, appointments, queue)
+        return document, today.date().isoformat(), future_day
+    document, today, future_day = asyncio.run(run())
+    assert document["appointments_by_day"] == {today: 1, future_day: 1}
+    assert dashboard_view(document)["today_appointments"] == 1
+
+
+def test_reconcile_does_not_overwrite_increments_made_while_counting():
+    class CountingPatients:
+        """Registers a patient (and bumps the counter) while the first recount is running"""
+
+        def __init__(self, collection, stats):
+            self.collection, self.stats, self.calls = collection, stats, 0
+
+        async def count_documents(self, query):
+            count = await self.collection.count_documents(query)
+            self.calls += 1
+            if self.calls == 1:
+                await self.collection.insert_one({"patient_uid": "late"})
+                await self.stats.update_one({"_id": DASHBOARD_STATS_ID}, {"$inc": {"total_patients": 1, "version": 1}})
+            return count
+
+    async def run():
+        stats, patients, appointments, queue = collections()
+        await patients.insert_one({"patient_uid": "first"})
+        counting = CountingPatients(patients, stats)
+        document = await reconcile_stats(stats, counting, appointments, queue)
+        return document, counting.calls
+    document, calls = asyncio.run(run())
+    assert calls == 2
+    assert document["total_patients"] == 2
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+from vitals_ingest import VitalsIngestBuffer, build_vitals_document
+
+
+class FakeCollection:
+    """insert_many that fails the first `failures` calls, then stores documents by _id"""
+
+    def __init__(self, failures=0, error=None):
+        self.failures = failures
+        self.error = error
+        self.documents = {}
+        self.calls = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error or AutoReconnect("connection lost")
+        for document in documents:
+            self.documents[document["_id"]] = document
+
+
+def readings(count):
+    return [build_vitals_document({"patient_uid": i, "heart_rate": 70, "device_info": {"id": "m1"}}, "device")
+            for i in range(count)]
+
+
+def run_buffer(collection, documents, tmp_path, **options):
+    async def run():
+        buffer = VitalsIngestBuffer(retry_backoff=0, dead_letter_path=str(tmp_path / "dead.ndjson"), **options)
+        buffer.start(collection)
+        for document in documents:
+            await buffer.submit(document)
+        await buffer.stop()
+        return buffer
+    return asyncio.run(run())
+
+
+def test_stop_flushes_every_accepted_reading(tmp_path):
+    collection = FakeCollection()
+    buffer = run_buffer(collection, readings(10), tmp_path, flush_interval_ms=10_000)
+    assert buffer.accepted == 10
+    assert len(collection.documents) == 10
+    assert buffer.stats()["inserted"] == 10
+
+
+def test_failed_batches_are_retried(tmp_path):
+    collection = FakeCollection(failures=2)
+    buffer = run_buffer(collection, readings(5), tmp_path)
+    assert len(collection.documents) == 5
+    assert buffer.retries == 2
+    assert buffer.dead_lettered == 0
+
+
+def test_batches_failing_every_retry_are_dead_lettered(tmp_path):
+    collection = FakeCollection(failures=100)
+    buffer = run_buffer(collection, readings(4), tmp_path, max_retries=2)
+    lines = (tmp_path / "dead.ndjson").read_text().splitlines()
+    assert buffer.dead_lettered == 4
+    assert sorted(json.loads(line)["patient_uid"] for line in lines) == [0, 1, 2, 3]
+
+
+def test_duplicates_count_as_written_and_rejected_readings_are_dead_lettered(tmp_path):
+    documents = readings(3)
+    error = BulkWriteError({"writeErrors": [
+        {"index": 0, "code": 11000, "errmsg": "duplicate key"},
+        {"index": 1, "code": 121, "errmsg": "Document failed validation"}
+    ]})
+    collection = FakeCollection(failures=1, error=error)
+    buffer = run_buffer(collection, documents, tmp_path, batch_size=3)
+    lines = (tmp_path / "dead.ndjson").read_text().splitlines()
+    assert buffer.inserted == 2
+    assert [json.loads(line)["patient_uid"] for line in lines] == [1]
+    assert collection.calls == 1
+
+
+def test_integer_vitals_are_never_truncated():
+    reading = {"patient_uid": 1, "heart_rate": 72.0, "respiratory_rate": "18", "device_info": {"id": "m1"}}
+    document = build_vitals_document(reading, "device")
+    assert (document["heart_rate"], document["respiratory_rate"]) == (72, 18)
+    with pytest.raises(ValueError, match="heart_rate"):
+        build_vitals_document({**reading, "heart_rate": 72.9}, "device")
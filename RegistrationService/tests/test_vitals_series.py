@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta, timezone
+from utils import naive_utc
+from vitals_series import aggregate_series, to_arrays
+
+
+def test_aware_bounds_become_naive_utc():
+    aware = datetime(2024, 1, 1, 12, 0, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    assert naive_utc(aware) == datetime(2024, 1, 1, 6, 30)
+    assert naive_utc(datetime(2024, 1, 1, 6, 30)) == datetime(2024, 1, 1, 6, 30)
+    assert naive_utc(None) is None
+
+
+def test_readings_are_summarised_per_bucket():
+    start = datetime(2024, 1, 1)
+    readings = [
+        {"recorded_at": start + timedelta(minutes=5), "heart_rate": 60},
+        {"recorded_at": start + timedelta(minutes=50), "heart_rate": 80, "temperature": 37.0},
+        {"recorded_at": start + timedelta(minutes=70), "heart_rate": 100},
+    ]
+    buckets = aggregate_series(*to_arrays(readings), start, timedelta(hours=1))
+    assert [bucket["count"] for bucket in buckets] == [2, 1]
+    assert buckets[0]["heart_rate"] == {"min": 60.0, "mean": 70.0, "max": 80.0}
+    assert "temperature" not in buckets[1]
@@ -0,0 +1,76 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from queue_engine import QueueEngine, call_order
+from wait_estimator import WaitEstimator
+
+
+class QueueCollection:
+    """A mongomock queue collection whose bulk_write is recorded (mongomock can't run pymongo's UpdateOne)"""
+
+    def __init__(self, fail_writes=False):
+        self.collection = AsyncMongoMockClient()["test"]["queue"]
+        self.fail_writes = fail_writes
+        self.requests = []
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await self.collection.find_one(*args, **kwargs)
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.fail_writes:
+            raise ConnectionError("primary stepped down")
+        self.requests.extend(requests)
+
+
+def pending_item(item_id, priority="MEDIUM", waited_minutes=0):
+    return {"_id": item_id, "doctor_id": "D1", "queue_number": item_id, "priority": priority,
+            "status": "PENDING", "queue_day": datetime.now().date().isoformat(),
+            "created_at": datetime.utcnow() - timedelta(minutes=waited_minutes)}
+
+
+def test_vectorized_call_order_matches_the_engine():
+    rng = random.Random(11)
+    items = [pending_item(item_id, rng.choice(["LOW", "MEDIUM", "HIGH", "URGENT"]), rng.randrange(120))
+             for item_id in range(200)]
+    engine = QueueEngine(aging_minutes=15, max_promotion=1)
+    for item in items:
+        engine.apply(item)
+    ordered = [items[position]["_id"] for position in call_order(items, engine.aging_seconds, engine.max_promotion)]
+    assert ordered == [item["_id"] for item in engine.ordered_for("D1", len(items))]
+
+
+def test_positions_come_from_the_database_not_this_workers_partial_queue():
+    async def run():
+        collection = QueueCollection()
+        # Items 1 and 2 were added through another worker; this worker only knows item 3
+        await collection.collection.insert_many([pending_item(1, waited_minutes=30), pending_item(2, waited_minutes=20),
+                                                 pending_item(3, waited_minutes=10)])
+        engine = QueueEngine()
+        engine.apply(pending_item(3, waited_minutes=10))
+        written = await WaitEstimator(default_minutes=10).recompute(collection, engine, "D1")
+        return written, collection.requests, engine.get("3")
+
+    written, requests, in_memory = asyncio.run(run())
+    assert written == 3
+    assert [(request._filter, request._doc["$set"]["estimated_wait_time"]) for request in requests] == [
+        ({"_id": 1, "status": "PENDING"}, 0), ({"_id": 2, "status": "PENDING"}, 10), ({"_id": 3, "status": "PENDING"}, 20)
+    ]
+    assert in_memory["estimated_wait_time"] == 20
+
+
+def test_estimates_reach_memory_only_after_the_write():
+    async def run():
+        collection = QueueCollection(fail_writes=True)
+        await collection.collection.insert_one(pending_item(1))
+        engine = QueueEngine()
+        engine.apply(pending_item(1))
+        with pytest.raises(ConnectionError):
+            await WaitEstimator().recompute(collection, engine, "D1")
+        return engine.get("1")
+
+    assert asyncio.run(run()).get("estimated_wait_time") is None
@@ -0,0 +1,68 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, List, Tuple
+from config import PATIENT_UID_BLOCK_SIZE
+
+# Patient UIDs are 11-digit numbers: UID_OFFSET + permute(sequence number)
+UID_OFFSET = 10_000_000_000
+UID_DOMAIN = 90_000_000_000
+
+# Balanced Feistel network over 38-bit values (the smallest even width covering
+# UID_DOMAIN); cycle-walking restricts the permutation to [0, UID_DOMAIN)
+_HALF_BITS = 19
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+def _round_function(key: bytes, round_number: int, value: int) -> int:
+    digest = hashlib.blake2b(bytes([round_number]) + value.to_bytes(3, "big"), key=key, digest_size=4).digest()
+    return int.from_bytes(digest, "big") & _HALF_MASK
+
+
+def _feistel(key: bytes, value: int) -> int:
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for round_number in range(_ROUNDS):
+        left, right = right, left ^ _round_function(key, round_number, right)
+    return (left << _HALF_BITS) | right
+
+
+def permute_uid(key: bytes, sequence: int) -> int:
+    """Map a sequence number to a non-guessable UID; distinct sequences never collide"""
+    if not 0 <= sequence < UID_DOMAIN:
+        raise ValueError("Patient UID space exhausted")
+    value = _feistel(key, sequence)
+    while value >= UID_DOMAIN:
+        value = _feistel(key, value)
+    return UID_OFFSET + value
+
+
+# Reserves `count` consecutive sequence numbers; returns (first sequence, permutation key)
+ReserveBlock = Callable[[int], Awaitable[Tuple[int, bytes]]]
+
+
+class PatientUIDAllocator:
+    """Hands out collision-free patient UIDs from sequence blocks reserved per worker"""
+
+    def __init__(self, reserve_block: ReserveBlock, block_size: int = PATIENT_UID_BLOCK_SIZE):
+        self._reserve_block = reserve_block
+        self.block_size = block_size
+        self._key = b""
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, count: int = 1) -> List[int]:
+        uids: List[int] = []
+        async with self._lock:
+            while len(uids) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(uids))
+                    self._next, self._key = await self._reserve_block(size)
+                    self._end = self._next + size
+                take = min(count - len(uids), self._end - self._next)
+                uids.extend(permute_uid(self._key, sequence) for sequence in range(self._next, self._next + take))
+                self._next += take
+        return uids
+
+    async def next_uid(self) -> int:
+        return (await self.allocate(1))[0]
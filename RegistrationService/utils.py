@@ -1,5 +1,47 @@
-import random
+from datetime import date, datetime, time, timezone
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
 
-def generate_patient_uid():
-    """Generates a random 11-digit patient UID."""
-    return random.randint(100_000_000_00, 999_999_999_99)
+def format_queue_row(row):
+    """Shape a joined queue row the way the print endpoint returns it"""
+    has_patient = "first_name" in row or "last_name" in row
+    return {
+        "queue_number": row["queue_number"],
+        "patient_uid": row["patient_uid"],
+        "patient_name": f"{row.get('first_name', '')} {row.get('last_name', '')}" if has_patient else "Unknown",
+        "status": row["status"],
+        "priority": row["priority"],
+        "appointment_time": row.get("appointment_time"),
+        "created_at": row["created_at"]
+    }
+
+# Fields the models declare as dates; bson_dates stores them as midnight datetimes
+DATE_FIELDS = ("dob",)
+
+def encode_document(document):
+    """JSON-ready copy of a Mongo document, exposing `_id` as `id` like the response models do"""
+    document = {("id" if key == "_id" else key): value for key, value in model_dates(document).items()}
+    return jsonable_encoder(document, custom_encoder={ObjectId: str})
+
+def bson_dates(document):
+    """Copy of a document with date-only values as midnight datetimes, since BSON has no date type"""
+    return {
+        key: datetime.combine(value, time()) if isinstance(value, date) and not isinstance(value, datetime) else value
+        for key, value in document.items()
+    }
+
+def model_dates(document):
+    """The inverse of bson_dates for DATE_FIELDS, so stored documents serialize dates as the models do"""
+    if not any(isinstance(document.get(field), datetime) for field in DATE_FIELDS):
+        return document
+    document = dict(document)
+    for field in DATE_FIELDS:
+        if isinstance(document.get(field), datetime):
+            document[field] = document[field].date()
+    return document
+
+def naive_utc(value):
+    """A datetime as naive UTC, the form stored timestamps take; naive values are assumed to be UTC already"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
@@ -0,0 +1,236 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from app_logging import logger
+from serializers import dumps
+from config import (
+    VITALS_INGEST_QUEUE_SIZE, VITALS_INGEST_BATCH_SIZE,
+    VITALS_INGEST_FLUSH_INTERVAL_MS, VITALS_INGEST_ENQUEUE_TIMEOUT_SECONDS,
+    VITALS_INGEST_MAX_RETRIES, VITALS_INGEST_RETRY_BACKOFF_SECONDS, VITALS_INGEST_DEAD_LETTER_PATH
+)
+
+_FLOAT_FIELDS = ("temperature", "oxygen_saturation", "weight", "height")
+_INT_FIELDS = ("blood_pressure_systolic", "blood_pressure_diastolic", "heart_rate", "respiratory_rate")
+DUPLICATE_KEY_ERROR = 11000
+# Queued by stop(); everything accepted before it is flushed before the flusher exits
+_STOP = object()
+
+
+class IngestBackpressure(Exception):
+    """Raised when the ingest queue stays full for longer than the enqueue timeout"""
+
+
+def _whole_number(name: str, value: Any) -> int:
+    # Like the Vitals model, accept 72 or 72.0 but reject 72.9 rather than truncate it,
+    # since a truncated heart or respiratory rate can change a NEWS2 band
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"{name} must be a whole number")
+    return int(number)
+
+
+def build_vitals_document(reading: Dict[str, Any], recorded_by: str) -> Dict[str, Any]:
+    """Validate one device reading into a vitals document without building Pydantic models"""
+    if not isinstance(reading, dict):
+        raise ValueError("Reading must be a JSON object")
+    patient_uid = reading.get("patient_uid")
+    if not isinstance(patient_uid, int) or isinstance(patient_uid, bool):
+        raise ValueError("patient_uid must be an integer")
+    device_info = reading.get("device_info")
+    if not isinstance(device_info, dict):
+        raise ValueError("device_info must be an object identifying the device")
+
+    document = {
+        "_id": ObjectId(),
+        "patient_uid": patient_uid,
+        "recorded_by": recorded_by,
+        "notes": reading.get("notes"),
+        "device_info": device_info
+    }
+    for name in _FLOAT_FIELDS:
+        value = reading.get(name)
+        document[name] = None if value is None else float(value)
+    for name in _INT_FIELDS:
+        value = reading.get(name)
+        document[name] = None if value is None else _whole_number(name, value)
+
+    # Devices may buffer readings, so honour their own timestamp when given
+    recorded_at = reading.get("recorded_at")
+    document["recorded_at"] = datetime.fromisoformat(recorded_at) if recorded_at else datetime.utcnow()
+    return document
+
+
+class VitalsIngestBuffer:
+    """Bounded queue of readings flushed to Mongo with insert_many on size or time thresholds.
+
+    An accepted reading is never dropped: failed writes are retried with backoff, and readings
+    that still can't be written are appended to a dead-letter NDJSON file for replay.
+    """
+
+    def __init__(self, max_queue: int = VITALS_INGEST_QUEUE_SIZE, batch_size: int = VITALS_INGEST_BATCH_SIZE,
+                 flush_interval_ms: float = VITALS_INGEST_FLUSH_INTERVAL_MS,
+                 enqueue_timeout: float = VITALS_INGEST_ENQUEUE_TIMEOUT_SECONDS,
+                 max_retries: int = VITALS_INGEST_MAX_RETRIES,
+                 retry_backoff: float = VITALS_INGEST_RETRY_BACKOFF_SECONDS,
+                 dead_letter_path: str = VITALS_INGEST_DEAD_LETTER_PATH):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letter_path = dead_letter_path
+        self._queue: Optional[asyncio.Queue] = None
+        self._collection = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.accepted = 0
+        self.inserted = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.flushes = 0
+        self.backpressure_events = 0
+        self.started_at = time.monotonic()
+
+    def start(self, collection):
+        self._collection = collection
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, document: Dict[str, Any]):
+        """Enqueue a reading, waiting while the queue is full; callers stop reading input meanwhile"""
+        if self._queue is None or self._stopping:
+            raise RuntimeError("Vitals ingest buffer is not running")
+        try:
+            await asyncio.wait_for(self._queue.put(document), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.backpressure_events += 1
+            raise IngestBackpressure("Vitals ingest queue is full")
+        self.accepted += 1
+
+    async def _next_batch(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """The next batch, and whether stop() was reached.
+
+        Only the first reading is awaited with get(); the rest are taken with get_nowait, so
+        no reading can be lost to a cancelled get() when the flush deadline passes.
+        """
+        first = await self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            while len(batch) < self.batch_size and not self._queue.empty():
+                document = self._queue.get_nowait()
+                if document is _STOP:
+                    return batch, True
+                batch.append(document)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or len(batch) >= self.batch_size:
+                break
+            await asyncio.sleep(min(remaining, 0.01))
+        return batch, False
+
+    async def _insert(self, batch: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """One insert_many attempt; returns (readings to retry, readings that can never be written)"""
+        try:
+            await self._collection.insert_many(batch, ordered=False)
+            self.inserted += len(batch)
+            return [], []
+        except BulkWriteError as e:
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            # After a write concern error it's unknown whether the rest were written, so they are retried
+            uncertain = bool(e.details.get("writeConcernErrors"))
+            retry, rejected = [], []
+            for index, document in enumerate(batch):
+                error = errors.get(index)
+                if error is not None and error.get("code") != DUPLICATE_KEY_ERROR:
+                    rejected.append({**document, "error": error.get("errmsg")})
+                elif uncertain:
+                    retry.append(document)
+                else:
+                    # Readings carry their own _id, so a duplicate means an earlier attempt already wrote it
+                    self.inserted += 1
+            return retry, rejected
+        except Exception:
+            logger.exception("Error flushing vitals readings", extra={"readings": len(batch)})
+            return batch, []
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        """Write a batch, retrying failures with exponential backoff before dead-lettering them"""
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            pending, rejected = await self._insert(pending)
+            if rejected:
+                await self._dead_letter(rejected, "rejected by the database")
+            if not pending:
+                break
+        else:
+            await self._dead_letter(pending, f"still failing after {self.max_retries} retries")
+        self.flushes += 1
+
+    async def _dead_letter(self, documents: List[Dict[str, Any]], reason: str):
+        """Append readings that could not be written to the dead-letter file, one JSON object per line"""
+        lines = b"".join(dumps(document) + b"\n" for document in documents)
+        # The file write runs off the event loop so a slow disk doesn't stall requests
+        await asyncio.to_thread(self._append_dead_letters, lines)
+        self.dead_lettered += len(documents)
+        logger.error("Vitals readings dead-lettered", extra={
+            "readings": len(documents), "reason": reason, "path": self.dead_letter_path
+        })
+
+    def _append_dead_letters(self, lines: bytes):
+        with open(self.dead_letter_path, "ab") as f:
+            f.write(lines)
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def stop(self):
+        """Flush every accepted reading, then stop the flusher"""
+        if self._task is None:
+            return
+        self._stopping = True
+        # Queued behind every accepted reading, so the flusher writes them all before exiting
+        await self._queue.put(_STOP)
+        await self._task
+        # Submissions that were already waiting for space when stop() began
+        remaining = []
+        while not self._queue.empty():
+            document = self._queue.get_nowait()
+            if document is not _STOP:
+                remaining.append(document)
+        for i in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[i:i + self.batch_size])
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "accepted": self.accepted,
+            "inserted": self.inserted,
+            "retries": self.retries,
+            "dead_lettered": self.dead_lettered,
+            "flushes": self.flushes,
+            "avg_batch_size": round(self.inserted / self.flushes, 1) if self.flushes else 0.0,
+            "backpressure_events": self.backpressure_events,
+            "throughput_per_second": round(self.inserted / elapsed, 2)
+        }
+
+
+vitals_ingest_buffer = VitalsIngestBuffer()
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import numpy as np
+
+# Numeric vitals fields summarised per time bucket
+SERIES_FIELDS = [
+    "temperature",
+    "blood_pressure_systolic",
+    "blood_pressure_diastolic",
+    "heart_rate",
+    "respiratory_rate",
+    "oxygen_saturation",
+    "weight",
+    "height"
+]
+
+MAX_SERIES_BUCKETS = 5000
+# Raw readings loaded for one series; longer ranges must be requested in pieces
+MAX_SERIES_READINGS = 100000
+
+
+def to_arrays(documents: List[Dict[str, Any]]):
+    """Column arrays for a list of vitals documents; missing readings become NaN"""
+    times = np.array([document["recorded_at"] for document in documents], dtype="datetime64[ms]")
+    columns = {
+        name: np.array([document.get(name) for document in documents], dtype=float)
+        for name in SERIES_FIELDS
+    }
+    return times, columns
+
+
+def aggregate_series(times: np.ndarray, columns: Dict[str, np.ndarray], start: datetime,
+                     bucket: timedelta) -> List[Dict[str, Any]]:
+    """Min/mean/max of every field per time bucket, for readings sorted by time"""
+    if len(times) == 0:
+        return []
+
+    bucket_ms = int(bucket.total_seconds() * 1000)
+    offsets = (times - np.datetime64(start, "ms")).astype(np.int64)
+    bucket_index = offsets // bucket_ms
+
+    occupied, counts = np.unique(bucket_index, return_counts=True)
+    buckets = {
+        int(index): {"start": start + bucket * int(index), "count": int(count)}
+        for index, count in zip(occupied, counts)
+    }
+
+    for name, values in columns.items():
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        valid_values = values[valid]
+        valid_index = bucket_index[valid]
+        # Readings are time-ordered, so each bucket is a contiguous run and reduceat applies
+        run_starts = np.flatnonzero(np.r_[True, np.diff(valid_index) != 0])
+        run_lengths = np.diff(np.r_[run_starts, len(valid_values)])
+        minimums = np.minimum.reduceat(valid_values, run_starts)
+        maximums = np.maximum.reduceat(valid_values, run_starts)
+        means = np.add.reduceat(valid_values, run_starts) / run_lengths
+        for index, low, mean, high in zip(valid_index[run_starts], minimums, means, maximums):
+            buckets[int(index)][name] = {
+                "min": float(low),
+                "mean": round(float(mean), 2),
+                "max": float(high)
+            }
+
+    return [buckets[index] for index in sorted(buckets)]
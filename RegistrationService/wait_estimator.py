@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set
+import numpy as np
+from pymongo import UpdateOne
+from models import StatusEnum
+from queue_engine import call_order, queue_day_today
+from app_logging import logger
+from config import (
+    WAIT_ESTIMATE_EWMA_ALPHA, WAIT_ESTIMATE_DEFAULT_SERVICE_MINUTES,
+    WAIT_ESTIMATE_DEBOUNCE_SECONDS, WAIT_ESTIMATE_HISTORY_DAYS
+)
+
+# Fields needed to put a doctor's pending items in call order
+WAIT_PROJECTION = {"_id": 1, "priority": 1, "created_at": 1, "queue_day": 1, "queue_number": 1, "estimated_wait_time": 1}
+
+
+def estimate_waits(service_minutes: float, pending: int, current_elapsed_minutes: Optional[float]) -> np.ndarray:
+    """Minutes until each of `pending` patients (in call order) is called.
+
+    Everyone waits for the rest of the consultation in progress, if any, plus one
+    average consultation per patient ahead of them.
+    """
+    remaining = 0.0
+    if current_elapsed_minutes is not None:
+        remaining = max(service_minutes - current_elapsed_minutes, 0.0)
+    return np.ceil(remaining + np.arange(pending) * service_minutes).astype(np.int64)
+
+
+class WaitEstimator:
+    """Rolling per-doctor consultation times and the wait estimates derived from them"""
+
+    def __init__(self, alpha: float = WAIT_ESTIMATE_EWMA_ALPHA,
+                 default_minutes: float = WAIT_ESTIMATE_DEFAULT_SERVICE_MINUTES,
+                 debounce_seconds: float = WAIT_ESTIMATE_DEBOUNCE_SECONDS):
+        self.alpha = alpha
+        self.default_minutes = default_minutes
+        self.debounce_seconds = debounce_seconds
+        self._service_minutes: Dict[str, float] = {}
+        self._samples: Dict[str, int] = {}
+        self._dirty: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self.recomputes = 0
+        self.items_written = 0
+
+    def service_minutes(self, doctor_id: str) -> float:
+        return self._service_minutes.get(doctor_id, self.default_minutes)
+
+    def observe(self, doctor_id: str, called_at: Optional[datetime], served_at: Optional[datetime]):
+        """Fold one completed consultation into the doctor's moving average"""
+        if called_at is None or served_at is None or served_at <= called_at:
+            return
+        minutes = (served_at - called_at).total_seconds() / 60
+        previous = self._service_minutes.get(doctor_id)
+        self._service_minutes[doctor_id] = minutes if previous is None else (
+            self.alpha * minutes + (1 - self.alpha) * previous
+        )
+        self._samples[doctor_id] = self._samples.get(doctor_id, 0) + 1
+
+    async def load_history(self, queue_collection, days: float = WAIT_ESTIMATE_HISTORY_DAYS) -> int:
+        """Seed the averages from recently completed items, oldest first"""
+        loaded = 0
+        cursor = queue_collection.find(
+            {"status": StatusEnum.COMPLETED, "served_at": {"$gte": datetime.utcnow() - timedelta(days=days)}},
+            {"_id": 0, "doctor_id": 1, "called_at": 1, "served_at": 1}
+        ).sort("served_at", 1)
+        async for queue_item in cursor:
+            self.observe(queue_item["doctor_id"], queue_item.get("called_at"), queue_item.get("served_at"))
+            loaded += 1
+        return loaded
+
+    def mark_dirty(self, doctor_id: str):
+        """Schedule a recompute of the doctor's estimates; bursts of changes are coalesced"""
+        self._dirty.add(doctor_id)
+        self._wakeup.set()
+
+    async def recompute(self, queue_collection, queue_engine, doctor_id: str) -> int:
+        """Estimate every pending item of a doctor in one pass and write the changed ones back.
+
+        Positions come from the doctor's pending items as stored, not from this worker's call
+        order, which can lag behind writes made through other workers.
+        """
+        pending = await queue_collection.find(
+            {"doctor_id": doctor_id, "status": StatusEnum.PENDING, "queue_day": queue_day_today()}, WAIT_PROJECTION
+        ).to_list(length=None)
+        if not pending:
+            return 0
+        pending = [pending[position] for position in call_order(pending, queue_engine.aging_seconds, queue_engine.max_promotion)]
+
+        current = await queue_collection.find_one(
+            {"doctor_id": doctor_id, "status": StatusEnum.IN_PROGRESS, "called_at": {"$ne": None}},
+            {"called_at": 1},
+            sort=[("called_at", -1)]
+        )
+        elapsed = None
+        if current is not None:
+            elapsed = (datetime.utcnow() - current["called_at"]).total_seconds() / 60
+
+        waits = estimate_waits(self.service_minutes(doctor_id), len(pending), elapsed).tolist()
+        changed = [(queue_item, wait) for queue_item, wait in zip(pending, waits) if queue_item.get("estimated_wait_time") != wait]
+        if changed:
+            # Only items still pending get an estimate; one called or served meanwhile is left alone
+            await queue_collection.bulk_write([
+                UpdateOne({"_id": queue_item["_id"], "status": StatusEnum.PENDING}, {"$set": {"estimated_wait_time": wait}})
+                for queue_item, wait in changed
+            ], ordered=False)
+            for queue_item, wait in changed:
+                # Mirror the write onto the item as this worker last saw it, if it is still pending
+                in_memory = queue_engine.get(str(queue_item["_id"]))
+                if in_memory is not None:
+                    queue_engine.apply({**in_memory, "estimated_wait_time": wait})
+        self.recomputes += 1
+        self.items_written += len(changed)
+        return len(changed)
+
+    async def run(self, queue_collection, queue_engine):
+        """Background loop recomputing doctors marked dirty"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.debounce_seconds)
+            self._wakeup.clear()
+            doctor_ids, self._dirty = self._dirty, set()
+            for doctor_id in doctor_ids:
+                try:
+                    await self.recompute(queue_collection, queue_engine, doctor_id)
+                except Exception:
+                    logger.exception("Error estimating wait times", extra={"doctor_id": doctor_id})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "doctors_tracked": len(self._service_minutes),
+            "pending_recomputes": len(self._dirty),
+            "recomputes": self.recomputes,
+            "items_written": self.items_written
+        }
+
+
+wait_estimator = WaitEstimator()